@@ -11,18 +11,37 @@ import base64
 import json
 import os
 from datetime import datetime
-from db_manager import db_manager, SessionLocal
-from camera_manager import camera_manager, get_all_camera_configs
-from tracking_manager import tracking_manager
+from db_manager import db_manager, db_writer, SessionLocal
+from camera_manager import camera_manager, get_all_camera_configs, get_camera_config, LatestFrameGrabber
+from tracking_manager import tracking_manager, OpticalFlowTracker, IdentityCache, FaceTracker
+from face_gallery import EmployeeGallery, INDEX_EXACT
+from inference_backend import create_face_analysis, face_analysis_options, FaceAnalyzer
+from inference_scheduler import InferenceScheduler
+from stream_control import FrameRateController, MotionGate
+from detection_regions import DetectionRegions, DetectionSizeSelector
 
 # Default system specifications (ditingkatkan untuk konsistensi ID tracking dan re-identification)
 DEFAULT_SYSTEM_SPECS = {
     "model": "InsightFace (Buffalo_L)",
     "detection_threshold": 0.5,
     "detection_size": (320, 320),
+    "detection_size_mode": "fixed",  # fixed = detection_size (atau "detection_size" per kamera), auto = pilih otomatis per kamera
+    "detection_sizes": [(320, 320), (480, 480), (640, 640)],  # Kandidat ukuran deteksi untuk mode auto
+    "detection_min_face_px": 24,  # Tinggi wajah minimum (piksel input detector) agar recall terjaga
+    "detection_size_probe_s": 30.0,  # Mode auto: interval deteksi pada ukuran terbesar untuk mencari wajah kecil
     "recognition_cooldown": 10,  # detik
-    "bbox_smoothing_factor": 0.85,  # Ditingkatkan untuk tracking yang lebih smooth
+    "bbox_smoothing_factor": 0.85,  # Ditingkatkan untuk tracking yang lebih smooth (hanya untuk track_motion_model "smoothing")
     "providers": "CUDAExecutionProvider, CPUExecutionProvider",
+    "insightface_modules": ["detection", "recognition"],  # Model InsightFace yang dimuat ("all" = semua, termasuk landmark & gender/age)
+    "ctx_id": "auto",  # "auto" = GPU hanya jika CUDAExecutionProvider tersedia, -1 = paksa CPU
+    "ort_intra_op_threads": 0,  # Thread per operator onnxruntime (0 = default, satu per core fisik)
+    "ort_inter_op_threads": 0,  # Thread antar operator (hanya dipakai pada execution mode "parallel")
+    "ort_execution_mode": "sequential",  # sequential / parallel
+    "ort_graph_optimization": "all",  # disable / basic / extended / all
+    "ort_allow_spinning": True,  # False = thread tidak busy-wait di antara frame (CPU lebih hemat)
+    "ort_thread_affinities": "",  # Pinning thread ke core, format onnxruntime "1,2;3,4"
+    "detector_model_path": "",  # File ONNX detector alternatif (misal hasil kuantisasi INT8), kosong = bawaan pack
+    "recognizer_model_path": "",  # File ONNX recognizer alternatif (misal hasil kuantisasi INT8)
     "fps_target": 30,
     "frame_skip": False,
     "multi_person": True,
@@ -32,7 +51,61 @@ DEFAULT_SYSTEM_SPECS = {
     "tracking_timeout": 3.0,         # Ditingkatkan dari 1.0 detik untuk mempertahankan ID lebih lama
     "movement_threshold": 5,
     # Re-identification parameters
-    "embedding_similarity_threshold": 0.7  # Threshold untuk matching berbasis embedding
+    "embedding_similarity_threshold": 0.7,  # Threshold untuk matching berbasis embedding
+    "track_motion_model": "kalman",   # "kalman" (prediksi kecepatan konstan) atau "smoothing" (bbox_smoothing_factor)
+    "kalman_process_noise": 2000.0,   # Variasi percepatan (px^2/s^3); lebih besar = lebih cepat mengikuti perubahan arah
+    "kalman_measurement_noise": 4.0,  # Jitter bbox detector (px)
+    "kalman_gate_sigma": 4.0,         # Deteksi dicocokkan jika dalam N standar deviasi dari posisi prediksi (maks. max_distance_threshold)
+    "kalman_max_predict_s": 1.0,      # Track yang tidak terdeteksi diekstrapolasi maksimal N detik
+    "tracker_record_dir": "",         # Jika diisi, deteksi per kamera direkam (JSON lines) untuk replay_tracker.py
+    # Employee gallery lookup
+    "gallery_index": "exact",         # "exact" (dense scan) atau "ivf" (approximate, untuk roster besar)
+    "gallery_ann_min_size": 2000,     # IVF hanya dipakai jika jumlah karyawan >= nilai ini
+    "gallery_ivf_nlist": None,        # Jumlah cell IVF (None = sqrt(jumlah karyawan))
+    "gallery_ivf_nprobe": 8,          # Jumlah cell yang diperiksa per wajah
+    "gallery_rerank_k": 32,           # Kandidat IVF yang di-rerank dengan centroid + semua sampel
+    # Write-behind database writer untuk status dan lokasi karyawan
+    "db_flush_interval_ms": 500,      # Flush ke database setiap N ms
+    "db_flush_max_events": 500,       # ... atau setiap M event, mana yang lebih dulu
+    "dwell_gap_seconds": 30,          # Jeda maksimum antar deteksi di kamera yang sama dalam satu interval lokasi
+    "dwell_checkpoint_seconds": 60,   # Interval lokasi yang masih terbuka disimpan setiap N detik
+    # Frame capture (thread pembaca terpisah per kamera)
+    "capture_buffer_size": 1,         # Jumlah frame terbaru yang disimpan; frame lama dibuang
+    # Inference scheduler bersama untuk semua kamera
+    "inference_workers": 1,           # Jumlah worker, masing-masing dengan sesi InsightFace sendiri
+    "inference_max_batch": 8,         # Maksimum frame (dari beberapa kamera) per batch
+    "inference_batch_wait_ms": 5,     # Waktu tunggu frame kamera lain sebelum batch dijalankan
+    # Pengaturan laju frame per kamera (menggantikan sleep tetap dan frame_skip % 3)
+    "inference_fps": 10,              # Target frame per detik yang dianalisis AI
+    "display_fps": 30,                # Target frame per detik yang dikirim ke preview
+    # Profil preview: frame ber-anotasi diperkecil setelah inferensi, lalu di-encode sekali per profil
+    "preview_profiles": {
+        "thumbnail": {"width": 320, "quality": 50},   # Grid kamera
+        "focus": {"width": 1280, "quality": 80},      # Tampilan satu kamera
+        "full": {"width": 0, "quality": 95}           # Resolusi kamera (width 0 = tanpa resize)
+    },
+    "preview_default_profile": "focus",  # Dapat di-override per kamera ("preview_profiles" di config kamera)
+    # "client": kotak & label dikirim sebagai metadata (event camera_detections) dan digambar browser di canvas;
+    # "burned": kotak & label digambar langsung di frame (cv2.putText / cv2.rectangle)
+    "preview_overlay": "client",
+    "stream_keep_alive": True,        # Stream tetap diproses (tanpa overlay/encode) setelah penonton terakhir keluar
+    "static_scene_threshold": 2.0,    # Rata-rata selisih piksel (thumbnail abu-abu) di bawah ini = scene statis
+    "static_scene_refresh_s": 2.0,    # Scene statis tetap dianalisis minimal setiap N detik
+    # Motion gate: deteksi wajah hanya saat ada gerakan (menggantikan pengecekan scene statis)
+    "motion_gate": True,
+    "motion_sensitivity": 0.5,        # 0..1, dapat di-override per kamera ("motion_sensitivity" di config kamera)
+    "motion_hold_s": 2.0,             # Tetap mendeteksi N detik setelah gerakan terakhir
+    "motion_idle_refresh_s": 10.0,    # Tanpa gerakan, deteksi tetap berjalan setiap N detik
+    # Detect-then-track: deteksi + embedding penuh hanya pada keyframe
+    "tracking_mode": "detect",        # "detect" (setiap frame) atau "detect_then_track"
+    "keyframe_interval": 5,           # Keyframe setiap N frame yang dianalisis
+    "track_confidence_decay": 0.98,   # Kepercayaan identitas dikali faktor ini (dan kualitas flow) per frame tracking
+    "track_reembed_confidence": 0.35, # Di bawah ini track dipaksa dideteksi ulang pada frame berikutnya
+    # Identity lock per track: lewati embedding untuk track yang sudah pasti
+    "identity_lock_after": 5,         # Kunci identitas setelah K pengenalan berturut-turut dengan nama sama (0 = nonaktif)
+    "identity_reverify_interval": 10.0,  # Verifikasi ulang identitas yang terkunci setiap N detik
+    "identity_lock_iou": 0.5,         # IoU minimum antara deteksi dan kotak track yang terkunci
+    "identity_appearance_threshold": 0.5  # Perubahan tampilan wajah (thumbnail) di atas ini memaksa embedding ulang
 }
 
 def load_system_specs():
@@ -63,17 +136,15 @@ def log_attendance(name: str):
 class FaceRecognitionSystem:
     def __init__(self):
         # Inisialisasi InsightFace dengan GPU acceleration jika tersedia
-        import insightface
-        providers = ['CUDAExecutionProvider', 'CPUExecutionProvider']  # Prioritaskan CUDA
-        self.app = insightface.app.FaceAnalysis(providers=providers)
-        # Gunakan ukuran deteksi dari konfigurasi
+        # Provider, ukuran deteksi, model dan opsi onnxruntime diambil dari konfigurasi
         SYSTEM_SPECS = load_system_specs()
-        det_size = SYSTEM_SPECS['detection_size']
-        self.app.prepare(ctx_id=0, det_size=det_size)
+        self.system_specs = SYSTEM_SPECS
+        self.app = create_face_analysis(**face_analysis_options(SYSTEM_SPECS))
         
         # Load employees data
         self.known_employees = []
         self.known_employees_with_id = []
+        self.gallery = EmployeeGallery()
         self.load_employees()
         
     def get_embeddings(self, frame):
@@ -83,9 +154,28 @@ class FaceRecognitionSystem:
     
     def load_employees(self):
         """Load data karyawan dari database"""
-        self.known_employees = db_manager.get_all_employees()
-        self.known_employees_with_id = db_manager.get_all_employees_with_id()
-        print(f"[INFO] Loaded {len(self.known_employees)} karyawan dari database")
+        roster = db_manager.load_roster()
+        if roster is None:
+            return
+        self.known_employees = roster.employees()
+        self.known_employees_with_id = roster.employees_with_id()
+        # Rebuild the gallery and swap it in one assignment so running streams never see a partial roster
+        self.gallery = self.build_gallery(roster)
+        print(f"[INFO] Loaded {len(roster)} karyawan ({len(roster.samples)} sampel embedding, roster v{roster.version}) dari database")
+    
+    def build_gallery(self, roster):
+        """Build the employee gallery using the lookup index configured in SYSTEM_SPECS"""
+        specs = self.system_specs
+        gallery = EmployeeGallery(
+            index_type=specs.get('gallery_index', INDEX_EXACT),
+            ann_min_size=specs.get('gallery_ann_min_size', 2000),
+            nlist=specs.get('gallery_ivf_nlist'),
+            nprobe=specs.get('gallery_ivf_nprobe', 8),
+            rerank_k=specs.get('gallery_rerank_k', 32)
+        ).build_from_arrays(roster.ids, roster.names, roster.embeddings, roster.sample_ids, roster.samples)
+        if gallery.index is not None:
+            print(f"[INFO] Gallery IVF index aktif ({len(gallery.index.centroids)} cells, nprobe={gallery.nprobe})")
+        return gallery
 
 class AIProcessingModule:
     def __init__(self):
@@ -95,10 +185,20 @@ class AIProcessingModule:
         self.employee_status_tracker = None
         self.processing_thread = None
         self.absence_check_thread = None
+        self.inference_scheduler = None
+        self.scheduler_lock = threading.Lock()
         
         # Load system specifications
         self.system_specs = load_system_specs()
         
+        # Detection side effects (status, location) go through the write-behind writer
+        db_writer.configure(
+            flush_interval_ms=self.system_specs.get('db_flush_interval_ms', 500),
+            max_batch_events=self.system_specs.get('db_flush_max_events', 500),
+            dwell_gap_seconds=self.system_specs.get('dwell_gap_seconds', 30),
+            dwell_checkpoint_seconds=self.system_specs.get('dwell_checkpoint_seconds', 60)
+        )
+        
         # Employee absence tracking
         self.employee_last_seen = {}  # {employee_name: timestamp}
         self.absence_threshold = 300  # 5 minutes in seconds
@@ -137,6 +237,7 @@ class AIProcessingModule:
                 self.face_recognition_system.load_employees()
             
             # Start background threads
+            db_writer.start()
             self.processing_thread = threading.Thread(target=self._background_processing_loop)
             self.processing_thread.daemon = True
             self.processing_thread.start()
@@ -161,23 +262,65 @@ class AIProcessingModule:
                 self.processing_thread.join(timeout=5)
             if self.absence_check_thread:
                 self.absence_check_thread.join(timeout=5)
+            
+            # Stop the shared inference workers
+            with self.scheduler_lock:
+                if self.inference_scheduler:
+                    self.inference_scheduler.stop()
+                    self.inference_scheduler = None
+            
+            # Flush queued status/location events
+            db_writer.stop()
                 
             return True
         return False
     
-    def start_stream(self, camera_id, rtsp_url, frame_callback=None):
-        """Start face recognition processing for a camera stream - background processing"""
+    def start_stream(self, camera_id, rtsp_url, frame_callback=None, viewer_count=None, detections_callback=None):
+        """Start face recognition processing for a camera stream - background processing
+        
+        frame_callback receives each annotated preview frame (BGR ndarray at
+        camera resolution; scaling and JPEG encoding per preview profile are
+        left to the receiver), or the string "Camera Unavailable" when the
+        camera cannot be read.
+        viewer_count, when given, returns how many clients watch the preview;
+        while it is 0 the stream runs headless (recognition and attendance
+        continue, but no overlay is drawn and nothing is encoded).
+        detections_callback, when given, receives the overlay metadata of every
+        analysed frame (see _detections_metadata), with or without viewers.
+        With "preview_overlay": "client" the preview frames carry no burned-in
+        boxes or labels; clients draw them from this metadata.
+        """
         try:
             print(f"[AI MODULE] Starting stream for camera: {camera_id}")
             
             # Stop any existing stream for this camera
             self.stop_stream(camera_id)
             
+            # Dedicated reader thread: keeps only the newest frames so inference never lags behind the camera
+            def report_camera_error():
+                if frame_callback:
+                    frame_callback("Camera Unavailable")
+            
+            grabber = LatestFrameGrabber(
+                camera_id,
+                rtsp_url,
+                buffer_size=self.system_specs.get('capture_buffer_size', 1),
+                on_error=report_camera_error
+            ).start()
+            camera_config = get_camera_config(camera_id)
+            rate_controller = self.create_rate_controller(camera_config)
+            motion_tracker = OpticalFlowTracker()
+            identity_cache = self.create_identity_cache()
+            detection_regions = self.create_detection_regions(camera_id, camera_config)
+            size_selector = DetectionSizeSelector.from_config(camera_config, self.system_specs)
+            tracker = self.create_tracker(camera_id)
+            
             # Start processing in a separate thread
             stop_event = threading.Event()
             thread = threading.Thread(
                 target=self._process_stream, 
-                args=(camera_id, rtsp_url, stop_event, frame_callback), 
+                args=(camera_id, rtsp_url, stop_event, frame_callback, grabber, rate_controller, motion_tracker,
+                      identity_cache, detection_regions, size_selector, tracker, viewer_count, detections_callback), 
                 daemon=True
             )
             thread.start()
@@ -185,8 +328,17 @@ class AIProcessingModule:
             self.active_streams[camera_id] = {
                 'thread': thread,
                 'stop_event': stop_event,
+                'grabber': grabber,
+                'rate_controller': rate_controller,
+                'motion_tracker': motion_tracker,
+                'identity_cache': identity_cache,
+                'detection_regions': detection_regions,
+                'size_selector': size_selector,
+                'tracker': tracker,
                 'rtsp_url': rtsp_url,
-                'frame_callback': frame_callback
+                'frame_callback': frame_callback,
+                'viewer_count': viewer_count,
+                'detections_callback': detections_callback
             }
             
             print(f"[AI MODULE] Started background face recognition for camera {camera_id}")
@@ -208,6 +360,7 @@ class AIProcessingModule:
         if camera_id in self.active_streams:
             try:
                 self.active_streams[camera_id]['stop_event'].set()
+                self.active_streams[camera_id]['grabber'].stop()
                 self.active_streams[camera_id]['thread'].join(timeout=5)
                 del self.active_streams[camera_id]
             except Exception as e:
@@ -219,9 +372,122 @@ class AIProcessingModule:
         for camera_id in camera_ids:
             self.stop_stream(camera_id)
     
-    def _process_stream(self, camera_id, rtsp_url, stop_event, frame_callback=None):
-        """Process video stream and perform face recognition in background"""
-        cap = None
+    def get_inference_scheduler(self):
+        """Return the inference scheduler shared by all camera streams, starting it on first use"""
+        with self.scheduler_lock:
+            if self.inference_scheduler is None or not self.inference_scheduler.is_running():
+                system = self.face_recognition_system
+                analysis_options = face_analysis_options(self.system_specs)
+                
+                def analyzer_factory(worker_index):
+                    # Worker 0 reuses the already loaded model; every other worker loads its own sessions
+                    if worker_index == 0:
+                        return FaceAnalyzer(system.app)
+                    return FaceAnalyzer(create_face_analysis(report=False, **analysis_options))
+                
+                self.inference_scheduler = InferenceScheduler(
+                    analyzer_factory,
+                    num_workers=self.system_specs.get('inference_workers', 1),
+                    max_batch_size=self.system_specs.get('inference_max_batch', 8),
+                    max_wait_ms=self.system_specs.get('inference_batch_wait_ms', 5)
+                ).start()
+            return self.inference_scheduler
+    
+    def get_inference_stats(self):
+        """Batching and latency statistics of the shared inference scheduler"""
+        scheduler = self.inference_scheduler
+        return scheduler.get_metrics() if scheduler else {}
+    
+    def create_rate_controller(self, camera_config=None):
+        """Per-camera inference/display pacing from SYSTEM_SPECS (motion gate settings may be set per camera)"""
+        specs = self.system_specs
+        camera_config = camera_config or {}
+        motion_gate = None
+        if camera_config.get('motion_gate', specs.get('motion_gate', True)):
+            motion_gate = MotionGate(
+                sensitivity=camera_config.get('motion_sensitivity', specs.get('motion_sensitivity', 0.5)),
+                hold_s=specs.get('motion_hold_s', 2.0),
+                idle_refresh_s=specs.get('motion_idle_refresh_s', 10.0)
+            )
+        fps_target = specs.get('fps_target', 30)
+        # Older configs only have fps_target/frame_skip: frame_skip meant "analyse every 3rd frame"
+        inference_fps = specs.get('inference_fps') or (fps_target / 3.0 if specs.get('frame_skip', False) else fps_target)
+        return FrameRateController(
+            inference_fps=inference_fps,
+            display_fps=specs.get('display_fps') or fps_target,
+            static_threshold=specs.get('static_scene_threshold', 2.0),
+            static_refresh_s=specs.get('static_scene_refresh_s', 2.0),
+            motion_gate=motion_gate
+        )
+    
+    def get_rate_stats(self):
+        """Achieved vs. target inference and display rates per active camera"""
+        return {camera_id: stream['rate_controller'].get_stats()
+                for camera_id, stream in list(self.active_streams.items())}
+    
+    def create_identity_cache(self):
+        """Per-camera identity locks from SYSTEM_SPECS (identity_lock_after = 0 disables locking)"""
+        specs = self.system_specs
+        return IdentityCache(
+            lock_after=specs.get('identity_lock_after', 5),
+            reverify_interval=specs.get('identity_reverify_interval', 10.0),
+            match_iou=specs.get('identity_lock_iou', 0.5),
+            appearance_threshold=specs.get('identity_appearance_threshold', 0.5),
+            recognition_threshold=specs.get('recognition_threshold', specs.get('detection_threshold', 0.5))
+        )
+    
+    def get_identity_stats(self):
+        """Embeddings run vs. skipped and per-track lock state per active camera"""
+        return {camera_id: stream['identity_cache'].get_stats()
+                for camera_id, stream in list(self.active_streams.items())}
+    
+    def create_tracker(self, camera_id):
+        """Per-camera FaceTracker; with "tracker_record_dir" set its detections are recorded for replay_tracker.py"""
+        tracker = FaceTracker.from_specs(self.system_specs)
+        record_dir = self.system_specs.get('tracker_record_dir', "")
+        if record_dir:
+            try:
+                os.makedirs(record_dir, exist_ok=True)
+                path = os.path.join(record_dir, f"{camera_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl")
+                tracker.start_recording(path)
+                print(f"[AI MODULE] Recording detections of camera {camera_id} to {path}")
+            except OSError as e:
+                print(f"[AI MODULE] Cannot record detections of camera {camera_id}: {e}")
+        return tracker
+    
+    def get_tracking_stats(self):
+        """Keyframe / tracked-frame counters of the detect-then-track mode and track counts per active camera"""
+        return {camera_id: dict(stream['motion_tracker'].get_stats(), tracks=stream['tracker'].get_stats())
+                for camera_id, stream in list(self.active_streams.items())}
+    
+    def create_detection_regions(self, camera_id, camera_config=None):
+        """Regions of interest from camera_configs/<CAM>/config.json or cam_info.json ("roi"), or None"""
+        try:
+            return DetectionRegions.from_config(camera_config or get_camera_config(camera_id))
+        except Exception as e:
+            print(f"[AI MODULE] Invalid ROI config for camera {camera_id}: {e}")
+            return None
+    
+    def get_region_stats(self):
+        """Regions of interest and detector input size per active camera (cameras without ROI omitted)"""
+        return {camera_id: stream['detection_regions'].get_stats()
+                for camera_id, stream in list(self.active_streams.items()) if stream.get('detection_regions')}
+    
+    def get_detection_size_stats(self):
+        """Detector input size mode, current size and face-size samples per active camera"""
+        return {camera_id: stream['size_selector'].get_stats()
+                for camera_id, stream in list(self.active_streams.items())}
+    
+    def get_capture_stats(self):
+        """Captured / dropped / processed frame counters per active camera"""
+        return {camera_id: stream['grabber'].get_stats()
+                for camera_id, stream in list(self.active_streams.items())}
+    
+    def _process_stream(self, camera_id, rtsp_url, stop_event, frame_callback=None, grabber=None, rate_controller=None,
+                        motion_tracker=None, identity_cache=None, detection_regions=None, size_selector=None,
+                        tracker=None, viewer_count=None, detections_callback=None):
+        """Process frames from the camera's frame grabber and perform face recognition in background"""
+        owns_grabber = grabber is None
         try:
             # Initialize face recognition system if needed
             if not self.initialize_model():
@@ -238,331 +504,186 @@ class AIProcessingModule:
             if not hasattr(system, 'known_employees') or not system.known_employees:
                 system.load_employees()
             
+            # Detection and embedding run on the shared worker pool, batched with other cameras
+            scheduler = self.get_inference_scheduler()
+            
             # Get system specifications (using the same approach as main.py)
             SYSTEM_SPECS = self.system_specs
             
             # Apply parameters from main.py implementation
             recognition_cooldown = SYSTEM_SPECS.get('recognition_cooldown', 10)
-            smoothing_factor = SYSTEM_SPECS.get('bbox_smoothing_factor', 0.85)
-            max_distance_threshold = SYSTEM_SPECS.get('max_distance_threshold', 150)
             tracking_timeout = SYSTEM_SPECS.get('tracking_timeout', 3.0)
-            embedding_similarity_threshold = SYSTEM_SPECS.get('embedding_similarity_threshold', 0.7)
-            fps_target = SYSTEM_SPECS.get('fps_target', 30)
-            frame_skip = SYSTEM_SPECS.get('frame_skip', False)
             
             # Get detection parameters
             detection_threshold = SYSTEM_SPECS.get('detection_threshold', 0.5)
             multi_person = SYSTEM_SPECS.get('multi_person', True)
             
-            # Calculate frame delay based on target FPS
-            frame_delay = 1.0 / fps_target if fps_target > 0 else 0.033  # Default to ~30 FPS
+            # Boxes and labels: burned into the preview frame, or sent as metadata for the client to draw
+            burn_overlay = SYSTEM_SPECS.get('preview_overlay', 'client') == 'burned'
+            overlay_threshold = SYSTEM_SPECS.get('recognition_threshold', SYSTEM_SPECS['detection_threshold'])
             
-            # Open video stream (RTSP or webcam)
-            if rtsp_url.isdigit():
-                # Webcam input
-                camera_index = int(rtsp_url)
-                cap = cv2.VideoCapture(camera_index)
-            else:
-                # RTSP stream
-                cap = cv2.VideoCapture(rtsp_url)
+            # Inference and preview rates are paced per camera (no fixed sleep after processing)
+            if rate_controller is None:
+                rate_controller = self.create_rate_controller()
             
-            # Set buffer size to reduce latency
-            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+            # Frames come from the camera's reader thread (opened, reconnected and drained there)
+            if grabber is None:
+                grabber = LatestFrameGrabber(
+                    camera_id, rtsp_url, buffer_size=SYSTEM_SPECS.get('capture_buffer_size', 1)
+                ).start()
             
-            # Check if camera opened successfully
-            if not cap.isOpened():
-                # Send error frame to frontend
-                if frame_callback:
-                    try:
-                        frame_callback("Camera Unavailable")
-                    except Exception as cb_error:
-                        print(f"[AI MODULE] Error sending error frame to callback: {cb_error}")
-                
-                return
+            # Detect-then-track mode (keyframe detection, optical flow tracking in between)
+            detect_then_track = SYSTEM_SPECS.get('tracking_mode', 'detect') == 'detect_then_track'
+            keyframe_interval = max(1, int(SYSTEM_SPECS.get('keyframe_interval', 5)))
+            confidence_decay = SYSTEM_SPECS.get('track_confidence_decay', 0.98)
+            reembed_confidence = SYSTEM_SPECS.get('track_reembed_confidence', 0.35)
+            if motion_tracker is None:
+                motion_tracker = OpticalFlowTracker()
+            
+            # Detector input size of this camera (fixed per camera, or chosen from observed face sizes)
+            if size_selector is None:
+                size_selector = DetectionSizeSelector.from_config(None, SYSTEM_SPECS)
+            
+            # Identity locks: confirmed tracks skip embedding + gallery lookup until re-verification
+            if identity_cache is None:
+                identity_cache = self.create_identity_cache()
+            identity_locking = identity_cache.lock_after > 0
+            frames_since_keyframe = 0
+            force_keyframe = False
             
             frame_count = 0
             # For face tracking with ID persistent and re-identification
-            tracked_faces = {}  # {track_id: {'bbox', 'last_seen', 'name', 'embedding', 'confidence_history'}}
-            next_track_id = 1
-            bbox_history = {}  # For smoothing bounding box
+            if tracker is None:
+                tracker = FaceTracker.from_specs(SYSTEM_SPECS)
             last_recognition = {}  # To prevent repeated attendance logging
+            last_analysis = None  # (time, faces, AI state) of the last analysed frame, redrawn on preview-only frames
             
             while not stop_event.is_set() and self.is_running:
-                ret, frame = cap.read()
-                if not ret:
-                    # Try to reconnect
-                    cap.release()
-                    time.sleep(2)
-                    if rtsp_url.isdigit():
-                        cap = cv2.VideoCapture(int(rtsp_url))
-                    else:
-                        cap = cv2.VideoCapture(rtsp_url)
-                    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
-                    if not cap.isOpened():
-                        # Send error frame to frontend
-                        if frame_callback:
-                            try:
-                                frame_callback("Camera Unavailable")
-                            except Exception as cb_error:
-                                print(f"[AI MODULE] Error sending error frame to callback: {cb_error}")
-                        
-                        # Continue trying to reconnect
-                        time.sleep(5)  # Wait longer before next reconnect attempt
-                        continue
+                frame = grabber.read(timeout=1.0)
+                if frame is None:
+                    # No new frame yet (camera reconnecting); the grabber reports camera errors
+                    continue
+                
+                # Flip frame horizontally for mirror effect (same as main.py)
+                frame = cv2.flip(frame, 1)
                 
-                # Process frame with face recognition every few frames for performance
-                process_frame = True
-                if frame_skip:
-                    process_frame = (frame_count % 3 == 0)  # Process every 3rd frame
+                # Run inference / send a preview only when this camera's rate targets call for it
+                frame_time = time.time()
+                process_frame = rate_controller.should_infer(frame, frame_time)
+                # Overlays are drawn and the frame encoded only when it will actually be shown
+                send_frame = frame_callback is not None and rate_controller.should_display(
+                    frame_time, viewer_count() if viewer_count is not None else None)
+                draw = send_frame and burn_overlay
                 
                 if process_frame:
+                    current_time = time.time()
+                    current_faces = []
+                    ai_state = "Active"
                     try:
-                        # Flip frame horizontally for mirror effect (same as main.py)
-                        frame = cv2.flip(frame, 1)
-                        
-                        # Detect and recognize faces using the same approach as main.py
-                        # Note: Don't resize frame to maintain consistent coordinate system
-                        faces = system.app.get(frame)
-                        
-                        # Filter faces based on detection threshold if needed (same as main.py)
-                        detection_threshold = SYSTEM_SPECS.get('detection_threshold', 0.5)
-                        if detection_threshold > 0.5:  # Only filter if threshold is higher than default
-                            faces = [face for face in faces if hasattr(face, 'det_score') and face.det_score >= detection_threshold]
-                        
-                        # Handle multi-person detection (same as main.py)
-                        multi_person = SYSTEM_SPECS.get('multi_person', True)
-                        if not multi_person and len(faces) > 0:
-                            # Only process the face with highest detection score
-                            faces = [max(faces, key=lambda f: f.det_score if hasattr(f, 'det_score') else 0)]
-                        
-                        current_time = time.time()
                         
-                        # Detect current faces with coordinates (same as main.py)
-                        current_faces = []
-                        for i, face in enumerate(faces):
-                            bbox = face.bbox.astype(int)
-                            center_x = (bbox[0] + bbox[2]) // 2
-                            center_y = (bbox[1] + bbox[3]) // 2
-                            current_faces.append({
-                                'index': i,
-                                'bbox': bbox,
-                                'center': (center_x, center_y),
-                                'face_obj': face,
-                                'embedding': face.embedding
-                            })
-                        
-                        # Match detected faces with tracked faces using position and embedding (same as main.py)
-                        matched_tracks = set()
-                        matched_faces = set()
-                        
-                        # For each existing tracked face (same as main.py)
-                        for track_id, track_data in list(tracked_faces.items()):
-                            if current_faces:
-                                # Find closest face for this tracked face
-                                min_distance = float('inf')
-                                best_match = None
-                                best_similarity = 0
-                                
-                                for face_data in current_faces:
-                                    if face_data['index'] in matched_faces:
-                                        continue
-                                        
-                                    # Calculate distance between center points
-                                    dx = track_data['center'][0] - face_data['center'][0]
-                                    dy = track_data['center'][1] - face_data['center'][1]
-                                    distance = (dx * dx + dy * dy) ** 0.5
-                                    
-                                    # Calculate similarity based on embedding
-                                    similarity = self._calculate_embedding_similarity(track_data['embedding'], face_data['embedding'])
-                                    
-                                    # Use combination of distance and similarity for matching
-                                    # Prioritize high similarity, but consider distance
-                                    if similarity > embedding_similarity_threshold:
-                                        # If similarity is high, ignore slightly farther distance
-                                        if distance < min_distance:
-                                            min_distance = distance
-                                            best_match = face_data
-                                            best_similarity = similarity
-                                    elif distance < min_distance and distance < max_distance_threshold:
-                                        # If similarity is low but distance is close, also consider
-                                        min_distance = distance
-                                        best_match = face_data
-                                        best_similarity = similarity
-                                
-                                # If we have a good match
-                                if best_match and (best_similarity > embedding_similarity_threshold or min_distance < max_distance_threshold):
-                                    matched_tracks.add(track_id)
-                                    matched_faces.add(best_match['index'])
-                                    
-                                    # Update tracked face with new data
-                                    bbox = best_match['bbox']
-                                    face = best_match['face_obj']
-                                    
-                                    # Apply smoothing to bounding box
-                                    if track_id in bbox_history:
-                                        # Use weighted average for smoothing
-                                        prev_bbox = bbox_history[track_id]
-                                        smoothed_bbox = (smoothing_factor * prev_bbox + (1 - smoothing_factor) * bbox).astype(int)
-                                    else:
-                                        smoothed_bbox = bbox
-                                    
-                                    # Save smoothed bounding box for next frame
-                                    bbox_history[track_id] = smoothed_bbox
-                                    
-                                    # Update tracking data
-                                    center_x = (bbox[0] + bbox[2]) // 2
-                                    center_y = (bbox[1] + bbox[3]) // 2
-                                    tracked_faces[track_id] = {
-                                        'bbox': smoothed_bbox,
-                                        'center': (center_x, center_y),
-                                        'last_seen': current_time,
-                                        'face_obj': face,
-                                        'embedding': face.embedding,  # Update embedding
-                                        'confidence_history': track_data.get('confidence_history', []) + [best_similarity]
-                                    }
-                                    
-                                    # Process recognition for this face (same as main.py)
-                                    embedding = face.embedding
-                                    name = "Unknown"
-                                    best_score = 0
-                                    
-                                    # Use the same employee recognition logic as main.py
-                                    for emp_name, emp_embedding in system.known_employees:
-                                        # Calculate cosine similarity
-                                        similarity = tracking_manager.calculate_embedding_similarity(embedding, emp_embedding)
-                                        
-                                        if similarity > best_score:
-                                            best_score = similarity
-                                            name = emp_name
-                                    
-                                    # Save name to tracked face
-                                    tracked_faces[track_id]['name'] = name
-                                    
-                                    # Threshold for recognition (same as main.py)
-                                    recognition_threshold = SYSTEM_SPECS.get('recognition_threshold', 
-                                                                           SYSTEM_SPECS['detection_threshold'])
-                                    if best_score > recognition_threshold:
-                                        # Add name label
-                                        label = f"{name} ({best_score:.2f}) ID:{track_id}"
-                                        cv2.putText(frame, label, (smoothed_bbox[0], smoothed_bbox[1]-10), 
-                                                   cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
-                                        
-                                        # Log attendance if not logged within cooldown period
-                                        if name not in last_recognition or \
-                                           current_time - last_recognition[name] > recognition_cooldown:
-                                            self.log_attendance(name)
-                                            last_recognition[name] = current_time
-                                        
-                                        # Update last seen for employee monitoring
-                                        self.employee_last_seen[name] = current_time
-                                    else:
-                                        # Face not recognized
-                                        label = f"Unknown ID:{track_id}"
-                                        cv2.putText(frame, label, (smoothed_bbox[0], smoothed_bbox[1]-10), 
-                                                   cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
-                                    
-                                    # Draw smoothed bounding box
-                                    color = (0, 255, 0) if name != "Unknown" else (0, 0, 255)
-                                    cv2.rectangle(frame, (smoothed_bbox[0], smoothed_bbox[1]), 
-                                                 (smoothed_bbox[2], smoothed_bbox[3]), color, 2)
+                        # Detect-then-track: full detection + embedding on keyframes, optical flow in between
+                        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if detect_then_track else None
+                        keyframe = (not detect_then_track or force_keyframe or not len(tracker)
+                                    or frames_since_keyframe + 1 >= keyframe_interval)
                         
-                        # Add new faces that are not yet tracked (same as main.py)
-                        for face_data in current_faces:
-                            if face_data['index'] not in matched_faces:
-                                # Try to match with existing tracked faces based on embedding similarity
-                                best_similarity = 0
-                                best_track_id = None
-                                
-                                for track_id, track_data in tracked_faces.items():
-                                    if track_id in matched_tracks:
-                                        continue
-                                        
-                                    # Calculate similarity based on embedding
-                                    similarity = self._calculate_embedding_similarity(track_data['embedding'], face_data['embedding'])
-                                    
-                                    # If similarity is high and better than threshold, match
-                                    if similarity > best_similarity and similarity > embedding_similarity_threshold:
-                                        best_similarity = similarity
-                                        best_track_id = track_id
-                                
-                                # If we found a match based on embedding, use the same ID
-                                if best_track_id:
-                                    track_id = best_track_id
-                                    # Update tracked face information
-                                    bbox = face_data['bbox']
-                                    face = face_data['face_obj']
-                                    
-                                    # Apply smoothing to bounding box (no history, so use original bbox)
-                                    smoothed_bbox = bbox
-                                    bbox_history[track_id] = smoothed_bbox
-                                    
-                                    # Update tracking data
-                                    center_x = (bbox[0] + bbox[2]) // 2
-                                    center_y = (bbox[1] + bbox[3]) // 2
-                                    tracked_faces[track_id] = {
-                                        'bbox': smoothed_bbox,
-                                        'center': (center_x, center_y),
-                                        'last_seen': current_time,
-                                        'face_obj': face,
-                                        'embedding': face.embedding,
-                                        'name': track_data.get('name', "Unknown"),
-                                        'confidence_history': track_data.get('confidence_history', []) + [best_similarity]
-                                    }
-                                    
-                                    # Use name from previous tracking if available
-                                    name = tracked_faces[track_id]['name']
+                        if not keyframe:
+                            frames_since_keyframe += 1
+                            current_faces = []
+                            force_keyframe = self._propagate_tracks(
+                                frame, gray, tracker, motion_tracker, current_time,
+                                SYSTEM_SPECS.get('recognition_threshold', SYSTEM_SPECS['detection_threshold']),
+                                confidence_decay, reembed_confidence, draw=draw
+                            )
+                        else:
+                            frames_since_keyframe = 0
+                            force_keyframe = False
+                            # Detect and recognize faces using the same approach as main.py
+                            # Note: Don't resize frame to maintain consistent coordinate system
+                            # Faces overlapping a locked track keep its identity and skip the embedding model
+                            embed_filter = None
+                            if identity_locking:
+                                track_boxes = tracker.boxes(current_time)
+                                embed_filter = lambda image, detected: identity_cache.select(image, detected, track_boxes, current_time)
+                            # Only the camera's regions of interest go through the detector, at this camera's size
+                            detector_shape = detection_regions.input_shape(frame.shape) if detection_regions else frame.shape[:2]
+                            input_size = size_selector.select(detector_shape, current_time)
+                            faces = scheduler.infer(camera_id, frame, embed_filter, detection_regions, input_size)
+                            size_selector.observe(faces)
+                            
+                            # Filter faces based on detection threshold if needed (same as main.py)
+                            detection_threshold = SYSTEM_SPECS.get('detection_threshold', 0.5)
+                            if detection_threshold > 0.5:  # Only filter if threshold is higher than default
+                                faces = [face for face in faces if hasattr(face, 'det_score') and face.det_score >= detection_threshold]
+                            
+                            # Handle multi-person detection (same as main.py)
+                            multi_person = SYSTEM_SPECS.get('multi_person', True)
+                            if not multi_person and len(faces) > 0:
+                                # Only process the face with highest detection score
+                                faces = [max(faces, key=lambda f: f.det_score if hasattr(f, 'det_score') else 0)]
+                            
+                            # Detect current faces with coordinates (same as main.py)
+                            current_faces = []
+                            for i, face in enumerate(faces):
+                                bbox = face.bbox.astype(int)
+                                center_x = (bbox[0] + bbox[2]) // 2
+                                center_y = (bbox[1] + bbox[3]) // 2
+                                locked_track_id = face.locked_track_id if identity_locking else None
+                                if locked_track_id not in tracker:
+                                    locked_track_id = None
+                                current_faces.append({
+                                    'index': i,
+                                    'bbox': bbox,
+                                    'center': (center_x, center_y),
+                                    'face_obj': face,
+                                    'embedding': face.embedding if locked_track_id is None else tracker.get(locked_track_id).embedding,
+                                    'locked_track_id': locked_track_id
+                                })
+                            
+                            # Match every newly embedded face against the employee gallery in one batch;
+                            # faces of locked tracks reuse the track's identity
+                            embedded_faces = [f for f in current_faces if f['locked_track_id'] is None and f['embedding'] is not None]
+                            if embedded_faces:
+                                match_names, match_scores = system.gallery.match([f['embedding'] for f in embedded_faces])
+                                for face_data, emp_name, emp_score in zip(embedded_faces, match_names, match_scores):
+                                    face_data['employee_match'] = (emp_name, float(emp_score))
+                            for face_data in current_faces:
+                                if 'employee_match' in face_data:
+                                    continue
+                                if face_data['locked_track_id'] is not None:
+                                    locked_track = tracker.get(face_data['locked_track_id'])
+                                    face_data['employee_match'] = (locked_track.name, locked_track.score)
                                 else:
-                                    # Create new track ID
-                                    track_id = next_track_id
-                                    next_track_id += 1
-                                    
-                                    bbox = face_data['bbox']
-                                    face = face_data['face_obj']
-                                    
-                                    # Apply smoothing to bounding box (no history, so use original bbox)
-                                    smoothed_bbox = bbox
-                                    bbox_history[track_id] = smoothed_bbox
-                                    
-                                    # Save tracking data
-                                    center_x = (bbox[0] + bbox[2]) // 2
-                                    center_y = (bbox[1] + bbox[3]) // 2
-                                    tracked_faces[track_id] = {
-                                        'bbox': smoothed_bbox,
-                                        'center': (center_x, center_y),
-                                        'last_seen': current_time,
-                                        'face_obj': face,
-                                        'embedding': face.embedding,
-                                        'name': "Unknown",
-                                        'confidence_history': []
-                                    }
-                                
-                                # Process recognition for this new face (same as main.py)
-                                embedding = face_data['embedding']
-                                name = "Unknown"
-                                best_score = 0
+                                    # No embedding (no landmarks, or no recognition model loaded)
+                                    face_data['employee_match'] = ("Unknown", 0.0)
+                            
+                            # Match detected faces with tracked faces (cost-matrix association in FaceTracker)
+                            assignments = tracker.update(current_faces, current_time)
+                            
+                            # Threshold for recognition (same as main.py)
+                            recognition_threshold = SYSTEM_SPECS.get('recognition_threshold', 
+                                                                   SYSTEM_SPECS['detection_threshold'])
+                            
+                            for track, face_data, _ in assignments:
+                                track_id = track.track_id
+                                smoothed_bbox = track.bbox
                                 
-                                # Use the same employee recognition logic as main.py
-                                for emp_name, emp_embedding in system.known_employees:
-                                    # Calculate cosine similarity
-                                    similarity = np.dot(embedding, emp_embedding) / (
-                                        np.linalg.norm(embedding) * np.linalg.norm(emp_embedding)
-                                    )
-                                    
-                                    if similarity > best_score:
-                                        best_score = similarity
-                                        name = emp_name
+                                # Recognition result from the batched gallery lookup
+                                name, best_score = face_data['employee_match']
                                 
                                 # Save name to tracked face
-                                tracked_faces[track_id]['name'] = name
+                                track.name = name
+                                track.score = best_score
+                                track.identity_confidence = best_score
+                                if identity_locking and face_data['locked_track_id'] is None:
+                                    identity_cache.update(track_id, name, best_score,
+                                                          face_data['face_obj'].appearance_signature, current_time)
                                 
-                                # Threshold for recognition (same as main.py)
-                                recognition_threshold = SYSTEM_SPECS.get('recognition_threshold', 
-                                                                       SYSTEM_SPECS['detection_threshold'])
                                 if best_score > recognition_threshold:
                                     # Add name label
-                                    label = f"{name} ({best_score:.2f}) ID:{track_id}"
-                                    cv2.putText(frame, label, (smoothed_bbox[0], smoothed_bbox[1]-10), 
-                                               cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+                                    if draw:
+                                        label = f"{name} ({best_score:.2f}) ID:{track_id}"
+                                        cv2.putText(frame, label, (smoothed_bbox[0], smoothed_bbox[1]-10), 
+                                                   cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
                                     
                                     # Log attendance if not logged within cooldown period
                                     if name not in last_recognition or \
@@ -572,50 +693,71 @@ class AIProcessingModule:
                                     
                                     # Update last seen for employee monitoring
                                     self.employee_last_seen[name] = current_time
-                                else:
+                                elif draw:
                                     # Face not recognized
                                     label = f"Unknown ID:{track_id}"
                                     cv2.putText(frame, label, (smoothed_bbox[0], smoothed_bbox[1]-10), 
                                                cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
                                 
-                                # Draw bounding box
-                                color = (0, 255, 0) if name != "Unknown" else (0, 0, 255)
-                                cv2.rectangle(frame, (smoothed_bbox[0], smoothed_bbox[1]), 
-                                             (smoothed_bbox[2], smoothed_bbox[3]), color, 2)
+                                # Draw smoothed bounding box
+                                if draw:
+                                    color = (0, 255, 0) if name != "Unknown" else (0, 0, 255)
+                                    cv2.rectangle(frame, (smoothed_bbox[0], smoothed_bbox[1]), 
+                                                 (smoothed_bbox[2], smoothed_bbox[3]), color, 2)
+                            
+                            # Start following the boxes seen on this keyframe
+                            if detect_then_track:
+                                motion_tracker.reset(gray, {track.track_id: track.bbox for track in tracker
+                                                            if track.last_seen == current_time})
                         
                         # Clean up tracked faces that haven't been seen for a while (same as main.py)
-                        tracked_faces = {k: v for k, v in tracked_faces.items() 
-                                       if current_time - v['last_seen'] < tracking_timeout}
+                        tracker.cleanup(current_time, tracking_timeout)
+                        identity_cache.retain(tracker.tracks)
                         
                         # Track employees and update database (same as main.py)
-                        detected_employees = []
-                        for track_id, track_data in tracked_faces.items():
-                            if track_data['name'] != "Unknown":
-                                detected_employees.append(track_data['name'])
+                        detected_employees = [track.name for track in tracker if track.name != "Unknown"]
                         
-                        # Update employee status in database for each detected employee
+                        # Queue status/location updates; the write-behind writer batches them into one transaction
                         for employee_name in detected_employees:
                             self.update_employee_status(employee_name, camera_id)
-                            # Log employee location to database
-                            db_manager.log_employee_location(employee_name, camera_id)
+                            db_writer.submit_location(employee_name, camera_id)
                         
                         # Add frame info (same as main.py)
-                        cv2.putText(frame, f"Faces: {len(current_faces)} | Tracked: {len(tracked_faces)} | AI: Active", (10, 30), 
-                                   cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
+                        ai_state = "Active" if keyframe else "Tracking"
+                        if draw:
+                            cv2.putText(frame, f"Faces: {len(current_faces)} | Tracked: {len(tracker)} | AI: {ai_state}", (10, 30), 
+                                       cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
                         
                     except Exception as e:
                         print(f"[AI MODULE] Error in face recognition processing: {e}")
+                        ai_state = "Error"
                         # Still add frame to stream even if processing fails (same as main.py)
-                        cv2.putText(frame, "AI: Error", (10, 30), 
-                                   cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
+                        if draw:
+                            cv2.putText(frame, "AI: Error", (10, 30), 
+                                       cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
+                    rate_controller.record_inference(frame_time)
+                    last_analysis = (current_time, len(current_faces), ai_state)
+                    
+                    # Overlay metadata goes out on every analysed frame, also without video viewers
+                    if detections_callback is not None:
+                        try:
+                            detections_callback(self._detections_metadata(
+                                camera_id, frame, frame_time, tracker, current_time, overlay_threshold,
+                                len(current_faces), ai_state, detection_regions,
+                                max(tracking_timeout, rate_controller.max_inference_gap())))
+                        except Exception as e:
+                            print(f"[AI MODULE] Error sending detections to callback: {e}")
+                elif draw and last_analysis is not None:
+                    # Preview-only frame (display_fps > inference_fps): keep the overlay of the last analysis
+                    self._draw_tracks(frame, tracker, frame_time, last_analysis, overlay_threshold)
                 
-                # Encode frame to base64 and send to callback
-                if frame_callback:
+                # Hand the frame to the callback; it is downscaled and encoded per preview profile there
+                if send_frame:
                     try:
-                        _, buffer = cv2.imencode('.jpg', frame)
-                        frame_base64 = base64.b64encode(buffer).decode()
+                        if draw and detection_regions is not None:
+                            detection_regions.draw(frame)
                         # Send frame to callback - let application.py handle error detection
-                        frame_callback(frame_base64)
+                        frame_callback(frame)
                     except Exception as e:
                         print(f"[AI MODULE] Error sending frame to callback: {e}")
                         # Send a simple error indicator
@@ -625,22 +767,109 @@ class AIProcessingModule:
                             print(f"[AI MODULE] Error sending error frame: {e2}")
                 
                 frame_count += 1
-                # Delay to maintain target FPS
-                if fps_target > 0:
-                    time.sleep(frame_delay)
-                else:
-                    # Small delay to prevent overwhelming the system
-                    time.sleep(0.03)  # ~30 FPS default
                 
         except Exception as e:
             print(f"[AI MODULE] Error in face recognition worker: {e}")
         finally:
-            if cap:
-                cap.release()
+            if owns_grabber and grabber:
+                grabber.stop()
+            if tracker is not None:
+                tracker.stop_recording()
+    
+    def _propagate_tracks(self, frame, gray, tracker, motion_tracker, current_time,
+                          recognition_threshold, confidence_decay, reembed_confidence, draw=True):
+        """Tracking frame of detect-then-track mode: move boxes by optical flow and draw cached identities.
+        
+        Returns True when a track was lost or its identity confidence decayed
+        below `reembed_confidence`, so the next analysed frame must be a keyframe.
+        """
+        need_keyframe = False
+        for track_id, (bbox, quality) in motion_tracker.update(gray).items():
+            if track_id not in tracker:
+                continue
+            if quality <= 0:
+                # Flow lost this face; let detection find it again
+                need_keyframe = True
+                continue
+            
+            track = tracker.move(track_id, bbox, current_time)
+            track.identity_confidence *= quality * confidence_decay
+            
+            name = track.name
+            score = track.score
+            if name != "Unknown" and track.identity_confidence < reembed_confidence:
+                need_keyframe = True
+            
+            if draw:
+                self._draw_track(frame, bbox, track_id, name, score, recognition_threshold)
+        return need_keyframe
+    
+    @staticmethod
+    def _draw_track(frame, bbox, track_id, name, score, recognition_threshold):
+        """Burn one track's box and label into a preview frame"""
+        if score > recognition_threshold:
+            label = f"{name} ({score:.2f}) ID:{track_id}"
+            cv2.putText(frame, label, (bbox[0], bbox[1]-10), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+        else:
+            label = f"Unknown ID:{track_id}"
+            cv2.putText(frame, label, (bbox[0], bbox[1]-10), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
+        color = (0, 255, 0) if name != "Unknown" else (0, 0, 255)
+        cv2.rectangle(frame, (bbox[0], bbox[1]), (bbox[2], bbox[3]), color, 2)
+    
+    def _draw_tracks(self, frame, tracker, now, analysis, recognition_threshold):
+        """Redraw the tracks of the last analysed frame on a preview-only frame, boxes predicted to `now`"""
+        analysed_at, faces_detected, ai_state = analysis
+        boxes = tracker.boxes(now)
+        for track in tracker:
+            if track.last_seen != analysed_at:
+                continue
+            bbox = boxes.get(track.track_id, track.bbox)
+            self._draw_track(frame, bbox, track.track_id, track.name, track.score, recognition_threshold)
+        if ai_state == "Error":
+            cv2.putText(frame, "AI: Error", (10, 30), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 2)
+        else:
+            cv2.putText(frame, f"Faces: {faces_detected} | Tracked: {len(tracker)} | AI: {ai_state}", (10, 30), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 255), 2)
+    
+    def _detections_metadata(self, camera_id, frame, frame_time, tracker, current_time, recognition_threshold,
+                             faces_detected, ai_state, detection_regions=None, ttl=None):
+        """Overlay data of one analysed frame: the tracks updated on it, in frame pixels (after the mirror flip).
+        
+        `ttl` is how long (seconds) the record stays valid: a still scene may not
+        be analysed again for that long, so clients keep showing it until then.
+        """
+        detections = []
+        for track in tracker:
+            if track.last_seen != current_time:
+                continue
+            detections.append({
+                'track_id': track.track_id,
+                'bbox': [int(v) for v in track.bbox[:4]],
+                'name': track.name,
+                'score': round(float(track.score), 3),
+                'recognized': bool(track.score > recognition_threshold)
+            })
+        metadata = {
+            'camera_id': camera_id,
+            'timestamp': frame_time,
+            'width': int(frame.shape[1]),
+            'height': int(frame.shape[0]),
+            'faces': faces_detected,
+            'tracked': len(tracker),
+            'ai_state': ai_state,
+            'ttl': ttl,
+            'detections': detections
+        }
+        if detection_regions is not None:
+            metadata['regions'] = detection_regions.outlines(frame.shape)
+        return metadata
     
     def update_employee_status(self, employee_name, camera_id, status='available'):
-        """Update employee status in database"""
-        db_manager.update_employee_status(employee_name, camera_id, status)
+        """Queue an employee status update for the write-behind database writer"""
+        db_writer.submit_status(employee_name, camera_id, status)
     
     def _background_processing_loop(self):
         """Background loop for continuous processing"""
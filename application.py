@@ -3,17 +3,19 @@
 # Main Application - Web Interface that displays everything to UI
 
 from flask import Flask, render_template, jsonify, request, send_from_directory, Response
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room, leave_room
 from flask_cors import CORS
 import json
 import time
 from datetime import datetime
 import threading
 import os
-from db_manager import db_manager, SessionLocal, EmployeeStatus
-from camera_manager import camera_manager, get_all_camera_configs
+from db_manager import (db_manager, db_writer, SessionLocal, EmployeeStatus, Camera,
+                        compact_employee_locations, DWELL_GAP_SECONDS)
+from camera_manager import camera_manager, get_all_camera_configs, get_camera_config
 from tracking_manager import tracking_manager
 from AI_module import ai_processing_module, load_system_specs
+from frame_broadcaster import FrameBroadcaster, preview_profiles
 
 # Create Flask app
 app = Flask(__name__, static_folder='static')
@@ -21,8 +23,40 @@ app.config['SECRET_KEY'] = 'your-secret_key_here'
 socketio = SocketIO(app, async_mode="threading", cors_allowed_origins="*")
 CORS(app)
 
-# Active streams tracking
+# Active streams tracking ({rtsp_url: True}); with stream_keep_alive a stream keeps running headless
+# after its last viewer leaves, otherwise it stops
 active_streams = {}
+streams_lock = threading.RLock()
+
+# Overlay metadata: latest per stream, and clients that receive camera_detections without video
+latest_detections = {}
+detection_subscribers = {}  # {rtsp_url: set of sids}
+
+def detections_room(rtsp_url):
+    """Socket.IO room that receives the camera_detections events of a stream"""
+    return f"detections:{rtsp_url}"
+
+def stream_viewers(rtsp_url):
+    """Video viewers (Socket.IO and MJPEG) plus detection-only subscribers of a stream"""
+    return frame_broadcaster.viewer_count(rtsp_url) + len(detection_subscribers.get(rtsp_url, ()))
+
+def send_camera_frame(sid, rtsp_url, jpeg):
+    """Send one preview frame to one Socket.IO client (binary attachment)"""
+    socketio.emit('camera_frame', {
+        'frame': jpeg,
+        'format': 'jpeg',
+        'rtsp_url': rtsp_url
+    }, namespace='/camera', to=sid)
+
+# Each frame is encoded once per camera and preview profile and fanned out to its viewers
+frame_broadcaster = FrameBroadcaster(send=send_camera_frame)
+
+def open_feed(rtsp_url):
+    """Broadcaster feed of a stream, with the preview profiles of SYSTEM_SPECS and the camera's config"""
+    specs = ai_processing_module.system_specs
+    camera_config = get_camera_config(rtsp_url) or {}
+    default_profile = camera_config.get('preview_default_profile', specs.get('preview_default_profile', 'focus'))
+    return frame_broadcaster.open(rtsp_url, preview_profiles(specs, camera_config), default_profile)
 
 # Initialize AI processing module
 print("[APPLICATION] Initializing AI processing module...")
@@ -65,12 +99,12 @@ def get_employees():
     try:
         session = get_db_session()
         
-        # Get all employees
-        employees_data = db_manager.get_all_employees()
+        # Get all employee names (embeddings are not needed here)
+        employee_names = db_manager.get_employee_names()
         
         # Get status for each employee
         employees_with_status = []
-        for name, _ in employees_data:
+        for name in employee_names:
             # Get employee status
             status_record = session.query(EmployeeStatus).filter_by(employee_name=name).first()
             
@@ -142,17 +176,25 @@ def get_employee_location(employee_id):
         # Convert employee_id back to name (this is a simple approach)
         employee_name = employee_id.replace('_', ' ').title()
         
-        # Get employee locations
-        locations = session.query(EmployeeLocation).filter_by(employee_name=employee_name).order_by(EmployeeLocation.timestamp.desc()).limit(10).all()
+        # Get employee dwell intervals (one entry per camera visit)
+        intervals = db_manager.get_employee_location_history(employee_name, limit=10)
+        camera_ids = {interval['camera_id'] for interval in intervals}
+        camera_names = {
+            camera.id: camera.name
+            for camera in session.query(Camera).filter(Camera.id.in_(camera_ids))
+        } if camera_ids else {}
         
         location_history = []
-        for loc in locations:
-            camera = session.query(Camera).filter_by(id=loc.camera_id).first()
+        for interval in intervals:
             location_info = {
-                'cameraId': loc.camera_id,
-                'cameraName': camera.name if camera else loc.camera_id,
-                'timestamp': loc.timestamp.isoformat(),
-                'formattedTime': format_last_seen(loc.timestamp)
+                'cameraId': interval['camera_id'],
+                'cameraName': camera_names.get(interval['camera_id'], interval['camera_id']),
+                'timestamp': interval['exit_ts'].isoformat(),
+                'formattedTime': format_last_seen(interval['exit_ts']),
+                'enteredAt': interval['enter_ts'].isoformat(),
+                'exitedAt': interval['exit_ts'].isoformat(),
+                'dwellSeconds': (interval['exit_ts'] - interval['enter_ts']).total_seconds(),
+                'frameCount': interval['frame_count']
             }
             location_history.append(location_info)
         
@@ -246,62 +288,210 @@ def handle_camera_connect():
     """Handle camera client connection"""
     print('[APPLICATION] Camera client connected')
 
+@socketio.on('disconnect', namespace='/camera')
+def handle_camera_disconnect():
+    """Drop the client's subscriptions; streams nobody watches any more are stopped"""
+    orphaned = set(frame_broadcaster.unsubscribe_all(request.sid))
+    with streams_lock:
+        for rtsp_url, sids in detection_subscribers.items():
+            if request.sid in sids:
+                sids.discard(request.sid)
+                orphaned.add(rtsp_url)
+    for rtsp_url in orphaned:
+        stop_stream_if_idle(rtsp_url)
+
+def ensure_stream(rtsp_url):
+    """Start background processing for a stream unless it is already running; returns success"""
+    with streams_lock:
+        if rtsp_url in active_streams:
+            return True
+        feed = open_feed(rtsp_url)
+        
+        # Define frame callback: annotated frames go to the broadcaster, error messages to the camera's room
+        def frame_callback(frame):
+            if not isinstance(frame, str):
+                feed.publish(frame)
+                return
+            # Always send error text to the viewers, let frontend handle error detection
+            socketio.emit('camera_frame', {
+                'frame': frame, 
+                'rtsp_url': rtsp_url
+            }, namespace='/camera', to=rtsp_url)
+        
+        # Boxes and labels of every analysed frame, for canvas overlays and API consumers
+        def detections_callback(metadata):
+            metadata['rtsp_url'] = rtsp_url
+            latest_detections[rtsp_url] = metadata
+            socketio.emit('camera_detections', metadata, namespace='/camera', to=detections_room(rtsp_url))
+        
+        # Start face recognition processing in background (delegate to AI module)
+        # Use rtsp_url as both camera_id and rtsp_url for consistency
+        viewer_count = lambda: feed.viewer_count()
+        if not ai_processing_module.start_stream(rtsp_url, rtsp_url, frame_callback, viewer_count,
+                                                 detections_callback):
+            frame_broadcaster.close(rtsp_url)
+            return False
+        active_streams[rtsp_url] = True
+    # Update AI status for all clients
+    socketio.emit('ai_status_update', {'active': True})
+    return True
+
+def stop_stream_if_idle(rtsp_url):
+    """Stop a stream's processing once no video viewers or detection subscribers are left.
+    
+    With stream_keep_alive (default) the stream keeps running: recognition and
+    attendance continue while drawing and JPEG encoding are skipped.
+    """
+    if ai_processing_module.system_specs.get('stream_keep_alive', True):
+        if stream_viewers(rtsp_url) == 0:
+            print(f"[APPLICATION] No viewers left, stream continues headless: {rtsp_url}")
+        return
+    with streams_lock:
+        if rtsp_url not in active_streams or stream_viewers(rtsp_url) > 0:
+            return
+        print(f"[APPLICATION] Stopping stream: {rtsp_url}")
+        # Stop face recognition processing (delegate to AI module)
+        ai_processing_module.stop_stream(rtsp_url)
+        frame_broadcaster.close(rtsp_url)
+        latest_detections.pop(rtsp_url, None)
+        del active_streams[rtsp_url]
+        still_active = bool(active_streams)
+    # Update AI status for all clients
+    socketio.emit('ai_status_update', {'active': still_active})
+    print(f"[APPLICATION] Stream stopped: {rtsp_url}")
+
 @socketio.on('start_stream', namespace='/camera')
 def start_stream(data):
-    """Start camera stream - delegate to AI module for background processing"""
+    """Subscribe this client to a camera stream, starting its background processing if needed.
+    
+    Other streams keep running, so several operators can watch different cameras.
+    transport "socketio": frames arrive as binary camera_frame events (one in flight,
+    acknowledged with frame_ack); "mjpeg": the client reads /api/camera/mjpeg.
+    profile: preview profile of this client (e.g. "thumbnail" for a grid tile);
+    the camera's profiles are sent back in a preview_profiles event.
+    Viewers also receive the stream's camera_detections events (overlay metadata).
+    """
     rtsp_url = data.get('rtsp_url')
     if not rtsp_url:
         # Send error frame to client
-        socketio.emit('camera_frame', {
+        emit('camera_frame', {
             'frame': 'Camera Unavailable',
             'rtsp_url': ''
-        }, namespace='/camera')
+        })
         return
+    transport = data.get('transport', 'socketio')
     
-    # Stop any existing streams
-    for url in list(active_streams.keys()):
-        stop_stream({'rtsp_url': url})
-    
-    # Define frame callback to emit frames to client
-    def frame_callback(frame_base64):
-        # Always send frame to client, let frontend handle error detection
-        socketio.emit('camera_frame', {
-            'frame': frame_base64, 
-            'rtsp_url': rtsp_url
-        }, namespace='/camera')
-    
-    # Start face recognition processing in background (delegate to AI module)
-    # Use rtsp_url as both camera_id and rtsp_url for consistency
-    success = ai_processing_module.start_stream(rtsp_url, rtsp_url, frame_callback)
-    
-    if success:
-        # Update AI status for all clients
-        socketio.emit('ai_status_update', {'active': True})
-        active_streams[rtsp_url] = True
-    else:
+    # Subscribe first so the stream is never seen as idle while starting
+    join_room(rtsp_url)
+    join_room(detections_room(rtsp_url))
+    with streams_lock:
+        feed = open_feed(rtsp_url)
+        profile = feed.subscribe(request.sid, transport, data.get('profile'))
+        started = ensure_stream(rtsp_url)
+    if not started:
+        leave_room(rtsp_url)
+        leave_room(detections_room(rtsp_url))
         # Send error frame to client
-        socketio.emit('camera_frame', {
+        emit('camera_frame', {
             'frame': 'Camera Unavailable',
             'rtsp_url': rtsp_url
-        }, namespace='/camera')
+        })
+        return
+    emit('preview_profiles', {
+        'rtsp_url': rtsp_url,
+        'profiles': feed.profiles,
+        'profile': profile
+    })
+
+@socketio.on('set_preview_profile', namespace='/camera')
+def set_preview_profile(data):
+    """Switch this client's preview of a stream to another profile (e.g. grid tile -> focused view)"""
+    rtsp_url = data.get('rtsp_url')
+    profile = frame_broadcaster.set_profile(rtsp_url, request.sid, data.get('profile'))
+    if profile is not None:
+        emit('preview_profile', {'rtsp_url': rtsp_url, 'profile': profile})
+
+@socketio.on('subscribe_detections', namespace='/camera')
+def subscribe_detections(data):
+    """Receive a stream's camera_detections events without its video (starts the stream if needed)"""
+    rtsp_url = data.get('rtsp_url')
+    if not rtsp_url:
+        return
+    join_room(detections_room(rtsp_url))
+    with streams_lock:
+        detection_subscribers.setdefault(rtsp_url, set()).add(request.sid)
+        started = ensure_stream(rtsp_url)
+        if not started:
+            detection_subscribers[rtsp_url].discard(request.sid)
+    if not started:
+        leave_room(detections_room(rtsp_url))
+        emit('camera_frame', {
+            'frame': 'Camera Unavailable',
+            'rtsp_url': rtsp_url
+        })
+
+@socketio.on('unsubscribe_detections', namespace='/camera')
+def unsubscribe_detections(data):
+    """Stop receiving a stream's camera_detections events"""
+    rtsp_url = data.get('rtsp_url')
+    if not rtsp_url:
+        return
+    with streams_lock:
+        detection_subscribers.get(rtsp_url, set()).discard(request.sid)
+    # Video viewers of the stream keep receiving the overlay metadata
+    feed = frame_broadcaster.get(rtsp_url)
+    if feed is None or request.sid not in feed.subscribers:
+        leave_room(detections_room(rtsp_url))
+    stop_stream_if_idle(rtsp_url)
+
+@app.route('/api/camera/detections')
+def camera_detections():
+    """Latest overlay metadata of one active stream (?rtsp_url=), or of all active streams"""
+    rtsp_url = request.args.get('rtsp_url')
+    if rtsp_url is None:
+        return jsonify(latest_detections)
+    if rtsp_url not in latest_detections:
+        return jsonify({'status': 'error', 'message': 'No detections for this stream'}), 404
+    return jsonify(latest_detections[rtsp_url])
+
+@socketio.on('frame_ack', namespace='/camera')
+def handle_frame_ack(data):
+    """Client finished displaying its last frame of a stream; the next one may be sent"""
+    frame_broadcaster.ack(data.get('rtsp_url'), request.sid)
+
+@app.route('/api/camera/mjpeg')
+def camera_mjpeg():
+    """Preview of an active stream as multipart JPEG (for <img src>), without base64 or Socket.IO framing.
+    
+    ?profile= picks the preview profile (default: the camera's default profile).
+    """
+    rtsp_url = request.args.get('rtsp_url', '')
+    profile = request.args.get('profile')
+    feed = frame_broadcaster.get(rtsp_url)
+    if rtsp_url not in active_streams or feed is None:
+        return jsonify({'status': 'error', 'message': 'Stream not active'}), 404
+    
+    def frames():
+        try:
+            yield from feed.mjpeg_frames(profile)
+        finally:
+            stop_stream_if_idle(rtsp_url)
+    return Response(frames(), mimetype='multipart/x-mixed-replace; boundary=frame',
+                    headers={'Cache-Control': 'no-cache, no-store'})
 
 @socketio.on('stop_stream', namespace='/camera')
 def stop_stream(data):
-    """Stop camera stream - delegate to AI module"""
+    """Unsubscribe this client from a stream; processing stops when the last viewer leaves"""
     rtsp_url = data.get('rtsp_url')
     print(f"[APPLICATION] Received stop_stream request for RTSP URL: {rtsp_url}")
     if not rtsp_url:
         return
     
-    if rtsp_url in active_streams:
-        print(f"[APPLICATION] Stopping stream: {rtsp_url}")
-        # Stop face recognition processing (delegate to AI module)
-        ai_processing_module.stop_stream(rtsp_url)
-        
-        # Update AI status for all clients
-        socketio.emit('ai_status_update', {'active': False})
-        del active_streams[rtsp_url]
-        print(f"[APPLICATION] Stream stopped: {rtsp_url}")
+    leave_room(rtsp_url)
+    if request.sid not in detection_subscribers.get(rtsp_url, ()):
+        leave_room(detections_room(rtsp_url))
+    frame_broadcaster.unsubscribe(rtsp_url, request.sid)
+    stop_stream_if_idle(rtsp_url)
 
 # API routes for AI control
 @app.route('/api/ai/start', methods=['POST'])
@@ -321,6 +511,12 @@ def stop_ai_processing():
     """Stop AI processing module"""
     try:
         if ai_processing_module.stop_processing():
+            # All streams (headless ones included) are stopped with the module
+            with streams_lock:
+                for rtsp_url in list(active_streams.keys()):
+                    frame_broadcaster.close(rtsp_url)
+                active_streams.clear()
+                latest_detections.clear()
             return jsonify({'status': 'success', 'message': 'AI processing stopped'})
         else:
             return jsonify({'status': 'error', 'message': 'Failed to stop AI processing'}), 500
@@ -334,7 +530,16 @@ def get_ai_status():
     try:
         status = {
             'active': ai_processing_module.is_running,
-            'active_streams': list(ai_processing_module.active_streams.keys())
+            'active_streams': list(ai_processing_module.active_streams.keys()),
+            'capture': ai_processing_module.get_capture_stats(),
+            'rates': ai_processing_module.get_rate_stats(),
+            'tracking': ai_processing_module.get_tracking_stats(),
+            'identity': ai_processing_module.get_identity_stats(),
+            'regions': ai_processing_module.get_region_stats(),
+            'detection_size': ai_processing_module.get_detection_size_stats(),
+            'viewers': frame_broadcaster.get_stats(),
+            'inference': ai_processing_module.get_inference_stats(),
+            'db_writer': db_writer.get_metrics()
         }
         return jsonify(status)
     except Exception as e:
@@ -391,6 +596,12 @@ def handle_employee_status_request():
 def start_application():
     """Start the main application"""
     try:
+        # Fold location rows written since the last run into dwell intervals (configured gap)
+        try:
+            compact_employee_locations(load_system_specs().get('dwell_gap_seconds', DWELL_GAP_SECONDS))
+        except Exception as e:
+            print(f"[APPLICATION] Error compacting employee locations: {e}")
+        
         # Start background thread for status updates
         status_thread = threading.Thread(target=update_employee_status_in_background)
         status_thread.daemon = True
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# benchmark_gallery.py
+# Recall/latency benchmark of the IVF gallery index against the brute-force scan
+#
+# Usage: python benchmark_gallery.py --sizes 1000 5000 20000 --nprobe 4 8 16
+
+import argparse
+import time
+import numpy as np
+from face_gallery import EmployeeGallery, INDEX_EXACT, INDEX_IVF
+
+def make_synthetic_gallery(n_employees, dim, rng):
+    """Random unit-norm identity embeddings, one per synthetic employee"""
+    embeddings = rng.standard_normal((n_employees, dim)).astype(np.float32)
+    return [(i, f"emp_{i}", embeddings[i]) for i in range(n_employees)], embeddings
+
+def make_queries(embeddings, n_queries, noise, rng):
+    """Noisy re-captures of random employees (noise is relative to the embedding norm)"""
+    targets = rng.integers(0, len(embeddings), size=n_queries)
+    base = embeddings[targets]
+    scale = noise * np.linalg.norm(base, axis=1, keepdims=True) / np.sqrt(base.shape[1])
+    return base + scale * rng.standard_normal(base.shape).astype(np.float32), targets
+
+def time_lookup(gallery, queries, batch_size):
+    """Average lookup latency per query in milliseconds, plus the top-1 rows"""
+    rows = []
+    start = time.perf_counter()
+    for i in range(0, len(queries), batch_size):
+        indices, _ = gallery.search(queries[i:i + batch_size], k=1)
+        rows.append(indices[:, 0])
+    elapsed = time.perf_counter() - start
+    return elapsed * 1000.0 / len(queries), np.concatenate(rows)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark IVF vs brute-force employee gallery lookups")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--dim", type=int, default=512)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=4, help="faces looked up together (faces per frame)")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16])
+    parser.add_argument("--nlist", type=int, default=None, help="IVF cells (default sqrt(size))")
+    parser.add_argument("--noise", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    print("=== Gallery Benchmark ({}-d, {} queries, batch {}) ===".format(args.dim, args.queries, args.batch_size))
+    print("{:>8} {:>8} {:>8} {:>12} {:>10} {:>10} {:>9}".format(
+        "size", "index", "nprobe", "build (ms)", "ms/query", "recall@1", "speedup"))
+
+    for size in args.sizes:
+        employees, embeddings = make_synthetic_gallery(size, args.dim, rng)
+        queries, _ = make_queries(embeddings, args.queries, args.noise, rng)
+
+        start = time.perf_counter()
+        exact = EmployeeGallery(employees, index_type=INDEX_EXACT)
+        build_ms = (time.perf_counter() - start) * 1000.0
+        exact_ms, exact_rows = time_lookup(exact, queries, args.batch_size)
+        print("{:>8} {:>8} {:>8} {:>12.1f} {:>10.4f} {:>10.3f} {:>9.2f}".format(
+            size, INDEX_EXACT, "-", build_ms, exact_ms, 1.0, 1.0))
+
+        for nprobe in args.nprobe:
+            start = time.perf_counter()
+            ivf = EmployeeGallery(employees, index_type=INDEX_IVF, ann_min_size=0,
+                                  nlist=args.nlist, nprobe=nprobe)
+            build_ms = (time.perf_counter() - start) * 1000.0
+            ivf_ms, ivf_rows = time_lookup(ivf, queries, args.batch_size)
+            # Recall is measured against the brute-force answer, not the synthetic label
+            recall = float(np.mean(ivf_rows == exact_rows))
+            print("{:>8} {:>8} {:>8} {:>12.1f} {:>10.4f} {:>10.3f} {:>9.2f}".format(
+                size, INDEX_IVF, nprobe, build_ms, ivf_ms, recall, exact_ms / ivf_ms if ivf_ms > 0 else 0.0))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# benchmark_inference.py
+# Per-model latency of the InsightFace pack, and comparison of onnxruntime backend settings
+#
+# Usage: python benchmark_inference.py --images data/registered_faces/*.jpg --repeat 20
+#        python benchmark_inference.py --modules detection recognition
+#        python benchmark_inference.py --compare --intra-threads 1 2 4 --graph-optimization basic all
+#        python benchmark_inference.py --compare --detector-model det_int8.onnx --recognizer-model rec_int8.onnx
+
+import argparse
+import glob
+import itertools
+import json
+import time
+import cv2
+from inference_backend import (create_face_analysis, face_analysis_options, parse_allowed_modules,
+                               DEFAULT_ALLOWED_MODULES)
+
+def load_specs(path="parameter_config.json"):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def load_images(patterns, pad):
+    """Read the benchmark images; registered face crops get a border so the detector sees context"""
+    images = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            image = cv2.imread(path)
+            if image is None:
+                continue
+            if pad > 0:
+                border = int(max(image.shape[:2]) * pad)
+                image = cv2.copyMakeBorder(image, border, border, border, border, cv2.BORDER_CONSTANT)
+            images.append((path, image))
+    return images
+
+def time_call(fn, repeat):
+    """Average wall time of fn() in milliseconds"""
+    fn()  # warm-up (first onnxruntime run allocates buffers)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) * 1000.0 / repeat
+
+def benchmark_models(app, images, repeat):
+    """Latency per model: detection per frame, every other head per detected face"""
+    from insightface.app.common import Face
+    results = {task: {'file': getattr(model, 'model_file', ''), 'total_ms': 0.0, 'calls': 0}
+               for task, model in app.models.items()}
+    frames = 0
+    for _, image in images:
+        bboxes, kpss = app.det_model.detect(image, max_num=0, metric='default')
+        results['detection']['total_ms'] += time_call(
+            lambda: app.det_model.detect(image, max_num=0, metric='default'), repeat)
+        results['detection']['calls'] += 1
+        frames += 1
+        if bboxes.shape[0] == 0:
+            continue
+        face = Face(bbox=bboxes[0, 0:4], kps=kpss[0] if kpss is not None else None, det_score=bboxes[0, 4])
+        for task, model in app.models.items():
+            if task == 'detection':
+                continue
+            results[task]['total_ms'] += time_call(lambda: model.get(image, face), repeat)
+            results[task]['calls'] += 1
+    return results, frames
+
+def per_call_ms(values):
+    return values['total_ms'] / values['calls'] if values['calls'] else 0.0
+
+def report_modules(args, specs):
+    """Time every head of the full pack and report what the configured subset saves"""
+    kept = parse_allowed_modules(args.modules if args.modules is not None
+                                 else specs.get("insightface_modules", DEFAULT_ALLOWED_MODULES))
+    options = face_analysis_options(specs)
+    options.update({'det_size': tuple(args.det_size), 'allowed_modules': None})
+    app = create_face_analysis(**options)
+    results, _ = benchmark_models(app, args.loaded_images, args.repeat)
+
+    print(f"\n{len(args.loaded_images)} images, {args.repeat} runs each, det_size={tuple(args.det_size)}")
+    print(f"{'model':<16}{'file':<28}{'ms/call':>10}{'calls':>8}{'ms/frame':>10}  status")
+    total_all = 0.0
+    total_kept = 0.0
+    for task, values in results.items():
+        per_call = per_call_ms(values)
+        # Detection runs once per frame, the other heads once per face
+        per_frame = per_call if task == 'detection' else per_call * args.faces_per_frame
+        enabled = kept is None or task in kept
+        total_all += per_frame
+        total_kept += per_frame if enabled else 0.0
+        file_name = str(values['file']).split('/')[-1]
+        print(f"{task:<16}{file_name:<28}{per_call:>10.2f}{values['calls']:>8}{per_frame:>10.2f}  "
+              f"{'loaded' if enabled else 'skipped'}")
+
+    saved = total_all - total_kept
+    print(f"\nAll models       : {total_all:.2f} ms/frame ({args.faces_per_frame:g} faces)")
+    print(f"Configured models: {total_kept:.2f} ms/frame ({', '.join(kept) if kept else 'all'})")
+    print(f"Saved            : {saved:.2f} ms/frame ({saved / total_all * 100 if total_all else 0.0:.1f}%)")
+
+def compare_settings(args, specs):
+    """Detection + recognition latency for every combination of the given backend settings"""
+    base = face_analysis_options(specs)
+    base.update({'det_size': tuple(args.det_size), 'allowed_modules': DEFAULT_ALLOWED_MODULES})
+    if args.providers:
+        base['providers'] = args.providers
+
+    model_sets = [('pack', {})]
+    if args.detector_model or args.recognizer_model:
+        model_sets.append(('custom', {'detection': args.detector_model or '',
+                                      'recognition': args.recognizer_model or ''}))
+
+    combinations = itertools.product(args.intra_threads, args.inter_threads, args.execution_mode,
+                                     args.graph_optimization, model_sets)
+    print(f"\n{'intra':>6}{'inter':>6}  {'mode':<11}{'graph opt':<10}{'models':<8}"
+          f"{'det ms':>9}{'rec ms':>9}{'ms/frame':>10}{'fps':>8}")
+    for intra, inter, mode, graph_optimization, (models_name, model_paths) in combinations:
+        options = dict(base)
+        options['session_settings'] = dict(base['session_settings'], intra_op_threads=intra, inter_op_threads=inter,
+                                           execution_mode=mode, graph_optimization=graph_optimization)
+        options['model_paths'] = model_paths
+        app = create_face_analysis(report=False, **options)
+        results, _ = benchmark_models(app, args.loaded_images, args.repeat)
+        det_ms = per_call_ms(results['detection'])
+        rec_ms = per_call_ms(results['recognition']) if 'recognition' in results else 0.0
+        per_frame = det_ms + rec_ms * args.faces_per_frame
+        print(f"{intra:>6}{inter:>6}  {mode:<11}{graph_optimization:<10}{models_name:<8}"
+              f"{det_ms:>9.2f}{rec_ms:>9.2f}{per_frame:>10.2f}{1000.0 / per_frame if per_frame else 0.0:>8.1f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark InsightFace per-model latency and backend settings")
+    parser.add_argument("--images", nargs="+", default=["data/registered_faces/*.jpg"])
+    parser.add_argument("--det-size", type=int, nargs=2, default=[640, 640])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--pad", type=float, default=0.5, help="border added around each image (fraction of its size)")
+    parser.add_argument("--modules", nargs="+", default=None,
+                        help="modules to keep (default: insightface_modules from parameter_config.json)")
+    parser.add_argument("--faces-per-frame", type=float, default=3.0,
+                        help="average faces per camera frame used for the per-frame estimate")
+    parser.add_argument("--compare", action="store_true", help="compare onnxruntime settings instead of models")
+    parser.add_argument("--providers", default=None, help="comma-separated execution providers")
+    parser.add_argument("--intra-threads", type=int, nargs="+", default=[0])
+    parser.add_argument("--inter-threads", type=int, nargs="+", default=[0])
+    parser.add_argument("--execution-mode", nargs="+", default=["sequential"], choices=["sequential", "parallel"])
+    parser.add_argument("--graph-optimization", nargs="+", default=["all"],
+                        choices=["disable", "basic", "extended", "all"])
+    parser.add_argument("--detector-model", default=None, help="alternative detector ONNX file (e.g. INT8)")
+    parser.add_argument("--recognizer-model", default=None, help="alternative recognizer ONNX file (e.g. INT8)")
+    args = parser.parse_args()
+
+    args.loaded_images = load_images(args.images, args.pad)
+    if not args.loaded_images:
+        print("[ERROR] No benchmark images found")
+        return
+
+    specs = load_specs()
+    if args.compare:
+        compare_settings(args, specs)
+    else:
+        report_modules(args, specs)
+
+if __name__ == "__main__":
+    main()
@@ -7,10 +7,12 @@ import threading
 import time
 import os
 import json
+from collections import deque
 from pathlib import Path
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Boolean, Text
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Text
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
+from db_engine import get_engine
 
 # Define Camera model locally
 Base = declarative_base()
@@ -24,8 +26,8 @@ class Camera(Base):
     status = Column(String, default='offline')  # 'online', 'offline', 'error'
     is_active = Column(Boolean, default=False)
 
-# Setup database engine and session
-engine = create_engine("sqlite:///attendance.db")
+# Setup database engine and session (same shared engine as db_manager)
+engine = get_engine()
 SessionLocal = sessionmaker(bind=engine)
 
 # Camera configurations directory
@@ -111,6 +113,11 @@ def load_cameras_from_json(json_path, field_name, place_name):
                 'status': 'offline',
                 'is_active': False
             }
+            # Optional detector input and preview settings (see detection_regions, frame_broadcaster)
+            for key in ('roi', 'roi_mask', 'detection_size', 'motion_gate', 'motion_sensitivity',
+                        'preview_profiles', 'preview_default_profile'):
+                if key in camera_data:
+                    config[key] = camera_data[key]
             configs.append(config)
         
         return configs
@@ -118,6 +125,20 @@ def load_cameras_from_json(json_path, field_name, place_name):
         print(f"[ERROR] Error loading cameras from {json_path}: {e}")
         return []
 
+def get_camera_config(camera_id):
+    """Folder/field config of one camera (including optional keys such as "roi"), or None.
+    
+    The dashboard starts streams with the RTSP URL as camera ID, so the URL matches too.
+    """
+    configs = get_camera_configs_from_folders()
+    for config in configs:
+        if config['id'] == camera_id:
+            return config
+    for config in configs:
+        if config.get('rtsp_url') == camera_id:
+            return config
+    return None
+
 def save_camera_config_to_folder(folder_path, config_data):
     """Save camera configuration to a folder"""
     try:
@@ -359,5 +380,140 @@ class CameraManager:
         """Get all camera configurations (from folders and database)"""
         return get_all_camera_configs()
 
+class LatestFrameGrabber:
+    """Reads one camera on its own thread and keeps only the newest frames.
+    
+    Decoded frames go into a drop-oldest ring of `buffer_size` frames (1 =
+    always the latest frame), so a slow consumer never makes RTSP frames
+    pile up in the decoder; it simply skips stale ones. The reader thread
+    also owns reconnecting when the stream drops.
+    """
+    
+    def __init__(self, camera_id, source, buffer_size=1, reconnect_delay=2.0, open_retry_delay=5.0, on_error=None):
+        self.camera_id = camera_id
+        self.source = source
+        self.buffer_size = max(1, int(buffer_size))
+        self.reconnect_delay = reconnect_delay
+        self.open_retry_delay = open_retry_delay
+        self.on_error = on_error  # dipanggil saat kamera tidak bisa dibuka / terputus
+        self._frames = deque(maxlen=self.buffer_size)
+        self._condition = threading.Condition()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.connected = False
+        self.stats = {
+            'captured': 0,
+            'dropped': 0,
+            'processed': 0,
+            'reconnects': 0
+        }
+        self._started_at = None
+    
+    def _open_capture(self):
+        if str(self.source).isdigit():
+            # Webcam input
+            cap = cv2.VideoCapture(int(self.source))
+        else:
+            # RTSP stream
+            cap = cv2.VideoCapture(self.source)
+        # Set buffer size to reduce latency
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return cap
+    
+    def _report_error(self):
+        if self.on_error:
+            try:
+                self.on_error()
+            except Exception as e:
+                print(f"[CAMERA MANAGER] Error in error callback for camera {self.camera_id}: {e}")
+    
+    def start(self):
+        """Start the reader thread"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop_event.clear()
+            self._started_at = time.time()
+            self._thread = threading.Thread(target=self._reader_loop, name=f"grabber-{self.camera_id}", daemon=True)
+            self._thread.start()
+        return self
+    
+    def stop(self, timeout=5):
+        """Stop the reader thread and wake up any waiting consumer"""
+        self._stop_event.set()
+        with self._condition:
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+    
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+    
+    def _reader_loop(self):
+        cap = None
+        try:
+            while not self._stop_event.is_set():
+                if cap is None:
+                    cap = self._open_capture()
+                    if not cap.isOpened():
+                        cap.release()
+                        cap = None
+                        self.connected = False
+                        self._report_error()
+                        # Wait longer before next reconnect attempt
+                        self._stop_event.wait(self.open_retry_delay)
+                        continue
+                    self.connected = True
+                
+                ret, frame = cap.read()
+                if not ret:
+                    # Stream dropped: release and reconnect
+                    print(f"[CAMERA MANAGER] Lost frames from camera {self.camera_id}, reconnecting...")
+                    cap.release()
+                    cap = None
+                    self.connected = False
+                    self.stats['reconnects'] += 1
+                    self._stop_event.wait(self.reconnect_delay)
+                    continue
+                
+                with self._condition:
+                    if len(self._frames) == self._frames.maxlen:
+                        # Ring is full: the oldest frame is overwritten without being processed
+                        self.stats['dropped'] += 1
+                    self._frames.append(frame)
+                    self.stats['captured'] += 1
+                    self._condition.notify()
+        except Exception as e:
+            print(f"[CAMERA MANAGER] Error in frame grabber for camera {self.camera_id}: {e}")
+        finally:
+            self.connected = False
+            if cap is not None:
+                cap.release()
+    
+    def read(self, timeout=1.0):
+        """Take the oldest buffered frame (the newest when buffer_size is 1).
+        
+        Blocks up to `timeout` seconds; returns None if no frame arrived or the
+        grabber is stopping.
+        """
+        with self._condition:
+            if not self._frames and not self._stop_event.is_set():
+                self._condition.wait(timeout)
+            if not self._frames:
+                return None
+            self.stats['processed'] += 1
+            return self._frames.popleft()
+    
+    def get_stats(self):
+        """Captured / dropped / processed counters and capture rate"""
+        with self._condition:
+            stats = dict(self.stats)
+            stats['buffered'] = len(self._frames)
+        elapsed = time.time() - self._started_at if self._started_at else 0
+        stats['capture_fps'] = stats['captured'] / elapsed if elapsed > 0 else 0.0
+        stats['processed_fps'] = stats['processed'] / elapsed if elapsed > 0 else 0.0
+        stats['buffer_size'] = self.buffer_size
+        stats['connected'] = self.connected
+        return stats
+
 # Global instance
 camera_manager = CameraManager()
\ No newline at end of file
@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+# compact_locations.py
+# One-off migration: fold per-frame employee_locations rows into dwell intervals
+#
+# application.py runs this on startup with the configured dwell_gap_seconds; use
+# this script to compact without starting the application, to pick a different
+# gap, or to reclaim the freed space with VACUUM afterwards.
+#
+# Usage: python compact_locations.py --gap 30 --vacuum
+
+import argparse
+from sqlalchemy import text
+from db_manager import engine, compact_employee_locations, DWELL_GAP_SECONDS
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact employee_locations into employee_dwell_intervals")
+    parser.add_argument("--gap", type=float, default=DWELL_GAP_SECONDS,
+                        help="max seconds between sightings on one camera within an interval")
+    parser.add_argument("--vacuum", action="store_true", help="VACUUM the database afterwards")
+    args = parser.parse_args()
+
+    rows, intervals = compact_employee_locations(gap_seconds=args.gap)
+    print(f"[INFO] {rows} location rows -> {intervals} dwell intervals")
+
+    if args.vacuum:
+        with engine.connect() as conn:
+            conn.execute(text("VACUUM"))
+        print("[INFO] Database vacuumed")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# db_engine.py
+# Shared SQLite engine factory: WAL mode, connection pragmas and index migrations
+
+import threading
+from sqlalchemy import create_engine, event, text
+
+DATABASE_URL = "sqlite:///attendance.db"
+
+# Applied to every new SQLite connection
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",      # pembaca tidak diblokir oleh penulis (kamera vs request Flask)
+    "synchronous": "NORMAL",    # aman dengan WAL, fsync hanya saat checkpoint
+    "cache_size": -65536,       # 64 MiB page cache per koneksi (nilai negatif = KiB)
+    "busy_timeout": 5000,       # tunggu lock hingga 5 detik sebelum "database is locked"
+    "temp_store": "MEMORY",
+}
+
+# Secondary indexes used by the dashboard and roster queries: (name, table, columns)
+SQLITE_INDEXES = [
+    ("ix_attendance_employee_timestamp", "attendance", "employee_name, timestamp"),
+    ("ix_attendance_timestamp", "attendance", "timestamp"),
+    ("ix_employee_locations_employee_timestamp", "employee_locations", "employee_name, timestamp"),
+    ("ix_employee_dwell_intervals_employee_exit", "employee_dwell_intervals", "employee_name, exit_ts"),
+    ("ix_employee_dwell_intervals_camera_exit", "employee_dwell_intervals", "camera_id, exit_ts"),
+    ("ix_employee_status_status", "employee_status", "status"),
+]
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+def _apply_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+def get_engine(url=DATABASE_URL):
+    """Return the process-wide engine for a database URL, creating it on first use.
+
+    Every module that opens the same database shares one engine (and so one
+    connection pool); SQLite connections get the SQLITE_PRAGMAS on connect.
+    """
+    with _engines_lock:
+        engine = _engines.get(url)
+        if engine is None:
+            if url.startswith("sqlite"):
+                engine = create_engine(url, connect_args={"check_same_thread": False, "timeout": 30})
+                event.listen(engine, "connect", _apply_pragmas)
+            else:
+                engine = create_engine(url)
+            _engines[url] = engine
+        return engine
+
+def ensure_indexes(engine, indexes=SQLITE_INDEXES):
+    """Create the secondary indexes for tables present in this database; returns names created"""
+    created = []
+    with engine.begin() as conn:
+        tables = {row[0] for row in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+        existing = {row[0] for row in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'"))}
+        for name, table, columns in indexes:
+            if table in tables and name not in existing:
+                conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+                created.append(name)
+        if created:
+            # Refresh planner statistics so the new indexes are picked up
+            conn.execute(text("ANALYZE"))
+    if created:
+        print(f"[DB ENGINE] Created indexes: {', '.join(created)}")
+    return created
+
+def get_sqlite_settings(engine):
+    """Effective pragma values of a pooled connection, for startup reports"""
+    with engine.connect() as conn:
+        return {name: conn.execute(text(f"PRAGMA {name}")).scalar() for name in SQLITE_PRAGMAS}
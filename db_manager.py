@@ -2,14 +2,24 @@
 # db_manager.py
 # Database manager for the face recognition system
 
-import pickle
-from datetime import datetime
-from sqlalchemy import create_engine, and_, Column, Integer, String, DateTime, Boolean, Text, ForeignKey, LargeBinary
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import and_, text, Column, Integer, String, DateTime, Boolean, Text, ForeignKey, LargeBinary
 from sqlalchemy.orm import sessionmaker, relationship
 from sqlalchemy.ext.declarative import declarative_base
+from db_engine import get_engine, ensure_indexes, get_sqlite_settings
+from embedding_store import (
+    decode_embedding,
+    install_roster_version_triggers,
+    migrate_embeddings_to_binary,
+    load_roster,
+    RosterCache
+)
 
-# Setup database engine and session
-engine = create_engine("sqlite:///attendance.db")
+# Setup database engine and session (shared, WAL-mode engine; see db_engine.py)
+engine = get_engine()
 SessionLocal = sessionmaker(bind=engine)
 
 # Define base for models
@@ -20,11 +30,22 @@ class Employee(Base):
     __tablename__ = "employees"
     id = Column(Integer, primary_key=True)
     name = Column(String, unique=True)
-    embedding = Column(LargeBinary)  # simpan numpy array sebagai binary
+    embedding = Column(LargeBinary)  # float32 little-endian dengan header (lihat embedding_store.py)
     
     # Relationships
     status_record = relationship("EmployeeStatus", back_populates="employee", uselist=False)
     locations = relationship("EmployeeLocation", back_populates="employee")
+    embedding_samples = relationship("EmployeeEmbedding", back_populates="employee", cascade="all, delete-orphan")
+
+class EmployeeEmbedding(Base):
+    __tablename__ = "employee_embeddings"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    employee_id = Column(Integer, ForeignKey('employees.id'), nullable=False, index=True)
+    embedding = Column(LargeBinary, nullable=False)  # satu sampel embedding hasil registrasi (format binary)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    
+    # Relationship to Employee
+    employee = relationship("Employee", back_populates="embedding_samples")
 
 class Attendance(Base):
     __tablename__ = "attendance"
@@ -66,10 +87,100 @@ class EmployeeLocation(Base):
     employee = relationship("Employee", back_populates="locations")
     camera = relationship("Camera")
 
+class EmployeeDwellInterval(Base):
+    __tablename__ = "employee_dwell_intervals"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    employee_name = Column(String, ForeignKey('employees.name'), nullable=False)
+    camera_id = Column(String, ForeignKey('cameras.id'), nullable=False)
+    enter_ts = Column(DateTime, nullable=False)     # pertama kali terlihat di kamera ini
+    exit_ts = Column(DateTime, nullable=False)      # terakhir kali terlihat di kamera ini
+    frame_count = Column(Integer, default=1)        # jumlah frame yang mengenali karyawan ini
+    
+    # Relationships
+    employee = relationship("Employee")
+    camera = relationship("Camera")
+
 # Add relationships to the Employee model
 Employee.status_record = relationship("EmployeeStatus", back_populates="employee", uselist=False)
 Employee.locations = relationship("EmployeeLocation", back_populates="employee")
 
+# Create tables that do not exist yet (e.g. employee_embeddings on older databases)
+Base.metadata.create_all(engine)
+
+# Secondary indexes for the dashboard queries
+try:
+    ensure_indexes(engine)
+    print(f"[DB MANAGER] SQLite settings: {get_sqlite_settings(engine)}")
+except Exception as e:
+    print(f"[DB MANAGER] Error preparing database indexes: {e}")
+
+# Roster version counter for the embedding cache, and one-time conversion of pickled embeddings
+try:
+    install_roster_version_triggers(engine)
+    migrate_embeddings_to_binary(engine)
+except Exception as e:
+    print(f"[DB MANAGER] Error preparing embedding storage: {e}")
+
+roster_cache = RosterCache()
+
+# Sightings further apart than this (on the same camera) start a new dwell interval
+DWELL_GAP_SECONDS = 30
+
+def compact_employee_locations(gap_seconds=DWELL_GAP_SECONDS, batch_size=5000):
+    """Fold per-frame employee_locations rows into dwell intervals.
+    
+    Consecutive rows of one employee on the same camera, no more than
+    `gap_seconds` apart, become one interval. Compacted rows are deleted,
+    so running this again only touches rows written since. Returns
+    (rows_compacted, intervals_written).
+    """
+    gap = timedelta(seconds=gap_seconds)
+    intervals = []
+    current = None
+    max_id = None
+    rows_compacted = 0
+    
+    with engine.begin() as conn:
+        result = conn.execute(text(
+            "SELECT id, employee_name, camera_id, timestamp FROM employee_locations "
+            "ORDER BY employee_name, timestamp, id"
+        ))
+        for row_id, employee_name, camera_id, timestamp in result:
+            if isinstance(timestamp, str):
+                timestamp = datetime.fromisoformat(timestamp)
+            rows_compacted += 1
+            max_id = row_id if max_id is None else max(max_id, row_id)
+            if (current is not None
+                    and current['employee_name'] == employee_name
+                    and current['camera_id'] == camera_id
+                    and timestamp - current['exit_ts'] <= gap):
+                current['exit_ts'] = timestamp
+                current['frame_count'] += 1
+                continue
+            if current is not None:
+                intervals.append(current)
+            current = {
+                'employee_name': employee_name,
+                'camera_id': camera_id,
+                'enter_ts': timestamp,
+                'exit_ts': timestamp,
+                'frame_count': 1
+            }
+        if current is not None:
+            intervals.append(current)
+        
+        if not rows_compacted:
+            return 0, 0
+        
+        insert = EmployeeDwellInterval.__table__.insert()
+        for i in range(0, len(intervals), batch_size):
+            conn.execute(insert, intervals[i:i + batch_size])
+        conn.execute(text("DELETE FROM employee_locations WHERE id <= :max_id"), {"max_id": max_id})
+    
+    print(f"[DB MANAGER] Compacted {rows_compacted} location rows into {len(intervals)} dwell intervals")
+    return rows_compacted, len(intervals)
+
 class DatabaseManager:
     """Manager for all database operations"""
     
@@ -79,7 +190,7 @@ class DatabaseManager:
         try:
             session = SessionLocal()
             employees = session.query(Employee).all()
-            data = [(emp.name, pickle.loads(emp.embedding)) for emp in employees]
+            data = [(emp.name, decode_embedding(emp.embedding)) for emp in employees]
             session.close()
             return data
         except Exception as e:
@@ -92,13 +203,54 @@ class DatabaseManager:
         try:
             session = SessionLocal()
             employees = session.query(Employee).all()
-            data = [(emp.id, emp.name, pickle.loads(emp.embedding)) for emp in employees]
+            data = [(emp.id, emp.name, decode_embedding(emp.embedding)) for emp in employees]
             session.close()
             return data
         except Exception as e:
             print(f"[DB MANAGER] Error getting employees with IDs: {e}")
             return []
     
+    @staticmethod
+    def load_roster():
+        """Load names, ids and embedding matrices of the whole roster in one pass.
+        
+        Served from the on-disk roster cache while the roster version counter
+        is unchanged; returns None on error.
+        """
+        try:
+            session = SessionLocal()
+            roster = load_roster(session, roster_cache)
+            session.close()
+            return roster
+        except Exception as e:
+            print(f"[DB MANAGER] Error loading roster: {e}")
+            return None
+    
+    @staticmethod
+    def get_employee_names():
+        """Get the names of all employees without loading their embeddings"""
+        try:
+            session = SessionLocal()
+            names = [name for (name,) in session.query(Employee.name).order_by(Employee.id).all()]
+            session.close()
+            return names
+        except Exception as e:
+            print(f"[DB MANAGER] Error getting employee names: {e}")
+            return []
+    
+    @staticmethod
+    def get_all_employee_samples():
+        """Get all registered embedding samples as (employee_id, embedding) pairs"""
+        try:
+            session = SessionLocal()
+            samples = session.query(EmployeeEmbedding.employee_id, EmployeeEmbedding.embedding).all()
+            data = [(employee_id, decode_embedding(embedding)) for employee_id, embedding in samples]
+            session.close()
+            return data
+        except Exception as e:
+            print(f"[DB MANAGER] Error getting employee samples: {e}")
+            return []
+    
     @staticmethod
     def log_attendance(employee_name):
         """Log employee attendance to database"""
@@ -196,18 +348,328 @@ class DatabaseManager:
     
     @staticmethod
     def log_employee_location(employee_name, camera_id):
-        """Log employee location to database"""
+        """Log an employee sighting (aggregated into dwell intervals by the write-behind writer)"""
+        db_writer.submit_location(employee_name, camera_id)
+    
+    @staticmethod
+    def get_employee_location_history(employee_name, limit=10):
+        """Get the most recent dwell intervals of an employee, newest first.
+        
+        Each entry is a dict with camera_id, enter_ts, exit_ts and frame_count.
+        The interval still open in memory is included with its latest exit time.
+        """
         try:
             session = SessionLocal()
-            location = EmployeeLocation(
-                employee_name=employee_name,
-                camera_id=camera_id
-            )
-            session.add(location)
-            session.commit()
+            records = session.query(EmployeeDwellInterval).filter(
+                EmployeeDwellInterval.employee_name == employee_name
+            ).order_by(EmployeeDwellInterval.exit_ts.desc()).limit(limit).all()
             session.close()
+            
+            history = {
+                record.id: {
+                    'camera_id': record.camera_id,
+                    'enter_ts': record.enter_ts,
+                    'exit_ts': record.exit_ts,
+                    'frame_count': record.frame_count
+                }
+                for record in records
+            }
+            open_interval = db_writer.get_open_interval(employee_name)
+            if open_interval:
+                history[open_interval.pop('row_id') or 'open'] = open_interval
+            
+            return sorted(history.values(), key=lambda item: item['exit_ts'], reverse=True)[:limit]
+        except Exception as e:
+            print(f"[DB MANAGER] Error getting employee location history: {e}")
+            return []
+
+class DwellTracker:
+    """Open dwell interval per employee, kept in memory between sightings.
+    
+    A sighting on the same camera within `gap_seconds` of the last one just
+    extends the open interval; a camera change or a longer gap closes it.
+    Intervals are only handed out for persisting when they close or when a
+    periodic checkpoint is due, so the database sees a handful of writes
+    per visit instead of one row per frame.
+    """
+    
+    def __init__(self, gap_seconds=DWELL_GAP_SECONDS, checkpoint_seconds=60):
+        self.gap_seconds = gap_seconds
+        self.checkpoint_seconds = checkpoint_seconds
+        self._open = {}  # {employee_name: interval dict}
+        self._lock = threading.Lock()
+        self._last_checkpoint = time.monotonic()
+    
+    @staticmethod
+    def _new_interval(employee_name, camera_id, timestamp):
+        return {
+            'row_id': None,          # id di employee_dwell_intervals setelah pertama kali disimpan
+            'employee_name': employee_name,
+            'camera_id': camera_id,
+            'enter_ts': timestamp,
+            'exit_ts': timestamp,
+            'frame_count': 1,
+            'dirty': True
+        }
+    
+    def observe(self, employee_name, camera_id, timestamp):
+        """Record one sighting; returns the interval it closed, or None"""
+        with self._lock:
+            interval = self._open.get(employee_name)
+            if (interval is not None
+                    and interval['camera_id'] == camera_id
+                    and (timestamp - interval['exit_ts']).total_seconds() <= self.gap_seconds):
+                if timestamp > interval['exit_ts']:
+                    interval['exit_ts'] = timestamp
+                interval['frame_count'] += 1
+                interval['dirty'] = True
+                return None
+            self._open[employee_name] = self._new_interval(employee_name, camera_id, timestamp)
+            return interval
+    
+    def expire(self, now):
+        """Close and return intervals not extended within the gap"""
+        with self._lock:
+            expired = [name for name, interval in self._open.items()
+                       if (now - interval['exit_ts']).total_seconds() > self.gap_seconds]
+            return [self._open.pop(name) for name in expired]
+    
+    def checkpoint(self, force=False):
+        """Return open intervals changed since they were last persisted, once per checkpoint period"""
+        if not force and time.monotonic() - self._last_checkpoint < self.checkpoint_seconds:
+            return []
+        self._last_checkpoint = time.monotonic()
+        with self._lock:
+            return [interval for interval in self._open.values() if interval['dirty']]
+    
+    def close_all(self):
+        """Close and return every open interval (used on shutdown)"""
+        with self._lock:
+            intervals = list(self._open.values())
+            self._open.clear()
+            return intervals
+    
+    def get_open(self, employee_name):
+        """Copy of the employee's open interval, or None"""
+        with self._lock:
+            interval = self._open.get(employee_name)
+            if interval is None:
+                return None
+            return {key: interval[key] for key in ('row_id', 'camera_id', 'enter_ts', 'exit_ts', 'frame_count')}
+    
+    def __len__(self):
+        return len(self._open)
+
+class DatabaseWriteBehind:
+    """Write-behind queue for per-frame detection side effects.
+    
+    Camera threads submit status and location events without touching the
+    database. A single writer thread coalesces status updates per employee
+    (last one wins), batches location inserts and flushes everything in one
+    transaction every `flush_interval_ms` or `max_batch_events` events.
+    Location events feed a DwellTracker; only closed or checkpointed dwell
+    intervals are written.
+    """
+    
+    def __init__(self, flush_interval_ms=500, max_batch_events=500, max_queue_size=20000,
+                 dwell_gap_seconds=DWELL_GAP_SECONDS, dwell_checkpoint_seconds=60):
+        self.flush_interval_ms = flush_interval_ms
+        self.max_batch_events = max_batch_events
+        self.dwell = DwellTracker(dwell_gap_seconds, dwell_checkpoint_seconds)
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._start_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            'events_submitted': 0,
+            'events_dropped': 0,
+            'status_updates_coalesced': 0,
+            'flushes': 0,
+            'flush_errors': 0,
+            'rows_written': 0,
+            'location_events': 0,
+            'intervals_closed': 0,
+            'last_flush_ms': 0.0,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0,
+            'last_flush_events': 0
+        }
+    
+    def configure(self, flush_interval_ms=None, max_batch_events=None, dwell_gap_seconds=None,
+                  dwell_checkpoint_seconds=None):
+        """Update flush and dwell thresholds (takes effect on the next batch)"""
+        if flush_interval_ms is not None:
+            self.flush_interval_ms = flush_interval_ms
+        if max_batch_events is not None:
+            self.max_batch_events = max_batch_events
+        if dwell_gap_seconds is not None:
+            self.dwell.gap_seconds = dwell_gap_seconds
+        if dwell_checkpoint_seconds is not None:
+            self.dwell.checkpoint_seconds = dwell_checkpoint_seconds
+    
+    def start(self):
+        """Start the writer thread if it is not running"""
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop_event.clear()
+                self._thread = threading.Thread(target=self._run, name="db-write-behind", daemon=True)
+                self._thread.start()
+    
+    def stop(self, timeout=5):
+        """Stop the writer thread after flushing everything still queued"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+    
+    def _submit(self, event):
+        self.start()
+        try:
+            self._queue.put_nowait(event)
+            with self._metrics_lock:
+                self._metrics['events_submitted'] += 1
+        except queue.Full:
+            with self._metrics_lock:
+                self._metrics['events_dropped'] += 1
+    
+    def submit_status(self, employee_name, camera_id, status='available'):
+        """Queue an employee status update (timestamped now)"""
+        self._submit(('status', employee_name, camera_id, status, datetime.utcnow()))
+    
+    def submit_location(self, employee_name, camera_id):
+        """Queue an employee sighting for the dwell tracker (timestamped now)"""
+        self._submit(('location', employee_name, camera_id, None, datetime.utcnow()))
+    
+    def get_open_interval(self, employee_name):
+        """The employee's dwell interval that has not been closed yet, or None"""
+        return self.dwell.get_open(employee_name)
+    
+    def _run(self):
+        """Writer loop: collect events until a flush threshold is hit, then flush"""
+        while True:
+            stopping = self._stop_event.is_set() and self._queue.empty()
+            statuses = {}   # {employee_name: (camera_id, status, timestamp)}
+            intervals = []  # closed or checkpointed dwell intervals to persist
+            event_count = 0
+            deadline = time.monotonic() + self.flush_interval_ms / 1000.0
+            
+            while event_count < self.max_batch_events:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    kind, employee_name, camera_id, status, timestamp = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                event_count += 1
+                if kind == 'status':
+                    if employee_name in statuses:
+                        with self._metrics_lock:
+                            self._metrics['status_updates_coalesced'] += 1
+                    statuses[employee_name] = (camera_id, status, timestamp)
+                else:
+                    closed = self.dwell.observe(employee_name, camera_id, timestamp)
+                    with self._metrics_lock:
+                        self._metrics['location_events'] += 1
+                        if closed is not None:
+                            self._metrics['intervals_closed'] += 1
+                    if closed is not None:
+                        intervals.append(closed)
+            
+            if stopping:
+                closed = self.dwell.close_all()
+            else:
+                closed = self.dwell.expire(datetime.utcnow())
+            with self._metrics_lock:
+                self._metrics['intervals_closed'] += len(closed)
+            intervals.extend(closed)
+            intervals.extend(self.dwell.checkpoint())
+            
+            if event_count or intervals:
+                self._flush(statuses, intervals, event_count)
+            if stopping:
+                break
+    
+    def _flush(self, statuses, intervals, event_count):
+        """Write one batch in a single transaction"""
+        start = time.perf_counter()
+        session = SessionLocal()
+        try:
+            if statuses:
+                existing = {
+                    record.employee_name: record
+                    for record in session.query(EmployeeStatus).filter(
+                        EmployeeStatus.employee_name.in_(list(statuses.keys()))
+                    )
+                }
+                for employee_name, (camera_id, status, timestamp) in statuses.items():
+                    record = existing.get(employee_name)
+                    if record:
+                        record.status = status
+                        record.last_seen = timestamp
+                        record.current_camera = camera_id
+                    else:
+                        session.add(EmployeeStatus(
+                            employee_name=employee_name,
+                            status=status,
+                            last_seen=timestamp,
+                            current_camera=camera_id
+                        ))
+            new_rows = []
+            updates = []
+            for interval in intervals:
+                values = {
+                    'enter_ts': interval['enter_ts'],
+                    'exit_ts': interval['exit_ts'],
+                    'frame_count': interval['frame_count']
+                }
+                if interval['row_id'] is None:
+                    new_rows.append((interval, EmployeeDwellInterval(
+                        employee_name=interval['employee_name'],
+                        camera_id=interval['camera_id'],
+                        **values
+                    )))
+                elif interval['dirty']:
+                    updates.append(dict(values, id=interval['row_id']))
+            session.add_all([row for _, row in new_rows])
+            if updates:
+                session.bulk_update_mappings(EmployeeDwellInterval, updates)
+            session.commit()
+            
+            # Later checkpoints of a still-open interval update the row written now
+            for interval, row in new_rows:
+                interval['row_id'] = row.id
+            for interval in intervals:
+                interval['dirty'] = False
+            
+            elapsed_ms = (time.perf_counter() - start) * 1000.0
+            with self._metrics_lock:
+                self._metrics['flushes'] += 1
+                self._metrics['rows_written'] += len(statuses) + len(new_rows) + len(updates)
+                self._metrics['last_flush_ms'] = elapsed_ms
+                self._metrics['max_flush_ms'] = max(self._metrics['max_flush_ms'], elapsed_ms)
+                self._metrics['total_flush_ms'] += elapsed_ms
+                self._metrics['last_flush_events'] = event_count
         except Exception as e:
-            print(f"[DB MANAGER] Error logging employee location: {e}")
+            session.rollback()
+            with self._metrics_lock:
+                self._metrics['flush_errors'] += 1
+            print(f"[DB MANAGER] Error flushing write-behind batch: {e}")
+        finally:
+            session.close()
+    
+    def get_metrics(self):
+        """Queue depth and flush statistics"""
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+        total_flush_ms = metrics.pop('total_flush_ms')
+        metrics['avg_flush_ms'] = total_flush_ms / metrics['flushes'] if metrics['flushes'] else 0.0
+        metrics['queue_depth'] = self._queue.qsize()
+        metrics['open_intervals'] = len(self.dwell)
+        metrics['running'] = self._thread is not None and self._thread.is_alive()
+        return metrics
 
 # Global instance
-db_manager = DatabaseManager()
\ No newline at end of file
+db_manager = DatabaseManager()
+db_writer = DatabaseWriteBehind()
\ No newline at end of file
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# detection_regions.py
+# Per-camera detector input: regions of interest (packed crops) and detection size selection
+
+import time
+from collections import deque
+import cv2
+import numpy as np
+
+class DetectionRegions:
+    """Regions of a camera view where faces can appear.
+
+    Each region is a rectangle [x1, y1, x2, y2] or a polygon [[x, y], ...],
+    in pixels or, when every value is <= 1, as fractions of the frame size.
+    Coordinates refer to the frame as shown in the dashboard (after the mirror
+    flip). The bounding rectangles of the regions are cut out and packed onto
+    one canvas, so the detector spends its whole input size on the regions
+    instead of the full frame. With `mask_outside`, pixels outside a polygon
+    are blanked and detections centred outside every region are dropped.
+    """
+
+    def __init__(self, regions, mask_outside=True, gap=8):
+        self.regions = regions
+        self.mask_outside = mask_outside
+        self.gap = gap
+        self._frame_shape = None
+        self._crops = []  # [{'rect': (x1, y1, x2, y2), 'offset': (ox, oy), 'polygon', 'mask'}]
+        self._canvas_size = (0, 0)
+        self._single_rect = False
+
+    @classmethod
+    def from_config(cls, camera_config):
+        """DetectionRegions from a camera config's "roi" / "roi_mask" keys, or None without regions"""
+        regions = (camera_config or {}).get('roi') or []
+        if not regions:
+            return None
+        # A single rectangle may be given without the enclosing list
+        if len(regions) == 4 and all(isinstance(value, (int, float)) for value in regions):
+            regions = [regions]
+        return cls(regions, mask_outside=(camera_config or {}).get('roi_mask', True))
+
+    @staticmethod
+    def parse_region(region, width, height):
+        """Polygon (K x 2 int32, full-frame pixels) of one configured region"""
+        points = np.asarray(region, dtype=np.float64)
+        if points.ndim == 1:
+            if points.size != 4:
+                raise ValueError(f"Rectangle ROI needs 4 values, got {region}")
+            x1, y1, x2, y2 = points
+            points = np.array([[x1, y1], [x2, y1], [x2, y2], [x1, y2]])
+        if points.ndim != 2 or points.shape[1] != 2 or len(points) < 3:
+            raise ValueError(f"Invalid ROI polygon: {region}")
+        if points.max() <= 1.0:
+            points = points * [width, height]
+        points[:, 0] = np.clip(points[:, 0], 0, width - 1)
+        points[:, 1] = np.clip(points[:, 1], 0, height - 1)
+        return np.round(points).astype(np.int32)
+
+    def _build(self, frame_shape):
+        """Lay the region crops out on a canvas (shelf packing, roughly square)"""
+        height, width = frame_shape[:2]
+        crops = []
+        for region in self.regions:
+            try:
+                polygon = self.parse_region(region, width, height)
+            except ValueError as e:
+                print(f"[ROI] {e}")
+                continue
+            x1, y1 = polygon.min(axis=0)
+            x2, y2 = polygon.max(axis=0) + 1
+            if x2 - x1 < 2 or y2 - y1 < 2:
+                continue
+            mask = None
+            is_rect = len(polygon) == 4 and len(np.unique(polygon[:, 0])) == 2 and len(np.unique(polygon[:, 1])) == 2
+            if self.mask_outside and not is_rect:
+                mask = np.zeros((y2 - y1, x2 - x1), dtype=np.uint8)
+                cv2.fillPoly(mask, [polygon - [x1, y1]], 255)
+            crops.append({'rect': (int(x1), int(y1), int(x2), int(y2)), 'polygon': polygon, 'mask': mask})
+
+        # Tallest crops first; a new shelf starts when the row would exceed the target width
+        total_area = sum((c['rect'][2] - c['rect'][0]) * (c['rect'][3] - c['rect'][1]) for c in crops)
+        target_width = max([int(np.sqrt(total_area))] + [c['rect'][2] - c['rect'][0] for c in crops]) if crops else 0
+        x = y = shelf_height = canvas_width = 0
+        for crop in sorted(crops, key=lambda c: c['rect'][3] - c['rect'][1], reverse=True):
+            crop_width = crop['rect'][2] - crop['rect'][0]
+            crop_height = crop['rect'][3] - crop['rect'][1]
+            if x > 0 and x + crop_width > target_width:
+                x = 0
+                y += shelf_height + self.gap
+                shelf_height = 0
+            crop['offset'] = (x, y)
+            x += crop_width + self.gap
+            shelf_height = max(shelf_height, crop_height)
+            canvas_width = max(canvas_width, x - self.gap)
+
+        self._crops = crops
+        self._canvas_size = (canvas_width, y + shelf_height)
+        self._single_rect = len(crops) == 1 and crops[0]['mask'] is None
+        self._frame_shape = frame_shape[:2]
+        coverage = total_area / float(width * height) * 100
+        print(f"[ROI] {len(crops)} region(s), detector input {self._canvas_size[0]}x{self._canvas_size[1]} "
+              f"({coverage:.0f}% of the {width}x{height} frame)")
+
+    def pack(self, frame):
+        """Detector input containing only the regions of this frame"""
+        if self._frame_shape != frame.shape[:2]:
+            self._build(frame.shape)
+        if not self._crops:
+            return frame
+        if self._single_rect:
+            x1, y1, x2, y2 = self._crops[0]['rect']
+            return frame[y1:y2, x1:x2]
+        canvas = np.zeros((self._canvas_size[1], self._canvas_size[0]) + frame.shape[2:], dtype=frame.dtype)
+        for crop in self._crops:
+            x1, y1, x2, y2 = crop['rect']
+            ox, oy = crop['offset']
+            patch = frame[y1:y2, x1:x2]
+            if crop['mask'] is not None:
+                patch = cv2.bitwise_and(patch, patch, mask=crop['mask'])
+            canvas[oy:oy + y2 - y1, ox:ox + x2 - x1] = patch
+        return canvas
+
+    def input_shape(self, frame_shape):
+        """(height, width) of the image the detector receives for frames of this shape"""
+        if self._frame_shape != frame_shape[:2]:
+            self._build(frame_shape)
+        if not self._crops:
+            return frame_shape[:2]
+        return self._canvas_size[1], self._canvas_size[0]
+
+    def unpack(self, bboxes, kpss):
+        """Map detector outputs on the packed canvas back to full-frame coordinates.
+
+        bboxes: N x 5 (x1, y1, x2, y2, score); kpss: N x 5 x 2 or None. Detections
+        whose centre is not inside a region are dropped.
+        """
+        if not self._crops or bboxes.shape[0] == 0:
+            return bboxes, kpss
+        centers = np.stack([(bboxes[:, 0] + bboxes[:, 2]) / 2, (bboxes[:, 1] + bboxes[:, 3]) / 2], axis=1)
+        shifts = np.zeros((bboxes.shape[0], 2), dtype=bboxes.dtype)
+        keep = np.zeros(bboxes.shape[0], dtype=bool)
+        for crop in self._crops:
+            x1, y1, x2, y2 = crop['rect']
+            ox, oy = crop['offset']
+            inside = ((centers[:, 0] >= ox) & (centers[:, 0] < ox + x2 - x1)
+                      & (centers[:, 1] >= oy) & (centers[:, 1] < oy + y2 - y1) & ~keep)
+            if crop['mask'] is not None:
+                for index in np.flatnonzero(inside):
+                    point = (float(centers[index, 0] - ox + x1), float(centers[index, 1] - oy + y1))
+                    inside[index] = cv2.pointPolygonTest(crop['polygon'], point, False) >= 0
+            shifts[inside] = (x1 - ox, y1 - oy)
+            keep |= inside
+        bboxes = bboxes[keep].copy()
+        bboxes[:, 0:4] += np.tile(shifts[keep], 2)
+        if kpss is not None:
+            kpss = kpss[keep] + shifts[keep][:, None, :]
+        return bboxes, kpss
+
+    def draw(self, frame, color=(255, 200, 0)):
+        """Outline the regions on a preview frame"""
+        if self._frame_shape != frame.shape[:2]:
+            self._build(frame.shape)
+        cv2.polylines(frame, [crop['polygon'] for crop in self._crops], True, color, 1)
+
+    def outlines(self, frame_shape):
+        """Region polygons as [[x, y], ...] lists (full-frame pixels), for client-side overlays"""
+        if self._frame_shape != frame_shape[:2]:
+            self._build(frame_shape)
+        return [crop['polygon'].tolist() for crop in self._crops]
+
+    def get_stats(self):
+        if self._frame_shape is None:
+            return {'regions': len(self.regions)}
+        height, width = self._frame_shape
+        return {
+            'regions': len(self._crops),
+            'detector_input': list(self._canvas_size),
+            'frame_coverage': self._canvas_size[0] * self._canvas_size[1] / float(width * height)
+        }
+
+class DetectionSizeSelector:
+    """Picks the detector input size of one camera stream.
+
+    With a fixed size it always returns that size. In auto mode it keeps the
+    heights of recently detected faces (in pixels of the image given to the
+    detector) and picks the smallest candidate size at which the small end of
+    that distribution (`percentile`) still scales to at least `min_face_px`
+    detector pixels. Faces that only the largest size can find would never be
+    observed at a smaller size, so every `probe_interval` seconds one
+    inference runs at the largest candidate.
+    """
+
+    def __init__(self, sizes=((320, 320), (480, 480), (640, 640)), fixed_size=None, min_face_px=24,
+                 percentile=10, window=200, min_samples=20, probe_interval=30.0):
+        self.sizes = sorted((tuple(int(v) for v in size) for size in sizes), key=lambda size: size[0] * size[1])
+        self.fixed_size = tuple(int(v) for v in fixed_size) if fixed_size else None
+        self.min_face_px = min_face_px
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.probe_interval = probe_interval
+        self._face_heights = deque(maxlen=window)
+        self._last_probe = 0.0
+        self._current = self.fixed_size or self.sizes[-1]
+        self.stats = {'selections': {}, 'probes': 0}
+
+    @classmethod
+    def from_config(cls, camera_config, specs):
+        """Selector from a camera's "detection_size" ([w, h] or "auto") and the global specs"""
+        camera_size = (camera_config or {}).get('detection_size')
+        mode = 'auto' if camera_size == 'auto' else specs.get('detection_size_mode', 'fixed')
+        fixed_size = None
+        if mode != 'auto':
+            fixed_size = camera_size if camera_size and camera_size != 'auto' else specs.get('detection_size', (640, 640))
+        return cls(
+            sizes=specs.get('detection_sizes', [(320, 320), (480, 480), (640, 640)]),
+            fixed_size=fixed_size,
+            min_face_px=specs.get('detection_min_face_px', 24),
+            probe_interval=specs.get('detection_size_probe_s', 30.0)
+        )
+
+    @property
+    def auto(self):
+        return self.fixed_size is None
+
+    @staticmethod
+    def scale(input_shape, size):
+        """Letterbox scale the detector applies to an image of input_shape (h, w)"""
+        height, width = input_shape[:2]
+        return min(size[0] / float(width), size[1] / float(height))
+
+    def select(self, input_shape, now=None):
+        """Detector input size for the next inference on an image of input_shape (h, w)"""
+        if not self.auto:
+            return self.fixed_size
+        now = now if now is not None else time.time()
+        if now - self._last_probe >= self.probe_interval:
+            self._last_probe = now
+            self.stats['probes'] += 1
+            size = self.sizes[-1]
+        elif len(self._face_heights) < self.min_samples:
+            size = self._current
+        else:
+            small_face = float(np.percentile(self._face_heights, self.percentile))
+            size = self.sizes[-1]
+            for candidate in self.sizes:
+                if small_face * self.scale(input_shape, candidate) >= self.min_face_px:
+                    size = candidate
+                    break
+            self._current = size
+        key = f"{size[0]}x{size[1]}"
+        self.stats['selections'][key] = self.stats['selections'].get(key, 0) + 1
+        return size
+
+    def observe(self, faces):
+        """Record the heights of the faces detected on the last inference"""
+        if not self.auto:
+            return
+        for face in faces:
+            self._face_heights.append(float(face.bbox[3] - face.bbox[1]))
+
+    def get_stats(self):
+        stats = {
+            'mode': 'auto' if self.auto else 'fixed',
+            'current_size': list(self._current),
+            'selections': dict(self.stats['selections']),
+            'probes': self.stats['probes'],
+            'samples': len(self._face_heights)
+        }
+        if self._face_heights:
+            stats['face_height_p%d' % self.percentile] = float(np.percentile(self._face_heights, self.percentile))
+        return stats
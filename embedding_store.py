@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# embedding_store.py
+# Compact binary embedding format, roster version counter and on-disk roster cache
+
+import json
+import os
+import pickle
+import secrets
+import shutil
+import struct
+import numpy as np
+from sqlalchemy import text
+
+# Blob layout: magic (4 bytes) | format version (uint16) | dimension (uint32) | float32 little-endian payload
+EMBEDDING_MAGIC = b"FEMB"
+EMBEDDING_FORMAT_VERSION = 1
+EMBEDDING_HEADER = struct.Struct("<4sHI")
+EMBEDDING_DTYPE = np.dtype("<f4")
+
+ROSTER_CACHE_DIR = "embedding_cache"
+
+def encode_embedding(embedding):
+    """Serialize an embedding as header + raw little-endian float32"""
+    vector = np.ascontiguousarray(np.asarray(embedding).ravel(), dtype=EMBEDDING_DTYPE)
+    return EMBEDDING_HEADER.pack(EMBEDDING_MAGIC, EMBEDDING_FORMAT_VERSION, vector.size) + vector.tobytes()
+
+def is_encoded_embedding(blob):
+    """True if the blob uses the binary format (False for legacy pickled arrays)"""
+    return blob is not None and bytes(blob[:4]) == EMBEDDING_MAGIC
+
+def decode_embedding(blob):
+    """Deserialize one embedding blob, accepting legacy pickled arrays"""
+    if blob is None:
+        return None
+    if not is_encoded_embedding(blob):
+        return np.asarray(pickle.loads(blob), dtype=np.float32)
+    _, version, dim = EMBEDDING_HEADER.unpack_from(blob)
+    if version != EMBEDDING_FORMAT_VERSION:
+        raise ValueError(f"Unsupported embedding format version {version}")
+    return np.frombuffer(blob, dtype=EMBEDDING_DTYPE, count=dim, offset=EMBEDDING_HEADER.size)
+
+def decode_embedding_matrix(blobs):
+    """Decode many blobs into one contiguous (n, dim) float32 matrix.
+
+    When every blob is in the binary format with the same dimension the
+    payloads are joined and viewed with a single np.frombuffer call.
+    """
+    if not blobs:
+        return np.zeros((0, 0), dtype=np.float32)
+    header_size = EMBEDDING_HEADER.size
+    expected_length = len(blobs[0])
+    if is_encoded_embedding(blobs[0]) and all(len(b) == expected_length and is_encoded_embedding(b) for b in blobs):
+        _, version, dim = EMBEDDING_HEADER.unpack_from(blobs[0])
+        if version == EMBEDDING_FORMAT_VERSION:
+            payload = b"".join(bytes(b[header_size:]) for b in blobs)
+            return np.frombuffer(payload, dtype=EMBEDDING_DTYPE).reshape(len(blobs), dim).astype(np.float32, copy=False)
+    # Mixed or legacy rows: fall back to decoding row by row
+    return np.ascontiguousarray(np.stack([decode_embedding(b) for b in blobs]), dtype=np.float32)
+
+# Roster version counter ------------------------------------------------------
+
+ROSTER_VERSION_KEY = "roster_version"
+ROSTER_ID_KEY = "roster_id"
+ROSTER_TABLES = ("employees", "employee_embeddings")
+
+def install_roster_version_triggers(engine):
+    """Create the roster_meta counter and triggers that bump it on every roster change.
+
+    Triggers live in the database, so the counter stays correct no matter
+    which process (web app, command-line registration, another site) writes.
+    Next to the counter, roster_id is a random stamp that the triggers also
+    re-roll on every change. The counter alone repeats across databases (a
+    replaced or restored attendance.db starts again from an old value); the
+    stamp ties a cached roster to the database contents it was built from.
+    """
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE IF NOT EXISTS roster_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)"))
+        conn.execute(text("INSERT OR IGNORE INTO roster_meta (key, value) VALUES (:key, 0)"),
+                     {"key": ROSTER_VERSION_KEY})
+        conn.execute(text("INSERT OR IGNORE INTO roster_meta (key, value) VALUES (:key, :value)"),
+                     {"key": ROSTER_ID_KEY, "value": secrets.randbits(62)})
+        for table in ROSTER_TABLES:
+            for action in ("INSERT", "UPDATE", "DELETE"):
+                conn.execute(text(
+                    f"CREATE TRIGGER IF NOT EXISTS {table}_{action.lower()}_roster_version "
+                    f"AFTER {action} ON {table} BEGIN "
+                    f"UPDATE roster_meta SET value = value + 1 WHERE key = '{ROSTER_VERSION_KEY}'; END"
+                ))
+                conn.execute(text(
+                    f"CREATE TRIGGER IF NOT EXISTS {table}_{action.lower()}_roster_id "
+                    f"AFTER {action} ON {table} BEGIN "
+                    f"UPDATE roster_meta SET value = (random() & 9223372036854775807) WHERE key = '{ROSTER_ID_KEY}'; END"
+                ))
+
+def get_roster_version(session):
+    """(roster_id, version counter) of the current roster"""
+    values = dict(session.execute(text("SELECT key, value FROM roster_meta WHERE key IN (:id_key, :version_key)"),
+                                  {"id_key": ROSTER_ID_KEY, "version_key": ROSTER_VERSION_KEY}).fetchall())
+    return int(values.get(ROSTER_ID_KEY) or 0), int(values.get(ROSTER_VERSION_KEY) or 0)
+
+def migrate_embeddings_to_binary(engine):
+    """Rewrite legacy pickled embedding blobs in the binary format; returns rows converted"""
+    converted = 0
+    magic = "X'" + EMBEDDING_MAGIC.hex().upper() + "'"
+    with engine.begin() as conn:
+        for table in ROSTER_TABLES:
+            rows = conn.execute(text(
+                f"SELECT id, embedding FROM {table} "
+                f"WHERE embedding IS NOT NULL AND substr(embedding, 1, 4) != {magic}"
+            )).fetchall()
+            for row_id, blob in rows:
+                conn.execute(text(f"UPDATE {table} SET embedding = :blob WHERE id = :id"),
+                             {"blob": encode_embedding(pickle.loads(blob)), "id": row_id})
+                converted += 1
+    if converted:
+        print(f"[EMBEDDING STORE] Converted {converted} pickled embeddings to binary format")
+    return converted
+
+# Roster snapshot and on-disk cache ------------------------------------------
+
+class RosterSnapshot:
+    """All employee embeddings as contiguous arrays, as returned by the roster loader"""
+
+    def __init__(self, version, ids, names, embeddings, sample_ids, samples, roster_id=0):
+        self.version = version
+        self.roster_id = roster_id
+        self.ids = ids                # [employee_id]
+        self.names = names            # [employee_name]
+        self.embeddings = embeddings  # (n_employees, dim) float32, row i belongs to ids[i]
+        self.sample_ids = sample_ids  # (n_samples,) employee id owning each sample row
+        self.samples = samples        # (n_samples, dim) float32
+
+    def __len__(self):
+        return len(self.names)
+
+    def employees(self):
+        """(name, embedding) pairs, the shape returned by get_all_employees"""
+        return list(zip(self.names, self.embeddings))
+
+    def employees_with_id(self):
+        """(id, name, embedding) tuples, the shape returned by get_all_employees_with_id"""
+        return list(zip(self.ids, self.names, self.embeddings))
+
+class RosterCache:
+    """Memory-mapped .npy cache of the roster, keyed by roster_id and the roster version counter"""
+
+    def __init__(self, cache_dir=ROSTER_CACHE_DIR):
+        self.cache_dir = cache_dir
+
+    def _version_dir(self, roster_id, version):
+        return os.path.join(self.cache_dir, f"roster_{roster_id:016x}_v{version}")
+
+    def load(self, roster_id, version):
+        """Return the cached RosterSnapshot for this roster, or None"""
+        folder = self._version_dir(roster_id, version)
+        meta_file = os.path.join(folder, "roster.json")
+        if not os.path.exists(meta_file):
+            return None
+        try:
+            with open(meta_file, 'r') as f:
+                meta = json.load(f)
+            return RosterSnapshot(
+                version,
+                meta["ids"],
+                meta["names"],
+                np.load(os.path.join(folder, "embeddings.npy"), mmap_mode="r"),
+                np.load(os.path.join(folder, "sample_ids.npy")),
+                np.load(os.path.join(folder, "samples.npy"), mmap_mode="r"),
+                roster_id,
+            )
+        except Exception as e:
+            print(f"[EMBEDDING STORE] Ignoring unreadable roster cache {folder}: {e}")
+            return None
+
+    def save(self, snapshot):
+        """Write a snapshot and drop caches of older roster versions"""
+        folder = self._version_dir(snapshot.roster_id, snapshot.version)
+        tmp_folder = folder + ".tmp"
+        try:
+            shutil.rmtree(tmp_folder, ignore_errors=True)
+            os.makedirs(tmp_folder, exist_ok=True)
+            np.save(os.path.join(tmp_folder, "embeddings.npy"), np.ascontiguousarray(snapshot.embeddings, dtype=np.float32))
+            np.save(os.path.join(tmp_folder, "sample_ids.npy"), np.asarray(snapshot.sample_ids, dtype=np.int64))
+            np.save(os.path.join(tmp_folder, "samples.npy"), np.ascontiguousarray(snapshot.samples, dtype=np.float32))
+            with open(os.path.join(tmp_folder, "roster.json"), 'w') as f:
+                json.dump({"roster_id": snapshot.roster_id, "version": snapshot.version,
+                           "ids": snapshot.ids, "names": snapshot.names}, f)
+            shutil.rmtree(folder, ignore_errors=True)
+            os.replace(tmp_folder, folder)
+
+            for entry in os.listdir(self.cache_dir):
+                if entry.startswith("roster_") and entry != os.path.basename(folder):
+                    shutil.rmtree(os.path.join(self.cache_dir, entry), ignore_errors=True)
+            return True
+        except Exception as e:
+            print(f"[EMBEDDING STORE] Error writing roster cache: {e}")
+            return False
+
+def load_roster(session, cache=None):
+    """Load the whole roster as a RosterSnapshot.
+
+    With a warm cache this is a single version query; otherwise employees and
+    their samples come back from one UNION ALL query and are decoded as two
+    contiguous matrices without per-row unpickling.
+    """
+    roster_id, version = get_roster_version(session)
+    if cache is not None:
+        snapshot = cache.load(roster_id, version)
+        if snapshot is not None:
+            return snapshot
+
+    rows = session.execute(text(
+        "SELECT 0 AS kind, id, name, embedding FROM employees WHERE embedding IS NOT NULL "
+        "UNION ALL "
+        "SELECT 1 AS kind, employee_id, NULL, embedding FROM employee_embeddings "
+        "ORDER BY kind, id"
+    )).fetchall()
+    employee_rows = [row for row in rows if row[0] == 0]
+    sample_rows = [row for row in rows if row[0] == 1]
+
+    embeddings = decode_embedding_matrix([row[3] for row in employee_rows])
+    samples = decode_embedding_matrix([row[3] for row in sample_rows])
+    if samples.size == 0:
+        samples = np.zeros((0, embeddings.shape[1] if embeddings.ndim == 2 else 0), dtype=np.float32)
+
+    snapshot = RosterSnapshot(
+        version,
+        [row[1] for row in employee_rows],
+        [row[2] for row in employee_rows],
+        embeddings,
+        np.asarray([row[1] for row in sample_rows], dtype=np.int64),
+        samples,
+        roster_id,
+    )
+    if cache is not None:
+        cache.save(snapshot)
+    return snapshot
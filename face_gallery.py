@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+# face_gallery.py
+# Vectorized employee gallery for matching face embeddings against the roster
+
+import numpy as np
+
+UNKNOWN_NAME = "Unknown"
+
+# Gallery index types
+INDEX_EXACT = "exact"  # dense matrix scan over every employee
+INDEX_IVF = "ivf"      # inverted-file approximate index with exact re-ranking
+
+def normalize_embeddings(embeddings):
+    """L2-normalize a batch of embeddings as float32 rows (zero vectors stay zero)"""
+    matrix = np.asarray(embeddings, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+class IVFIndex:
+    """Inverted-file approximate nearest-neighbour index over normalized rows.
+
+    A spherical k-means coarse quantizer splits the gallery into `nlist`
+    cells; a query only scans the rows of its `nprobe` closest cells. Rows
+    are stored contiguously per cell so a probe is a slice, not a gather.
+    """
+
+    def __init__(self, nlist=None, nprobe=8, iterations=10, seed=0):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.iterations = iterations
+        self.seed = seed
+        self.centroids = np.zeros((0, 0), dtype=np.float32)
+        self.row_order = np.zeros(0, dtype=np.int64)     # gallery row of each cell-ordered row
+        self.cell_offsets = np.zeros(1, dtype=np.int64)  # cell c owns cell-ordered rows offsets[c]:offsets[c+1]
+        self.cell_matrix = np.zeros((0, 0), dtype=np.float32)
+
+    def train(self, matrix):
+        """Cluster the (already normalized) gallery matrix into cells"""
+        n_rows = matrix.shape[0]
+        nlist = self.nlist or max(1, int(np.sqrt(n_rows)))
+        nlist = min(nlist, n_rows)
+        rng = np.random.default_rng(self.seed)
+        centroids = matrix[rng.choice(n_rows, size=nlist, replace=False)].copy()
+
+        for _ in range(self.iterations):
+            assignments = np.argmax(matrix @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, matrix)
+            counts = np.bincount(assignments, minlength=nlist)
+            empty = counts == 0
+            if np.any(empty):
+                # Re-seed empty cells with random rows so every cell stays useful
+                sums[empty] = matrix[rng.choice(n_rows, size=int(empty.sum()), replace=False)]
+            centroids = normalize_embeddings(sums)
+
+        assignments = np.argmax(matrix @ centroids.T, axis=1)
+        self.centroids = np.ascontiguousarray(centroids)
+        self.row_order = np.argsort(assignments, kind='stable')
+        self.cell_offsets = np.concatenate(([0], np.cumsum(np.bincount(assignments, minlength=nlist))))
+        self.cell_matrix = np.ascontiguousarray(matrix[self.row_order])
+        return self
+
+    def search(self, query, k):
+        """Probe the closest cells and rank their rows by exact cosine similarity.
+
+        Returns (rows, scores) for at most k gallery rows, best first.
+        """
+        nprobe = min(self.nprobe, len(self.centroids))
+        cells = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        positions = np.concatenate([np.arange(self.cell_offsets[c], self.cell_offsets[c + 1]) for c in cells])
+        if len(positions) == 0:
+            return positions, np.zeros(0, dtype=np.float32)
+
+        candidate_scores = np.concatenate([self.cell_matrix[self.cell_offsets[c]:self.cell_offsets[c + 1]] @ query
+                                           for c in cells])
+        keep = min(k, len(positions))
+        top = np.argpartition(-candidate_scores, keep - 1)[:keep]
+        top = top[np.argsort(-candidate_scores[top])]
+        return self.row_order[positions[top]], candidate_scores[top]
+
+class EmployeeGallery:
+    """Holds all employee embeddings as one pre-normalized float32 matrix.
+
+    Every employee has one centroid row (the normalized mean of all their
+    registered samples) followed by a compact block of per-sample rows, so
+    a lookup is still a single matrix product; an employee's score is the
+    best of its centroid and sample similarities.
+
+    With index_type="ivf" and at least `ann_min_size` employees, an IVFIndex
+    over the centroids shortlists `rerank_k` employees per face, which are
+    then re-ranked exactly against their centroid and sample rows.
+    """
+
+    def __init__(self, employees=None, samples=None, index_type=INDEX_EXACT, ann_min_size=2000,
+                 nlist=None, nprobe=8, rerank_k=32):
+        self.ids = []
+        self.names = []
+        self.matrix = np.zeros((0, 0), dtype=np.float32)          # centroid rows, then sample rows
+        self.sample_offsets = np.zeros(1, dtype=np.int64)         # employee i owns sample rows offsets[i]:offsets[i+1]
+        self.index_type = index_type
+        self.ann_min_size = ann_min_size
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.rerank_k = rerank_k
+        self.index = None
+        if employees:
+            self.build(employees, samples)
+
+    @property
+    def centroids(self):
+        return self.matrix[:len(self.names)]
+
+    @property
+    def samples(self):
+        return self.matrix[len(self.names):]
+
+    def build(self, employees, samples=None):
+        """Build the gallery from (id, name, embedding) or (name, embedding) tuples.
+
+        `samples` is an optional iterable of (employee_id, embedding) pairs
+        holding the extra registration captures of each employee.
+        """
+        samples = [(emp_id, embedding) for emp_id, embedding in samples or [] if embedding is not None]
+        sample_owner_ids = {emp_id for emp_id, _ in samples}
+
+        ids = []
+        names = []
+        embeddings = []
+        for record in employees:
+            if len(record) == 3:
+                emp_id, name, embedding = record
+            else:
+                emp_id = None
+                name, embedding = record
+            if embedding is None:
+                if emp_id is None or emp_id not in sample_owner_ids:
+                    continue
+                embedding = np.zeros_like(np.asarray(samples[0][1], dtype=np.float32).ravel())
+            ids.append(emp_id)
+            names.append(name)
+            embeddings.append(np.asarray(embedding, dtype=np.float32).ravel())
+
+        return self.build_from_arrays(
+            ids,
+            names,
+            np.stack(embeddings) if embeddings else None,
+            [emp_id for emp_id, _ in samples],
+            np.stack([np.asarray(e, dtype=np.float32).ravel() for _, e in samples]) if samples else None
+        )
+
+    def build_from_arrays(self, ids, names, embeddings, sample_ids=None, samples=None):
+        """Build the gallery from contiguous arrays (see embedding_store.RosterSnapshot).
+
+        `embeddings` holds one row per employee; `samples` holds extra rows
+        owned by the employee ids in `sample_ids`. Centroids and the sample
+        block are computed with array operations only.
+        """
+        self.ids = list(ids)
+        self.names = list(names)
+        self.index = None
+        n_employees = len(self.names)
+        if n_employees == 0 or embeddings is None:
+            self.ids, self.names = [], []
+            self.matrix = np.zeros((0, 0), dtype=np.float32)
+            self.sample_offsets = np.zeros(1, dtype=np.int64)
+            return self
+
+        base = normalize_embeddings(embeddings)
+        centroid_sums = base.copy()
+        sample_rows = np.zeros((0, base.shape[1]), dtype=np.float32)
+        counts = np.zeros(n_employees, dtype=np.int64)
+
+        if samples is not None and len(samples):
+            # Map each sample's employee id to its gallery row
+            id_array = np.array([-1 if emp_id is None else emp_id for emp_id in self.ids], dtype=np.int64)
+            order = np.argsort(id_array, kind='stable')
+            sorted_ids = id_array[order]
+            owner_ids = np.asarray(sample_ids, dtype=np.int64)
+            positions = np.clip(np.searchsorted(sorted_ids, owner_ids), 0, n_employees - 1)
+            known = (sorted_ids[positions] == owner_ids) & (owner_ids >= 0)
+            owners = order[positions[known]]
+            normalized_samples = normalize_embeddings(np.asarray(samples)[known])
+
+            np.add.at(centroid_sums, owners, normalized_samples)
+            sample_order = np.argsort(owners, kind='stable')
+            sample_rows = normalized_samples[sample_order]
+            counts = np.bincount(owners, minlength=n_employees).astype(np.int64)
+
+        self.matrix = np.ascontiguousarray(np.vstack([normalize_embeddings(centroid_sums), sample_rows]))
+        self.sample_offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+
+        if self.index_type == INDEX_IVF and n_employees >= self.ann_min_size:
+            self.index = IVFIndex(nlist=self.nlist, nprobe=self.nprobe).train(np.ascontiguousarray(self.centroids))
+        return self
+
+    def __len__(self):
+        return len(self.names)
+
+    def _employee_scores(self, similarities, n_employees):
+        """Fold centroid and sample similarities into one score per employee"""
+        scores = similarities[:, :n_employees].copy()
+        if similarities.shape[1] > n_employees:
+            has_samples = self.sample_offsets[:-1] < self.sample_offsets[1:]
+            starts = self.sample_offsets[:-1][has_samples]
+            sample_best = np.maximum.reduceat(similarities[:, n_employees:], starts, axis=1)
+            scores[:, has_samples] = np.maximum(scores[:, has_samples], sample_best)
+        return scores
+
+    def _rerank(self, query, candidates):
+        """Exact centroid-or-sample scores of a shortlist of employees for one query"""
+        scores = self.centroids[candidates] @ query
+        n_employees = len(self.names)
+        for position, emp_index in enumerate(candidates):
+            start, end = self.sample_offsets[emp_index], self.sample_offsets[emp_index + 1]
+            if end > start:
+                scores[position] = max(scores[position], float(np.max(self.matrix[n_employees + start:n_employees + end] @ query)))
+        return scores
+
+    def search(self, embeddings, k=1):
+        """Top-k employees for each embedding in a batch.
+
+        Returns (indices, scores), both shaped (n_queries, k). Rows with fewer
+        than k candidates are padded with index -1 and score -1.
+        """
+        queries = normalize_embeddings(np.stack([np.asarray(e, dtype=np.float32).ravel() for e in embeddings]))
+        n_queries = len(queries)
+        n_employees = len(self.names)
+        k = max(1, min(k, n_employees)) if n_employees else 1
+        indices = np.full((n_queries, k), -1, dtype=np.int64)
+        scores = np.full((n_queries, k), -1.0, dtype=np.float32)
+        if n_employees == 0:
+            return indices, scores
+
+        if self.index is None:
+            # One matrix product gives the similarity of every face against every centroid and sample
+            employee_scores = self._employee_scores(queries @ self.matrix.T, n_employees)
+            if k == 1:
+                indices[:, 0] = np.argmax(employee_scores, axis=1)
+            else:
+                top = np.argpartition(-employee_scores, k - 1, axis=1)[:, :k]
+                order = np.argsort(-np.take_along_axis(employee_scores, top, axis=1), axis=1)
+                indices[:] = np.take_along_axis(top, order, axis=1)
+            scores[:] = np.take_along_axis(employee_scores, indices, axis=1)
+            return indices, scores
+
+        # Approximate path: shortlist employees by centroid, then re-rank them exactly
+        for row, query in enumerate(queries):
+            candidates, _ = self.index.search(query, max(k, self.rerank_k))
+            if len(candidates) == 0:
+                continue
+            candidate_scores = self._rerank(query, candidates)
+            order = np.argsort(-candidate_scores)[:k]
+            indices[row, :len(order)] = candidates[order]
+            scores[row, :len(order)] = candidate_scores[order]
+        return indices, scores
+
+    def match(self, embeddings):
+        """Find the best employee for each embedding in a batch.
+
+        Returns (names, scores) where names[i] is "Unknown" when no employee
+        has a positive cosine similarity with embeddings[i].
+        """
+        if embeddings is None or len(embeddings) == 0:
+            return [], np.zeros(0, dtype=np.float32)
+
+        indices, scores = self.search(embeddings, k=1)
+        best_indices = indices[:, 0]
+        best_scores = scores[:, 0]
+        names = [self.names[idx] if idx >= 0 and score > 0 else UNKNOWN_NAME
+                 for idx, score in zip(best_indices, best_scores)]
+        return names, np.maximum(best_scores, 0.0)
+
+    def match_one(self, embedding):
+        """Find the best employee for a single embedding"""
+        names, scores = self.match([embedding])
+        return names[0], float(scores[0])
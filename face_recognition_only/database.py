@@ -2,15 +2,27 @@
 # database.py
 # Database operations for the face recognition system
 
-import pickle
 import os
+import sys
 import json
 from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, LargeBinary
+from sqlalchemy import Column, Integer, String, DateTime, LargeBinary, ForeignKey
 from sqlalchemy.orm import sessionmaker, declarative_base
 
-# Setup database
-engine = create_engine("sqlite:///attendance.db")
+# Modul bersama (embedding_store) berada di direktori induk proyek
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from db_engine import get_engine, ensure_indexes
+from embedding_store import (
+    encode_embedding,
+    decode_embedding,
+    install_roster_version_triggers,
+    migrate_embeddings_to_binary,
+    load_roster as load_roster_snapshot,
+    RosterCache
+)
+
+# Setup database (WAL mode dan pragma SQLite, lihat db_engine.py)
+engine = get_engine()
 SessionLocal = sessionmaker(bind=engine)
 
 # Define database models
@@ -20,7 +32,14 @@ class Employee(Base):
     __tablename__ = "employees"
     id = Column(Integer, primary_key=True)
     name = Column(String, unique=True)
-    embedding = Column(LargeBinary)  # simpan numpy array sebagai binary
+    embedding = Column(LargeBinary)  # float32 little-endian dengan header (lihat embedding_store.py)
+
+class EmployeeEmbedding(Base):
+    __tablename__ = "employee_embeddings"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    employee_id = Column(Integer, ForeignKey('employees.id'), nullable=False, index=True)
+    embedding = Column(LargeBinary, nullable=False)  # satu sampel embedding hasil registrasi (format binary)
+    created_at = Column(DateTime, default=datetime.utcnow)
 
 class Attendance(Base):
     __tablename__ = "attendance"
@@ -30,25 +49,42 @@ class Attendance(Base):
 
 # Create tables
 Base.metadata.create_all(engine)
+ensure_indexes(engine)
+
+# Counter versi roster untuk cache embedding, dan konversi embedding pickle lama ke format binary
+install_roster_version_triggers(engine)
+migrate_embeddings_to_binary(engine)
+roster_cache = RosterCache()
 
-def save_employee(name, embedding, face_image):
-    """Simpan data karyawan ke database dan gambar ke folder"""
+def save_employee(name, embedding, face_image, samples=None):
+    """Simpan data karyawan ke database dan gambar ke folder
+    
+    `embedding` adalah embedding utama (centroid) karyawan, sedangkan `samples`
+    berisi semua embedding hasil capture registrasi yang disimpan per sampel.
+    """
     session = SessionLocal()
     
     # Cek apakah karyawan dengan nama ini sudah ada
     existing_employee = session.query(Employee).filter(Employee.name == name).first()
     if existing_employee:
         # Update data karyawan yang sudah ada
-        existing_employee.embedding = pickle.dumps(embedding)
+        existing_employee.embedding = encode_embedding(embedding)
         emp = existing_employee
         print(f"[INFO] Data karyawan {name} berhasil diperbarui")
     else:
         # Simpan embedding ke database dengan ID unik
-        data = pickle.dumps(embedding)
+        data = encode_embedding(embedding)
         emp = Employee(name=name, embedding=data)
         session.add(emp)
         print(f"[INFO] Karyawan {name} berhasil didaftarkan")
     
+    # Simpan sampel embedding (ganti sampel lama jika karyawan diregistrasi ulang)
+    if samples:
+        session.flush()
+        session.query(EmployeeEmbedding).filter(EmployeeEmbedding.employee_id == emp.id).delete()
+        for sample in samples:
+            session.add(EmployeeEmbedding(employee_id=emp.id, embedding=encode_embedding(sample)))
+    
     # Pastikan direktori ada sebelum menyimpan gambar
     if not os.path.exists("data/registered_faces"):
         os.makedirs("data/registered_faces")
@@ -66,7 +102,7 @@ def get_all_employees():
     """Ambil semua data karyawan dari database"""
     session = SessionLocal()
     employees = session.query(Employee).all()
-    data = [(emp.name, pickle.loads(emp.embedding)) for emp in employees]
+    data = [(emp.name, decode_embedding(emp.embedding)) for emp in employees]
     session.close()
     return data
 
@@ -74,7 +110,22 @@ def get_all_employees_with_id():
     """Ambil semua data karyawan dari database termasuk ID"""
     session = SessionLocal()
     employees = session.query(Employee).all()
-    data = [(emp.id, emp.name, pickle.loads(emp.embedding)) for emp in employees]
+    data = [(emp.id, emp.name, decode_embedding(emp.embedding)) for emp in employees]
+    session.close()
+    return data
+
+def load_roster():
+    """Ambil nama, ID, dan matrix embedding seluruh karyawan sekaligus (memakai cache roster)"""
+    session = SessionLocal()
+    roster = load_roster_snapshot(session, roster_cache)
+    session.close()
+    return roster
+
+def get_employee_samples():
+    """Ambil semua sampel embedding karyawan sebagai pasangan (employee_id, embedding)"""
+    session = SessionLocal()
+    samples = session.query(EmployeeEmbedding.employee_id, EmployeeEmbedding.embedding).all()
+    data = [(employee_id, decode_embedding(embedding)) for employee_id, embedding in samples]
     session.close()
     return data
 
@@ -87,7 +138,8 @@ def delete_employee_by_name(name):
         employee = session.query(Employee).filter(Employee.name == name).first()
         
         if employee:
-            # Hapus karyawan dari database
+            # Hapus sampel embedding dan karyawan dari database
+            session.query(EmployeeEmbedding).filter(EmployeeEmbedding.employee_id == employee.id).delete()
             session.delete(employee)
             session.commit()
             
@@ -127,6 +179,16 @@ DEFAULT_SYSTEM_SPECS = {
     "recognition_cooldown": 10,  # detik
     "bbox_smoothing_factor": 0.85,  # Ditingkatkan untuk tracking yang lebih smooth
     "providers": "CUDAExecutionProvider, CPUExecutionProvider",
+    "insightface_modules": ["detection", "recognition"],  # Model InsightFace yang dimuat ("all" = semua)
+    "ctx_id": "auto",  # "auto" = GPU hanya jika CUDAExecutionProvider tersedia, -1 = paksa CPU
+    "ort_intra_op_threads": 0,  # Thread per operator onnxruntime (0 = default, satu per core fisik)
+    "ort_inter_op_threads": 0,  # Thread antar operator (hanya dipakai pada execution mode "parallel")
+    "ort_execution_mode": "sequential",  # sequential / parallel
+    "ort_graph_optimization": "all",  # disable / basic / extended / all
+    "ort_allow_spinning": True,  # False = thread tidak busy-wait di antara frame (CPU lebih hemat)
+    "ort_thread_affinities": "",  # Pinning thread ke core, format onnxruntime "1,2;3,4"
+    "detector_model_path": "",  # File ONNX detector alternatif (misal hasil kuantisasi INT8), kosong = bawaan pack
+    "recognizer_model_path": "",  # File ONNX recognizer alternatif (misal hasil kuantisasi INT8)
     "fps_target": 30,
     "frame_skip": False,
     "multi_person": True,
@@ -136,7 +198,14 @@ DEFAULT_SYSTEM_SPECS = {
     "tracking_timeout": 3.0,         # Ditingkatkan dari 1.0 detik untuk mempertahankan ID lebih lama
     "movement_threshold": 5,
     # Re-identification parameters
-    "embedding_similarity_threshold": 0.7  # Threshold untuk matching berbasis embedding
+    "embedding_similarity_threshold": 0.7,  # Threshold untuk matching berbasis embedding
+    "track_motion_model": "kalman",  # "kalman" (prediksi kecepatan konstan) atau "smoothing" (bbox_smoothing_factor)
+    "kalman_process_noise": 2000.0,  # Variasi percepatan (px^2/s^3)
+    "kalman_measurement_noise": 4.0,  # Jitter bbox detector (px)
+    "kalman_gate_sigma": 4.0,  # Jarak gating dalam standar deviasi prediksi
+    "kalman_max_predict_s": 1.0,  # Ekstrapolasi maksimal track yang tidak terdeteksi (detik)
+    # Registrasi
+    "registration_samples": 5  # Jumlah capture wajah yang disimpan per karyawan
 }
 
 def load_system_specs():
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# frame_broadcaster.py
+# Encode once, fan out to many viewers: latest preview frame per camera and its subscribers
+
+import threading
+import time
+import cv2
+
+# Preview profiles: output width (0 = camera resolution) and JPEG quality
+DEFAULT_PREVIEW_PROFILES = {
+    'thumbnail': {'width': 320, 'quality': 50},
+    'focus': {'width': 1280, 'quality': 80},
+    'full': {'width': 0, 'quality': 95}
+}
+DEFAULT_PREVIEW_PROFILE = 'focus'
+
+def preview_profiles(specs, camera_config=None):
+    """Profiles from SYSTEM_SPECS "preview_profiles", overridden per camera by the camera config's"""
+    profiles = {name: dict(values) for name, values in DEFAULT_PREVIEW_PROFILES.items()}
+    for source in (specs or {}, camera_config or {}):
+        for name, values in (source.get('preview_profiles') or {}).items():
+            profiles[name] = dict(profiles.get(name, {'width': 0, 'quality': 95}), **values)
+    return profiles
+
+def encode_preview(frame, width=0, quality=95):
+    """Downscale an annotated frame to `width` (never upscales) and encode it as JPEG bytes"""
+    if width and frame.shape[1] > width:
+        height = int(round(frame.shape[0] * width / float(frame.shape[1])))
+        frame = cv2.resize(frame, (int(width), height), interpolation=cv2.INTER_AREA)
+    ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+    return buffer.tobytes() if ok else None
+
+class CameraFeed:
+    """Latest preview frame of one camera and the viewers subscribed to it.
+
+    The inference thread only stores the newest annotated frame (publish never
+    blocks on viewers). Each frame is encoded at most once per preview
+    profile, and only for profiles someone is watching. A sender thread per
+    camera hands each new frame to the Socket.IO subscribers that have
+    acknowledged their previous frame; a subscriber that is still busy simply
+    misses frames. MJPEG readers pull the newest frame whenever they are
+    ready, so both kinds of viewers run at their own rate.
+    """
+
+    def __init__(self, camera_id, send=None, ack_timeout=2.0, profiles=None, default_profile=DEFAULT_PREVIEW_PROFILE):
+        self.camera_id = camera_id
+        self.send = send  # send(sid, camera_id, jpeg) for Socket.IO subscribers
+        self.ack_timeout = ack_timeout
+        self.profiles = profiles or preview_profiles({})
+        self.default_profile = default_profile if default_profile in self.profiles else next(iter(self.profiles))
+        self.sequence = 0
+        self.frame = None
+        self._encoded = {}  # {profile: (sequence, jpeg)}
+        self._encode_lock = threading.Lock()
+        self.subscribers = {}  # {sid: {'transport', 'profile', 'sent_sequence', 'sent_at', 'ready'}}
+        self.mjpeg_readers = {}  # {profile: count}
+        self.closed = False
+        self.condition = threading.Condition()
+        self.stats = {
+            'published': 0,
+            'sent': 0,
+            'dropped': 0,
+            'mjpeg_sent': 0,
+            'encoded': {}
+        }
+        self._sender = threading.Thread(target=self._send_loop, name=f"broadcast-{camera_id}", daemon=True)
+        self._sender.start()
+
+    def resolve_profile(self, profile):
+        return profile if profile in self.profiles else self.default_profile
+
+    def viewer_count(self):
+        with self.condition:
+            return len(self.subscribers) + sum(self.mjpeg_readers.values())
+
+    def publish(self, frame):
+        """Store a new annotated frame (ndarray, or JPEG bytes already encoded) and wake up the viewers"""
+        with self.condition:
+            self.sequence += 1
+            self.frame = frame
+            self.stats['published'] += 1
+            self.condition.notify_all()
+
+    def encoded(self, profile, sequence, frame):
+        """JPEG of `frame` (frame number `sequence`) for a profile; encoded once and shared by all its viewers"""
+        if isinstance(frame, (bytes, bytearray)):
+            return bytes(frame)
+        with self._encode_lock:
+            cached = self._encoded.get(profile)
+            if cached is not None and cached[0] == sequence:
+                return cached[1]
+            settings = self.profiles[profile]
+            jpeg = encode_preview(frame, settings.get('width', 0), settings.get('quality', 95))
+            self._encoded[profile] = (sequence, jpeg)
+            self.stats['encoded'][profile] = self.stats['encoded'].get(profile, 0) + 1
+            return jpeg
+
+    def subscribe(self, sid, transport='socketio', profile=None):
+        """Add (or update) a subscriber; returns the profile it gets"""
+        profile = self.resolve_profile(profile)
+        with self.condition:
+            self.subscribers[sid] = {'transport': transport, 'profile': profile, 'sent_sequence': 0,
+                                     'sent_at': 0.0, 'ready': True}
+            self.condition.notify_all()
+        return profile
+
+    def set_profile(self, sid, profile):
+        """Switch a subscriber to another profile; it gets the current frame again in that profile"""
+        profile = self.resolve_profile(profile)
+        with self.condition:
+            subscriber = self.subscribers.get(sid)
+            if subscriber is not None:
+                subscriber.update(profile=profile, sent_sequence=0, ready=True)
+                self.condition.notify_all()
+        return profile
+
+    def unsubscribe(self, sid):
+        with self.condition:
+            self.subscribers.pop(sid, None)
+            return len(self.subscribers) + sum(self.mjpeg_readers.values())
+
+    def ack(self, sid):
+        """A Socket.IO subscriber displayed its last frame and can take the next one"""
+        with self.condition:
+            subscriber = self.subscribers.get(sid)
+            if subscriber is not None:
+                subscriber['ready'] = True
+                self.condition.notify_all()
+
+    def _due(self, now):
+        """Socket.IO subscribers that should get the current frame now"""
+        due = []
+        for sid, subscriber in self.subscribers.items():
+            if subscriber['transport'] != 'socketio' or subscriber['sent_sequence'] >= self.sequence:
+                continue
+            if not subscriber['ready'] and now - subscriber['sent_at'] < self.ack_timeout:
+                continue
+            due.append(sid)
+        return due
+
+    def _send_loop(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.closed or (self.frame is not None and self._due(time.time())),
+                                        timeout=self.ack_timeout)
+                if self.closed:
+                    return
+                now = time.time()
+                due = []
+                sequence, frame = self.sequence, self.frame
+                for sid in self._due(now):
+                    subscriber = self.subscribers[sid]
+                    # Frames published since this subscriber's last one were skipped for it
+                    if subscriber['sent_sequence']:
+                        self.stats['dropped'] += max(sequence - subscriber['sent_sequence'] - 1, 0)
+                    subscriber.update(sent_sequence=sequence, sent_at=now, ready=False)
+                    due.append((sid, subscriber['profile']))
+            # Encoding happens here, off the inference thread and outside the lock
+            for sid, profile in due:
+                try:
+                    jpeg = self.encoded(profile, sequence, frame)
+                    if jpeg is None:
+                        continue
+                    self.send(sid, self.camera_id, jpeg)
+                    self.stats['sent'] += 1
+                except Exception as e:
+                    print(f"[BROADCASTER] Error sending frame of {self.camera_id} to {sid}: {e}")
+
+    def mjpeg_frames(self, profile=None, idle_timeout=10.0):
+        """multipart/x-mixed-replace body that always carries the newest frame in the given profile"""
+        profile = self.resolve_profile(profile)
+        with self.condition:
+            self.mjpeg_readers[profile] = self.mjpeg_readers.get(profile, 0) + 1
+        last_sequence = 0
+        try:
+            while True:
+                with self.condition:
+                    self.condition.wait_for(lambda: self.closed or self.sequence != last_sequence, timeout=idle_timeout)
+                    if self.closed:
+                        return
+                    sequence, frame = self.sequence, self.frame
+                if sequence == last_sequence or frame is None:
+                    continue  # no new frame within idle_timeout (camera reconnecting)
+                last_sequence = sequence
+                jpeg = self.encoded(profile, sequence, frame)
+                if jpeg is None:
+                    continue
+                self.stats['mjpeg_sent'] += 1
+                yield (b'--frame\r\nContent-Type: image/jpeg\r\nContent-Length: ' + str(len(jpeg)).encode()
+                       + b'\r\n\r\n' + jpeg + b'\r\n')
+        finally:
+            with self.condition:
+                self.mjpeg_readers[profile] -= 1
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def get_stats(self):
+        with self.condition:
+            stats = dict(self.stats, encoded=dict(self.stats['encoded']))
+            profiles_in_use = {}
+            for subscriber in self.subscribers.values():
+                profiles_in_use[subscriber['profile']] = profiles_in_use.get(subscriber['profile'], 0) + 1
+            for profile, count in self.mjpeg_readers.items():
+                if count:
+                    profiles_in_use[profile] = profiles_in_use.get(profile, 0) + count
+            stats['socketio_subscribers'] = sum(1 for s in self.subscribers.values() if s['transport'] == 'socketio')
+            stats['mjpeg_readers'] = sum(self.mjpeg_readers.values())
+            stats['viewers'] = len(self.subscribers) + stats['mjpeg_readers']
+            stats['profiles_in_use'] = profiles_in_use
+        return stats
+
+class FrameBroadcaster:
+    """Camera feeds by camera ID, and which feeds each Socket.IO client watches"""
+
+    def __init__(self, send=None, ack_timeout=2.0):
+        self.send = send
+        self.ack_timeout = ack_timeout
+        self.feeds = {}  # {camera_id: CameraFeed}
+        self.lock = threading.Lock()
+
+    def open(self, camera_id, profiles=None, default_profile=DEFAULT_PREVIEW_PROFILE):
+        """Feed of a camera, created on first use with the given preview profiles"""
+        with self.lock:
+            feed = self.feeds.get(camera_id)
+            if feed is None:
+                feed = CameraFeed(camera_id, self.send, self.ack_timeout, profiles, default_profile)
+                self.feeds[camera_id] = feed
+            return feed
+
+    def get(self, camera_id):
+        return self.feeds.get(camera_id)
+
+    def close(self, camera_id):
+        with self.lock:
+            feed = self.feeds.pop(camera_id, None)
+        if feed is not None:
+            feed.close()
+
+    def publish(self, camera_id, frame):
+        feed = self.feeds.get(camera_id)
+        if feed is not None:
+            feed.publish(frame)
+
+    def subscribe(self, camera_id, sid, transport='socketio', profile=None):
+        """Subscribe a client (opening the feed with default profiles if needed); returns the profile it gets"""
+        return self.open(camera_id).subscribe(sid, transport, profile)
+
+    def set_profile(self, camera_id, sid, profile):
+        feed = self.feeds.get(camera_id)
+        return feed.set_profile(sid, profile) if feed is not None else None
+
+    def unsubscribe(self, camera_id, sid):
+        """Remove a subscriber; returns the number of viewers the camera still has"""
+        feed = self.feeds.get(camera_id)
+        return feed.unsubscribe(sid) if feed is not None else 0
+
+    def unsubscribe_all(self, sid):
+        """Remove a disconnected client everywhere; returns the cameras left without viewers"""
+        orphaned = []
+        for camera_id, feed in list(self.feeds.items()):
+            if sid in feed.subscribers and feed.unsubscribe(sid) == 0:
+                orphaned.append(camera_id)
+        return orphaned
+
+    def ack(self, camera_id, sid):
+        feed = self.feeds.get(camera_id)
+        if feed is not None:
+            feed.ack(sid)
+
+    def viewer_count(self, camera_id):
+        feed = self.feeds.get(camera_id)
+        return feed.viewer_count() if feed is not None else 0
+
+    def get_stats(self):
+        return {camera_id: feed.get_stats() for camera_id, feed in list(self.feeds.items())}
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+# inference_backend.py
+# InsightFace model construction and batched face analysis across several frames
+
+DEFAULT_PROVIDERS = ['CUDAExecutionProvider', 'CPUExecutionProvider']  # Prioritaskan CUDA
+
+# Only bbox, det_score and embedding are used; landmark_3d_68, landmark_2d_106 and genderage are skipped
+DEFAULT_ALLOWED_MODULES = ['detection', 'recognition']
+
+def parse_allowed_modules(value):
+    """Normalize the insightface_modules setting.
+
+    None, "all" or an empty value load every model in the pack; otherwise a
+    list (or comma-separated string) of task names, always including detection.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        if value.strip().lower() in ('', 'all'):
+            return None
+        value = value.split(',')
+    modules = [str(module).strip() for module in value if str(module).strip()]
+    if not modules:
+        return None
+    if 'detection' not in modules:
+        modules.insert(0, 'detection')
+    return modules
+
+EXECUTION_MODES = {'sequential': 'ORT_SEQUENTIAL', 'parallel': 'ORT_PARALLEL'}
+GRAPH_OPTIMIZATION_LEVELS = {
+    'disable': 'ORT_DISABLE_ALL',
+    'basic': 'ORT_ENABLE_BASIC',
+    'extended': 'ORT_ENABLE_EXTENDED',
+    'all': 'ORT_ENABLE_ALL'
+}
+
+def parse_providers(value):
+    """Execution providers from the config string/list, keeping only those onnxruntime has"""
+    import onnxruntime
+    if value is None:
+        requested = list(DEFAULT_PROVIDERS)
+    elif isinstance(value, str):
+        requested = [provider.strip() for provider in value.split(',') if provider.strip()]
+    else:
+        requested = [str(provider).strip() for provider in value if str(provider).strip()]
+    available = onnxruntime.get_available_providers()
+    providers = [provider for provider in requested if provider in available]
+    skipped = [provider for provider in requested if provider not in available]
+    if skipped:
+        print(f"[INFERENCE] Providers not available in this onnxruntime build: {', '.join(skipped)}")
+    return providers or ['CPUExecutionProvider']
+
+def create_session_options(intra_op_threads=0, inter_op_threads=0, execution_mode='sequential',
+                           graph_optimization='all', allow_spinning=True, thread_affinities=''):
+    """onnxruntime.SessionOptions shared by every model of one FaceAnalysis app.
+
+    Thread counts of 0 leave the onnxruntime default (one thread per physical
+    core). With several inference workers, intra_op_threads x workers should
+    not exceed the core count. `thread_affinities` pins intra-op threads to
+    cores using onnxruntime's "1,2;3,4" syntax (one group per extra thread).
+    """
+    import onnxruntime
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = int(intra_op_threads or 0)
+    options.inter_op_num_threads = int(inter_op_threads or 0)
+    options.execution_mode = getattr(onnxruntime.ExecutionMode,
+                                     EXECUTION_MODES.get(str(execution_mode).lower(), 'ORT_SEQUENTIAL'))
+    options.graph_optimization_level = getattr(onnxruntime.GraphOptimizationLevel,
+                                               GRAPH_OPTIMIZATION_LEVELS.get(str(graph_optimization).lower(), 'ORT_ENABLE_ALL'))
+    # Busy-waiting threads lower latency but keep cores at 100% between frames
+    options.add_session_config_entry('session.intra_op.allow_spinning', '1' if allow_spinning else '0')
+    if thread_affinities:
+        options.add_session_config_entry('session.intra_op_thread_affinities', str(thread_affinities))
+    return options
+
+def apply_session_options(model, providers, sess_options):
+    """Rebuild a model zoo model's onnxruntime session with our SessionOptions.
+
+    insightface's model_zoo.get_model (0.7.3, as pinned) only forwards
+    providers and provider_options to onnxruntime, so sess_options given to
+    FaceAnalysis or get_model never reach the session. The model gets a new
+    session on the same file; input/output names and shapes are unchanged.
+    """
+    import onnxruntime
+    model.session = onnxruntime.InferenceSession(model.model_file, sess_options=sess_options, providers=providers)
+    return model
+
+def face_analysis_options(specs):
+    """create_face_analysis keyword arguments from a SYSTEM_SPECS dict"""
+    return {
+        'det_size': tuple(specs.get('detection_size', (640, 640))),
+        'providers': specs.get('providers'),
+        'ctx_id': specs.get('ctx_id', 'auto'),
+        'allowed_modules': specs.get('insightface_modules', DEFAULT_ALLOWED_MODULES),
+        'session_settings': {
+            'intra_op_threads': specs.get('ort_intra_op_threads', 0),
+            'inter_op_threads': specs.get('ort_inter_op_threads', 0),
+            'execution_mode': specs.get('ort_execution_mode', 'sequential'),
+            'graph_optimization': specs.get('ort_graph_optimization', 'all'),
+            'allow_spinning': specs.get('ort_allow_spinning', True),
+            'thread_affinities': specs.get('ort_thread_affinities', '')
+        },
+        'model_paths': {
+            'detection': specs.get('detector_model_path', ''),
+            'recognition': specs.get('recognizer_model_path', '')
+        }
+    }
+
+def create_face_analysis(det_size=(640, 640), providers=None, ctx_id='auto', allowed_modules=DEFAULT_ALLOWED_MODULES,
+                         session_settings=None, model_paths=None, report=True):
+    """Create and prepare an InsightFace FaceAnalysis app (each call loads its own onnxruntime sessions).
+
+    `model_paths` ({task: path}) replaces pack models with other ONNX files,
+    e.g. INT8-quantized detector/recognizer exports. `ctx_id` "auto" uses the
+    GPU only when the CUDA provider is actually available.
+    """
+    import insightface
+    from insightface.model_zoo import model_zoo
+    providers = parse_providers(providers)
+    sess_options = create_session_options(**(session_settings or {}))
+    if ctx_id in (None, 'auto'):
+        ctx_id = 0 if 'CUDAExecutionProvider' in providers else -1
+    app = insightface.app.FaceAnalysis(providers=providers, allowed_modules=parse_allowed_modules(allowed_modules))
+    for task, path in (model_paths or {}).items():
+        if not path:
+            continue
+        model = model_zoo.get_model(path, providers=providers)
+        if model is None or model.taskname != task:
+            print(f"[INFERENCE] Ignoring {path}: not a {task} model")
+            continue
+        app.models[task] = model
+        if task == 'detection':
+            app.det_model = model
+    for model in app.models.values():
+        apply_session_options(model, providers, sess_options)
+    app.prepare(ctx_id=int(ctx_id), det_size=tuple(det_size))
+    if report:
+        print_backend_report(app, ctx_id)
+    return app
+
+def describe_session_options(options):
+    """One-line summary of the settings an onnxruntime session was created with"""
+    try:
+        spinning = options.get_session_config_entry('session.intra_op.allow_spinning')
+    except Exception:
+        spinning = 'default'
+    return (f"intra_op_threads={options.intra_op_num_threads or 'default'}, "
+            f"inter_op_threads={options.inter_op_num_threads or 'default'}, "
+            f"execution_mode={options.execution_mode.name}, "
+            f"graph_optimization={options.graph_optimization_level.name}, "
+            f"allow_spinning={spinning}")
+
+def print_backend_report(app, ctx_id):
+    """Startup report: provider and session options actually applied, read back from each model's session"""
+    import onnxruntime
+    print(f"[INFERENCE] onnxruntime {onnxruntime.__version__}, device {onnxruntime.get_device()}, ctx_id {ctx_id}")
+    for task, model in app.models.items():
+        session = getattr(model, 'session', None)
+        provider = session.get_providers()[0] if session is not None else 'unknown'
+        print(f"[INFERENCE]   {task:<16} {str(getattr(model, 'model_file', '')).split('/')[-1]:<28} {provider}")
+        if session is not None:
+            print(f"[INFERENCE]     {describe_session_options(session.get_session_options())}")
+
+def create_detector(det_model, input_size):
+    """Separate detector instance (own onnxruntime session) prepared for another input size.
+
+    Uses the same model file, providers and session options as `det_model`;
+    a dedicated session per size avoids onnxruntime re-planning its buffers
+    whenever cameras with different detection sizes alternate.
+    """
+    from insightface.model_zoo import model_zoo
+    session = det_model.session
+    providers = session.get_providers()
+    detector = model_zoo.get_model(det_model.model_file, providers=providers)
+    apply_session_options(detector, providers, session.get_session_options())
+    detector.prepare(0 if 'CUDAExecutionProvider' in providers else -1, input_size=tuple(input_size),
+                     det_thresh=det_model.det_thresh)
+    if tuple(detector.input_size) != tuple(input_size):
+        print(f"[INFERENCE] Detector has a fixed input size {detector.input_size}; {tuple(input_size)} ignored")
+    else:
+        print(f"[INFERENCE] Prepared detector for input size {tuple(input_size)}")
+    return detector
+
+class FaceAnalyzer:
+    """Runs a FaceAnalysis app over a batch of frames.
+
+    Detection runs frame by frame (the detector input is one image), but the
+    aligned face crops of every frame in the batch go through the recognition
+    model in a single get_feat call. The result per frame is the same list of
+    Face objects FaceAnalysis.get would return.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.det_model = app.det_model
+        self.rec_model = app.models.get('recognition')
+        # Other per-face models (landmarks, gender/age) keep their per-face get()
+        self.face_models = [model for task, model in app.models.items()
+                            if task not in ('detection', 'recognition')]
+        self.default_input_size = tuple(self.det_model.input_size) if self.det_model.input_size else None
+        self._detectors = {}  # {input_size: detector prepared for that size}
+
+    def detector_for(self, input_size=None):
+        """Detector for an input size; the app's own detector serves the configured detection_size"""
+        if input_size is None or tuple(input_size) == self.default_input_size:
+            return self.det_model
+        input_size = tuple(int(value) for value in input_size)
+        detector = self._detectors.get(input_size)
+        if detector is None:
+            detector = create_detector(self.det_model, input_size)
+            self._detectors[input_size] = detector
+        return detector
+
+    def detect(self, frame, regions=None, input_size=None):
+        """Detect faces in one frame; returns Face objects without embeddings.
+
+        With `regions` (a DetectionRegions) the detector only sees the packed
+        regions of interest; boxes and landmarks are mapped back to the frame.
+        `input_size` selects a detector prepared for that size (None = detection_size).
+        """
+        from insightface.app.common import Face
+        detector = self.detector_for(input_size)
+        if regions is None:
+            bboxes, kpss = detector.detect(frame, max_num=0, metric='default')
+        else:
+            bboxes, kpss = detector.detect(regions.pack(frame), max_num=0, metric='default')
+            bboxes, kpss = regions.unpack(bboxes, kpss)
+        faces = []
+        for i in range(bboxes.shape[0]):
+            face = Face(bbox=bboxes[i, 0:4], kps=kpss[i] if kpss is not None else None, det_score=bboxes[i, 4])
+            for model in self.face_models:
+                model.get(frame, face)
+            faces.append(face)
+        return faces
+
+    def embed(self, frames, faces_per_frame, masks=None):
+        """Fill face.embedding for the faces of every frame with one recognition batch.
+
+        `masks` optionally holds one list of booleans per frame; faces whose
+        flag is False are not embedded (their embedding stays None).
+        """
+        if self.rec_model is None:
+            return
+        from insightface.utils import face_align
+        crops = []
+        targets = []
+        for index, (frame, faces) in enumerate(zip(frames, faces_per_frame)):
+            mask = masks[index] if masks is not None and masks[index] is not None else [True] * len(faces)
+            for face, selected in zip(faces, mask):
+                if face.kps is None or not selected:
+                    continue
+                crops.append(face_align.norm_crop(frame, landmark=face.kps, image_size=self.rec_model.input_size[0]))
+                targets.append(face)
+        if not crops:
+            return
+        features = self.rec_model.get_feat(crops)
+        for face, feature in zip(targets, features):
+            face.embedding = feature.flatten()
+
+    def analyze(self, frames, embed_filters=None, regions=None, input_sizes=None):
+        """Detect and embed faces in a list of frames; returns one face list per frame.
+
+        `embed_filters` optionally holds, per frame, a callable
+        filter(frame, faces) -> [bool] choosing which detected faces need an
+        embedding (None = embed every face). `regions` and `input_sizes`
+        optionally hold a DetectionRegions and a detector input size (or None) per frame.
+        """
+        regions = regions if regions is not None else [None] * len(frames)
+        input_sizes = input_sizes if input_sizes is not None else [None] * len(frames)
+        faces_per_frame = [self.detect(frame, frame_regions, input_size)
+                           for frame, frame_regions, input_size in zip(frames, regions, input_sizes)]
+        masks = None
+        if embed_filters is not None:
+            masks = [embed_filter(frame, faces) if embed_filter else None
+                     for frame, faces, embed_filter in zip(frames, faces_per_frame, embed_filters)]
+        self.embed(frames, faces_per_frame, masks)
+        return faces_per_frame
+
+    def get(self, frame):
+        """Single-frame equivalent of FaceAnalysis.get"""
+        return self.analyze([frame])[0]
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# inference_scheduler.py
+# Central inference scheduler: one worker pool shared by every camera stream
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+class InferenceScheduler:
+    """Batches frames submitted by camera threads onto a pool of inference workers.
+
+    Each worker owns its own analyzer (and so its own onnxruntime sessions),
+    created by `analyzer_factory(worker_index)`; the analyzer must provide
+    analyze(frames, embed_filters, regions, input_sizes) -> [faces per frame]. A worker takes the oldest request,
+    waits up to `max_wait_ms` for frames from other cameras to join it (at
+    most `max_batch_size`), runs the batch and resolves each camera's Future.
+    """
+
+    def __init__(self, analyzer_factory, num_workers=1, max_batch_size=8, max_wait_ms=5, max_queue_size=64):
+        self.analyzer_factory = analyzer_factory
+        self.num_workers = max(1, int(num_workers))
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_ms = max_wait_ms
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._stop_event = threading.Event()
+        self._workers = []
+        self._ready = []
+        self._lock = threading.Lock()
+        self._metrics = {
+            'frames_submitted': 0,
+            'frames_completed': 0,
+            'frames_rejected': 0,
+            'batches': 0,
+            'errors': 0,
+            'total_batch_ms': 0.0,
+            'total_latency_ms': 0.0,
+            'max_batch_size_seen': 0
+        }
+        self._camera_metrics = {}  # {camera_id: {'submitted', 'completed', 'total_latency_ms'}}
+
+    def start(self):
+        """Start the worker threads (no-op if already running)"""
+        with self._lock:
+            if any(worker.is_alive() for worker in self._workers):
+                return self
+            self._stop_event.clear()
+            self._workers = []
+            self._ready = [threading.Event() for _ in range(self.num_workers)]
+            for index in range(self.num_workers):
+                worker = threading.Thread(target=self._worker_loop, args=(index,),
+                                          name=f"inference-worker-{index}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+        print(f"[INFERENCE] Scheduler started with {self.num_workers} worker(s), batch <= {self.max_batch_size}")
+        return self
+
+    def stop(self, timeout=5):
+        """Stop the workers; pending requests are cancelled"""
+        self._stop_event.set()
+        for worker in self._workers:
+            worker.join(timeout=timeout)
+        self._workers = []
+        while True:
+            try:
+                _, _, _, _, _, future, _ = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            future.cancel()
+
+    def is_running(self):
+        return any(worker.is_alive() for worker in self._workers)
+
+    def submit(self, camera_id, frame, embed_filter=None, regions=None, input_size=None):
+        """Queue one frame for inference; returns a Future resolving to its face list.
+
+        `embed_filter(frame, faces) -> [bool]` runs on the worker after
+        detection and picks the faces that need an embedding. `regions`
+        (DetectionRegions) limits detection to the camera's regions of interest
+        and `input_size` picks the detector input size (None = detection_size).
+        """
+        future = Future()
+        with self._lock:
+            camera = self._camera_metrics.setdefault(camera_id, {'submitted': 0, 'completed': 0, 'total_latency_ms': 0.0})
+        try:
+            self._queue.put_nowait((camera_id, frame, embed_filter, regions, input_size, future, time.perf_counter()))
+        except queue.Full:
+            with self._lock:
+                self._metrics['frames_rejected'] += 1
+            future.set_exception(RuntimeError("Inference queue is full"))
+            return future
+        with self._lock:
+            self._metrics['frames_submitted'] += 1
+            camera['submitted'] += 1
+        return future
+
+    def infer(self, camera_id, frame, embed_filter=None, regions=None, input_size=None, timeout=10.0):
+        """Submit a frame and wait for its faces (blocking call for camera threads)"""
+        return self.submit(camera_id, frame, embed_filter, regions, input_size).result(timeout=timeout)
+
+    def _collect_batch(self):
+        """Block for the first request, then gather more until the batch is full or the wait expires"""
+        try:
+            batch = [self._queue.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.perf_counter() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker_loop(self, index):
+        try:
+            analyzer = self.analyzer_factory(index)
+        except Exception as e:
+            print(f"[INFERENCE] Worker {index} failed to load its model: {e}")
+            return
+        self._ready[index].set()
+
+        while not self._stop_event.is_set():
+            batch = self._collect_batch()
+            if not batch:
+                continue
+            batch = [request for request in batch if request[5].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            start = time.perf_counter()
+            try:
+                results = analyzer.analyze([frame for _, frame, _, _, _, _, _ in batch],
+                                           [embed_filter for _, _, embed_filter, _, _, _, _ in batch],
+                                           [regions for _, _, _, regions, _, _, _ in batch],
+                                           [input_size for _, _, _, _, input_size, _, _ in batch])
+            except Exception as e:
+                with self._lock:
+                    self._metrics['errors'] += 1
+                for _, _, _, _, _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            finished = time.perf_counter()
+
+            for (_, _, _, _, _, future, _), faces in zip(batch, results):
+                future.set_result(faces)
+            with self._lock:
+                self._metrics['batches'] += 1
+                self._metrics['frames_completed'] += len(batch)
+                self._metrics['total_batch_ms'] += (finished - start) * 1000.0
+                self._metrics['max_batch_size_seen'] = max(self._metrics['max_batch_size_seen'], len(batch))
+                for camera_id, _, _, _, _, _, submitted_at in batch:
+                    latency_ms = (finished - submitted_at) * 1000.0
+                    self._metrics['total_latency_ms'] += latency_ms
+                    camera = self._camera_metrics[camera_id]
+                    camera['completed'] += 1
+                    camera['total_latency_ms'] += latency_ms
+
+    def get_metrics(self):
+        """Throughput, batching and per-camera latency statistics"""
+        with self._lock:
+            metrics = dict(self._metrics)
+            cameras = {camera_id: dict(values) for camera_id, values in self._camera_metrics.items()}
+        batches = metrics['batches']
+        completed = metrics['frames_completed']
+        metrics['avg_batch_size'] = completed / batches if batches else 0.0
+        total_batch_ms = metrics.pop('total_batch_ms')
+        total_latency_ms = metrics.pop('total_latency_ms')
+        metrics['avg_batch_ms'] = total_batch_ms / batches if batches else 0.0
+        metrics['avg_latency_ms'] = total_latency_ms / completed if completed else 0.0
+        for values in cameras.values():
+            total_latency_ms = values.pop('total_latency_ms')
+            values['avg_latency_ms'] = total_latency_ms / values['completed'] if values['completed'] else 0.0
+        metrics['cameras'] = cameras
+        metrics['workers'] = self.num_workers
+        metrics['workers_ready'] = sum(1 for event in self._ready if event.is_set())
+        metrics['queue_depth'] = self._queue.qsize()
+        return metrics
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# replay_tracker.py
+# Deterministic replay of recorded (or synthetic) detections through FaceTracker
+#
+# Usage: python replay_tracker.py recordings/CAM1_20250101_080000.jsonl
+#        python replay_tracker.py --synthetic --people 8 --frames 600 --seed 7
+#        python replay_tracker.py --synthetic --save expected_tracks.json
+#        python replay_tracker.py --synthetic --expect expected_tracks.json
+#
+# Recordings are written by FaceTracker.start_recording (set "tracker_record_dir"
+# in parameter_config.json). Every replay of the same input with the same
+# tracking parameters gives the same track IDs, so --save / --expect can be
+# used to check that a change to the tracker did not change its decisions.
+
+import argparse
+import json
+import sys
+import time
+import numpy as np
+from tracking_manager import FaceTracker
+
+def load_specs(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def make_detection(bbox, embedding=None, label=None):
+    bbox = np.asarray(bbox, dtype=int)
+    detection = {
+        'bbox': bbox,
+        'center': ((bbox[0] + bbox[2]) // 2, (bbox[1] + bbox[3]) // 2),
+        'embedding': None if embedding is None else np.asarray(embedding, dtype=np.float32)
+    }
+    if label is not None:
+        detection['label'] = label
+    return detection
+
+def load_recording(path):
+    """[(t, detections)] from a FaceTracker JSON-lines recording"""
+    frames = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            frames.append((record['t'], [make_detection(d['bbox'], d.get('embedding'), d.get('label'))
+                                         for d in record['detections']]))
+    return frames
+
+def synthetic_frames(people=6, frames=600, fps=10.0, width=1920, height=1080, face_size=110,
+                     embedding_dim=512, embedding_noise=0.35, miss_rate=0.05, absence_rate=0.002, seed=0):
+    """Labelled detections of people walking across a frame (seeded, so always the same)
+
+    Each person moves with a constant velocity that bounces off the frame
+    edges, so paths cross. Embeddings are a fixed identity vector plus noise,
+    single detections are missed with `miss_rate`, and a person occasionally
+    leaves the view for a few seconds (`absence_rate` per frame).
+    """
+    rng = np.random.RandomState(seed)
+    identities = rng.normal(size=(people, embedding_dim)).astype(np.float32)
+    position = rng.uniform([face_size, face_size], [width - face_size, height - face_size], size=(people, 2))
+    velocity = rng.uniform(-120, 120, size=(people, 2)) / fps
+    sizes = face_size * rng.uniform(0.7, 1.3, size=people)
+    absent_until = np.zeros(people)
+
+    result = []
+    for index in range(frames):
+        t = index / fps
+        position += velocity
+        for axis, limit in ((0, width), (1, height)):
+            out = (position[:, axis] < sizes / 2) | (position[:, axis] > limit - sizes / 2)
+            velocity[out, axis] *= -1
+            position[:, axis] = np.clip(position[:, axis], sizes / 2, limit - sizes / 2)
+
+        detections = []
+        for person in range(people):
+            if t < absent_until[person]:
+                continue
+            if rng.rand() < absence_rate:
+                absent_until[person] = t + rng.uniform(1.0, 6.0)
+                continue
+            if rng.rand() < miss_rate:
+                continue
+            jitter = rng.normal(scale=3.0, size=4)
+            half = sizes[person] / 2
+            x, y = position[person]
+            bbox = np.array([x - half, y - half * 1.2, x + half, y + half * 1.2]) + jitter
+            embedding = identities[person] + rng.normal(scale=embedding_noise, size=embedding_dim)
+            detections.append(make_detection(bbox, embedding, label=person))
+        # Detector output order is not tied to identity
+        order = rng.permutation(len(detections))
+        result.append((t, [detections[i] for i in order]))
+    return result
+
+def replay(frames, specs):
+    """Feed every frame through a fresh FaceTracker; returns (track IDs per frame, tracker, seconds)"""
+    tracker = FaceTracker.from_specs(specs)
+    assigned = []
+    elapsed = 0.0
+    for t, detections in frames:
+        start = time.perf_counter()
+        assignments = tracker.update(detections, t)
+        tracker.cleanup(t)
+        elapsed += time.perf_counter() - start
+        # Track ID of every detection, in detection order
+        ids = {id(detection): track.track_id for track, detection, _ in assignments}
+        assigned.append([ids[id(detection)] for detection in detections])
+    return assigned, tracker, elapsed
+
+def identity_metrics(frames, assigned):
+    """ID switches and fragmentation against the ground-truth labels of the detections"""
+    last_track = {}
+    tracks_per_label = {}
+    labels_per_track = {}
+    switches = 0
+    for (_, detections), track_ids in zip(frames, assigned):
+        for detection, track_id in zip(detections, track_ids):
+            label = detection.get('label')
+            if label is None:
+                continue
+            if label in last_track and last_track[label] != track_id:
+                switches += 1
+            last_track[label] = track_id
+            tracks_per_label.setdefault(label, set()).add(track_id)
+            labels_per_track.setdefault(track_id, set()).add(label)
+    if not tracks_per_label:
+        return None
+    return {
+        'identities': len(tracks_per_label),
+        'id_switches': switches,
+        'fragmentation': sum(len(ids) - 1 for ids in tracks_per_label.values()),
+        'merged_tracks': sum(1 for labels in labels_per_track.values() if len(labels) > 1)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay detections through FaceTracker and report track stability")
+    parser.add_argument("recording", nargs="?", help="JSON-lines recording written by FaceTracker.start_recording")
+    parser.add_argument("--synthetic", action="store_true", help="replay seeded synthetic detections with labels")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--people", type=int, default=6)
+    parser.add_argument("--frames", type=int, default=600)
+    parser.add_argument("--fps", type=float, default=10.0)
+    parser.add_argument("--embedding-noise", type=float, default=0.35,
+                        help="noise added to the synthetic identity embeddings (higher = harder re-identification)")
+    parser.add_argument("--no-embeddings", action="store_true", help="drop embeddings (position-only association)")
+    parser.add_argument("--config", default="parameter_config.json", help="tracking parameters (SYSTEM_SPECS keys)")
+    parser.add_argument("--motion-model", choices=["kalman", "smoothing"], default=None,
+                        help="override track_motion_model from the config")
+    parser.add_argument("--save", default=None, help="write the assigned track IDs to this file")
+    parser.add_argument("--expect", default=None, help="compare the assigned track IDs with a file written by --save")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        frames = synthetic_frames(people=args.people, frames=args.frames, fps=args.fps,
+                                  embedding_noise=args.embedding_noise, seed=args.seed)
+    elif args.recording:
+        frames = load_recording(args.recording)
+    else:
+        parser.error("give a recording file or --synthetic")
+    if args.no_embeddings:
+        for _, detections in frames:
+            for detection in detections:
+                detection['embedding'] = None
+
+    specs = load_specs(args.config)
+    if args.motion_model:
+        specs['track_motion_model'] = args.motion_model
+    assigned, tracker, elapsed = replay(frames, specs)
+    detections = sum(len(d) for _, d in frames)
+    stats = tracker.get_stats()
+
+    print(f"[REPLAY] {len(frames)} frames, {detections} detections")
+    print(f"[REPLAY] Tracks created: {stats['created']}, matched: {stats['matched']}, expired: {stats['expired']}")
+    print(f"[REPLAY] Tracker time: {elapsed * 1000.0:.1f} ms total, "
+          f"{elapsed * 1000.0 / max(len(frames), 1):.3f} ms/frame")
+    metrics = identity_metrics(frames, assigned)
+    if metrics:
+        print(f"[REPLAY] Identities: {metrics['identities']}, ID switches: {metrics['id_switches']}, "
+              f"fragmentation: {metrics['fragmentation']}, merged tracks: {metrics['merged_tracks']}")
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'track_ids': assigned, 'metrics': metrics}, f)
+        print(f"[REPLAY] Track IDs saved to {args.save}")
+    if args.expect:
+        with open(args.expect) as f:
+            expected = json.load(f)['track_ids']
+        mismatched = [index for index, (got, want) in enumerate(zip(assigned, expected)) if got != want]
+        if mismatched or len(assigned) != len(expected):
+            first = mismatched[0] if mismatched else min(len(assigned), len(expected))
+            print(f"[ERROR] Track IDs differ from {args.expect} in {len(mismatched)} frame(s), first at frame {first}")
+            sys.exit(1)
+        print(f"[REPLAY] Track IDs match {args.expect}")
+
+if __name__ == "__main__":
+    main()
@@ -13,6 +13,21 @@ class CameraManager {
     this.isStreaming = false;
     this.faceRecognitionActive = false;
     this.socket = null;
+    // Preview transport: 'socketio' (binary JPEG attachments) or 'mjpeg' (multipart HTTP stream)
+    this.transport = 'socketio';
+    this.frameUrl = null;
+    this.frameLoading = false;
+    this.pendingFrame = null;
+    // Preview profile: 'auto' picks the smallest profile that fills the element, or a fixed name
+    this.previewProfile = 'auto';
+    this.previewProfiles = null; // {name: {width, quality}} of the current camera, sent by the server
+    this.activeProfile = null;
+    this.resizeTimer = null;
+    // Boxes and labels are drawn on a canvas over the stream from camera_detections metadata
+    this.overlayCanvas = null;
+    this.showOverlay = true;
+    this.detections = null;
+    this.detectionsReceivedAt = 0;
   }
 
   // Initialize camera manager
@@ -23,14 +38,36 @@ class CameraManager {
     this.loadingSpinner = document.getElementById('loading-spinner');
     this.buttonsContainer = document.getElementById('camera-buttons');
     this.fullscreenToggle = document.getElementById('fullscreen-toggle');
+    this.overlayCanvas = document.getElementById('face-overlay');
 
     if (!this.videoContainer || !this.placeholder || !this.buttonsContainer) {
       Utils.log('Camera manager initialization failed: Required elements not found', 'error');
       return false;
     }
 
+    if (this.streamElement && this.streamElement.dataset.transport) {
+      this.transport = this.streamElement.dataset.transport;
+    }
+    if (this.streamElement && this.streamElement.dataset.profile) {
+      this.previewProfile = this.streamElement.dataset.profile;
+    }
+    if (this.streamElement && this.streamElement.dataset.overlay === 'off') {
+      this.showOverlay = false;
+    }
+    // A larger or smaller view may need another preview profile
+    window.addEventListener('resize', () => {
+      this.drawOverlay();
+      clearTimeout(this.resizeTimer);
+      this.resizeTimer = setTimeout(() => this.updatePreviewProfile(), 300);
+    });
+    // The overlay follows the displayed image (size changes, stale boxes are cleared)
+    if (this.streamElement) {
+      this.streamElement.addEventListener('load', () => this.drawOverlay());
+    }
+
     // Initialize Socket.IO connection for camera streaming
     this.initCameraSocket();
+    this.initFrameDecoding();
     
     // Initialize fullscreen toggle
     this.initFullscreenToggle();
@@ -46,6 +83,10 @@ class CameraManager {
       
       // Listen for camera frames
       this.socket.on('camera_frame', (data) => {
+        // Other streams may be running for other operators; only show the selected camera
+        if (data.rtsp_url && this.currentCamera && data.rtsp_url !== this.currentCamera.rtspUrl) {
+          return;
+        }
         if (this.streamElement) {
           // Handle different types of frame data
           if (data.frame) {
@@ -61,18 +102,43 @@ class CameraManager {
               this.clearCameraError();
               // Show the video stream when we receive a normal frame
               this.showFaceRecognitionStream();
-              // Handle both string and object frame data
               if (typeof data.frame === 'string') {
+                // Legacy base64 frame
                 this.streamElement.src = "data:image/jpeg;base64," + data.frame;
               } else {
-                // If frame is not a string, it might be an object - convert to string
-                this.streamElement.src = "data:image/jpeg;base64," + String(data.frame);
+                // Binary JPEG (ArrayBuffer attachment)
+                this.displayFrame(data.frame);
               }
             }
           }
         }
       });
       
+      // Boxes, labels and frame info of each analysed frame of the selected camera
+      this.socket.on('camera_detections', (data) => {
+        if (!this.currentCamera || data.rtsp_url !== this.currentCamera.rtspUrl) return;
+        this.detections = data;
+        this.detectionsReceivedAt = performance.now();
+        this.drawOverlay();
+      });
+      
+      // Preview profiles of the camera just started, and the one the server picked for us
+      this.socket.on('preview_profiles', (data) => {
+        if (!this.currentCamera || data.rtsp_url !== this.currentCamera.rtspUrl) return;
+        this.previewProfiles = data.profiles;
+        this.activeProfile = data.profile;
+        this.updatePreviewProfile();
+        // The server sends this once the stream is registered, so the MJPEG endpoint is ready now
+        if (this.transport === 'mjpeg' && this.streamElement && !this.streamElement.src.includes('/api/camera/mjpeg')) {
+          this.streamElement.src = this.getPreviewUrl(this.currentCamera, this.activeProfile);
+        }
+      });
+      this.socket.on('preview_profile', (data) => {
+        if (this.currentCamera && data.rtsp_url === this.currentCamera.rtspUrl) {
+          this.activeProfile = data.profile;
+        }
+      });
+      
       // Listen for AI status updates
       this.socket.on('ai_status_update', (data) => {
         if (window.dashboard) {
@@ -85,6 +151,177 @@ class CameraManager {
     }
   }
 
+  // Release Blob URLs once the browser has decoded them, and ask the server for the next frame
+  initFrameDecoding() {
+    if (!this.streamElement) return;
+    const onFrameDone = () => {
+      if (!this.frameLoading) return;
+      this.frameLoading = false;
+      if (this.socket && this.currentCamera) {
+        this.socket.emit('frame_ack', { rtsp_url: this.currentCamera.rtspUrl });
+      }
+      if (this.pendingFrame) {
+        const frame = this.pendingFrame;
+        this.pendingFrame = null;
+        this.displayFrame(frame);
+      }
+    };
+    this.streamElement.addEventListener('load', onFrameDone);
+    this.streamElement.addEventListener('error', onFrameDone);
+  }
+
+  // Show a binary JPEG frame through a Blob URL (no base64 string decoding)
+  displayFrame(frame) {
+    if (!this.streamElement) return;
+    if (this.frameLoading) {
+      // Previous frame is still decoding: keep only the newest one
+      this.pendingFrame = frame;
+      return;
+    }
+    const url = URL.createObjectURL(new Blob([frame], { type: 'image/jpeg' }));
+    this.frameLoading = true;
+    this.streamElement.src = url;
+    if (this.frameUrl) {
+      URL.revokeObjectURL(this.frameUrl);
+    }
+    this.frameUrl = url;
+  }
+
+  // Drop any Blob URL / pending frame of the previous stream
+  releaseFrames() {
+    if (this.frameUrl) {
+      URL.revokeObjectURL(this.frameUrl);
+      this.frameUrl = null;
+    }
+    this.frameLoading = false;
+    this.pendingFrame = null;
+  }
+
+  // Profile that suits the stream element: the fixed choice, or in auto mode the smallest
+  // profile at least as wide as the element in device pixels (fullscreen: the largest)
+  choosePreviewProfile() {
+    if (!this.previewProfiles) return null;
+    if (this.previewProfile !== 'auto') {
+      return this.previewProfiles[this.previewProfile] ? this.previewProfile : null;
+    }
+    // width 0 means camera resolution
+    const widthOf = (name) => this.previewProfiles[name].width || Infinity;
+    const names = Object.keys(this.previewProfiles).sort((a, b) => widthOf(a) - widthOf(b));
+    if (names.length === 0) return null;
+    const element = this.streamElement && this.streamElement.clientWidth ? this.streamElement : this.videoContainer;
+    if (!element || (this.streamElement && this.streamElement.classList.contains('fullscreen'))) {
+      return names[names.length - 1];
+    }
+    const required = element.clientWidth * (window.devicePixelRatio || 1);
+    return names.find(name => widthOf(name) >= required) || names[names.length - 1];
+  }
+
+  // Switch the current stream to the profile choosePreviewProfile() picks, if it changed
+  updatePreviewProfile() {
+    if (!this.currentCamera) return;
+    const profile = this.choosePreviewProfile();
+    if (!profile || profile === this.activeProfile) return;
+    this.activeProfile = profile;
+    console.log(`[CAMERA MANAGER] Preview profile: ${profile}`);
+    if (this.transport === 'mjpeg') {
+      // Reconnect only when the multipart stream is already open; the preview_profiles handler opens it otherwise
+      if (this.streamElement && this.streamElement.src.includes('/api/camera/mjpeg')) {
+        this.streamElement.src = this.getPreviewUrl(this.currentCamera, profile);
+      }
+    } else if (this.socket) {
+      this.socket.emit('set_preview_profile', { rtsp_url: this.currentCamera.rtspUrl, profile: profile });
+    }
+  }
+
+  // Choose a preview profile ('auto', 'thumbnail', 'focus', 'full', ...) for this client
+  setPreviewProfile(profile) {
+    this.previewProfile = profile || 'auto';
+    this.updatePreviewProfile();
+  }
+
+  // MJPEG preview URL of a running camera stream, e.g. getPreviewUrl(camera, 'thumbnail') for a grid tile <img>
+  getPreviewUrl(camera, profile) {
+    let url = `/api/camera/mjpeg?rtsp_url=${encodeURIComponent(camera.rtspUrl)}`;
+    if (profile) {
+      url += `&profile=${encodeURIComponent(profile)}`;
+    }
+    return url;
+  }
+
+  // Draw the latest camera_detections metadata over the stream image
+  drawOverlay() {
+    const canvas = this.overlayCanvas;
+    const image = this.streamElement;
+    if (!canvas || !image) return;
+    const ratio = window.devicePixelRatio || 1;
+    const width = image.clientWidth;
+    const height = image.clientHeight;
+    canvas.style.left = `${image.offsetLeft}px`;
+    canvas.style.top = `${image.offsetTop}px`;
+    canvas.style.width = `${width}px`;
+    canvas.style.height = `${height}px`;
+    if (canvas.width !== Math.round(width * ratio) || canvas.height !== Math.round(height * ratio)) {
+      canvas.width = Math.round(width * ratio);
+      canvas.height = Math.round(height * ratio);
+    }
+    const ctx = canvas.getContext('2d');
+    ctx.setTransform(1, 0, 0, 1, 0, 0);
+    ctx.clearRect(0, 0, canvas.width, canvas.height);
+
+    const data = this.detections;
+    if (!this.showOverlay || !data || !width || image.style.display === 'none') return;
+    // The record stays valid until the next analysis is due at the latest (ttl from the server)
+    const ttlMs = (data.ttl || 3) * 1000;
+    if (performance.now() - this.detectionsReceivedAt > ttlMs) return;
+
+    // Frame pixels -> displayed pixels (any preview profile scale, object-fit contain or cover)
+    const fit = getComputedStyle(image).objectFit === 'cover' ? Math.max : Math.min;
+    const scale = fit(width / data.width, height / data.height);
+    const offsetX = (width - data.width * scale) / 2;
+    const offsetY = (height - data.height * scale) / 2;
+    const toX = (x) => offsetX + x * scale;
+    const toY = (y) => offsetY + y * scale;
+    ctx.setTransform(ratio, 0, 0, ratio, 0, 0);
+    ctx.font = '14px sans-serif';
+    ctx.textBaseline = 'bottom';
+
+    // Regions of interest
+    ctx.lineWidth = 1;
+    ctx.strokeStyle = 'rgb(0, 200, 255)';
+    (data.regions || []).forEach(points => {
+      ctx.beginPath();
+      points.forEach(([x, y], index) => index === 0 ? ctx.moveTo(toX(x), toY(y)) : ctx.lineTo(toX(x), toY(y)));
+      ctx.closePath();
+      ctx.stroke();
+    });
+
+    // Track boxes and labels
+    ctx.lineWidth = 2;
+    data.detections.forEach(detection => {
+      const [x1, y1, x2, y2] = detection.bbox;
+      ctx.strokeStyle = detection.name !== 'Unknown' ? 'rgb(0, 255, 0)' : 'rgb(255, 0, 0)';
+      ctx.strokeRect(toX(x1), toY(y1), (x2 - x1) * scale, (y2 - y1) * scale);
+      const label = detection.recognized
+        ? `${detection.name} (${detection.score.toFixed(2)}) ID:${detection.track_id}`
+        : `Unknown ID:${detection.track_id}`;
+      ctx.fillStyle = detection.recognized ? 'rgb(0, 255, 0)' : 'rgb(255, 0, 0)';
+      ctx.fillText(label, toX(x1), toY(y1) - 4);
+    });
+
+    // Frame info
+    ctx.fillStyle = data.ai_state === 'Error' ? 'rgb(255, 0, 0)' : 'rgb(255, 255, 0)';
+    const info = data.ai_state === 'Error'
+      ? 'AI: Error'
+      : `Faces: ${data.faces} | Tracked: ${data.tracked} | AI: ${data.ai_state}`;
+    ctx.fillText(info, Math.max(toX(0), 0) + 10, Math.max(toY(0), 0) + 24);
+  }
+
+  // Show or hide boxes and labels (the video itself is not affected)
+  setOverlayVisible(visible) {
+    this.showOverlay = visible;
+    this.drawOverlay();
+  }
+
   // Add camera configuration
   addCamera(cameraConfig) {
     const camera = {
@@ -170,6 +407,11 @@ class CameraManager {
       }
     }
 
+    // Leave the previous camera's stream (it keeps running if other viewers watch it)
+    if (this.currentCamera && this.currentCamera !== camera) {
+      this.stopStream();
+    }
+
     // Update camera states
     this.cameras.forEach(cam => cam.isActive = false);
     camera.isActive = true;
@@ -199,10 +441,28 @@ class CameraManager {
       console.log(`[CAMERA MANAGER] Starting stream for camera: ${camera.name} (${camera.rtspUrl})`);
       this.showLoading();
       
+      // Profiles of the new camera arrive with the preview_profiles event
+      this.previewProfiles = null;
+      this.activeProfile = this.previewProfile !== 'auto' ? this.previewProfile : null;
+      
       // Send start stream command to server
       if (this.socket) {
-        this.socket.emit('start_stream', { rtsp_url: camera.rtspUrl });
-        console.log('[CAMERA MANAGER] Start stream command sent to server');
+        this.socket.emit('start_stream', {
+          rtsp_url: camera.rtspUrl,
+          transport: this.transport,
+          profile: this.activeProfile
+        });
+        console.log(`[CAMERA MANAGER] Start stream command sent to server (${this.transport})`);
+      }
+
+      // MJPEG: the browser reads the multipart stream directly, opened on the preview_profiles event
+      if (this.transport === 'mjpeg' && this.streamElement) {
+        this.releaseFrames();
+        this.streamElement.onload = () => {
+          this.streamElement.onload = null;
+          this.clearCameraError();
+          this.showFaceRecognitionStream();
+        };
       }
       
       return true;
@@ -224,6 +484,9 @@ class CameraManager {
     if (this.streamElement) {
       this.streamElement.src = '';
     }
+    this.releaseFrames();
+    this.detections = null;
+    this.drawOverlay();
     
     this.isStreaming = false;
     this.showPlaceholder();
@@ -416,6 +679,9 @@ class CameraManager {
           </svg>
         `;
       }
+      // Fullscreen needs the largest profile, the normal view a smaller one again
+      this.updatePreviewProfile();
+      this.drawOverlay();
     }
   }
 }
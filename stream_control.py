@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# stream_control.py
+# Per-camera pacing of inference and display frames
+
+import time
+from collections import deque
+import cv2
+import numpy as np
+
+class RateMeter:
+    """Achieved event rate over the most recent events"""
+
+    def __init__(self, window=60):
+        self.timestamps = deque(maxlen=window)
+
+    def tick(self, now):
+        self.timestamps.append(now)
+
+    def rate(self, now=None):
+        if len(self.timestamps) < 2:
+            return 0.0
+        now = now if now is not None else time.time()
+        # A stream that stopped producing events decays towards zero
+        span = max(self.timestamps[-1], now - 1.0) - self.timestamps[0]
+        return (len(self.timestamps) - 1) / span if span > 0 else 0.0
+
+class MotionGate:
+    """Cheap motion check run before face detection.
+
+    Each frame is reduced to a small blurred grayscale image and compared with
+    a running-average background; the gate opens when enough pixels changed
+    and stays open for `hold_s` seconds after the last motion. While closed,
+    one frame still passes every `idle_refresh_s` seconds so people standing
+    still are re-detected. `sensitivity` (0..1) sets both the per-pixel change
+    threshold and the fraction of changed pixels needed to count as motion.
+    """
+
+    def __init__(self, sensitivity=0.5, size=(160, 90), hold_s=2.0, idle_refresh_s=10.0, background_alpha=0.05):
+        self.sensitivity = min(max(float(sensitivity), 0.0), 1.0)
+        self.size = tuple(size)
+        self.hold_s = hold_s
+        self.idle_refresh_s = idle_refresh_s
+        self.background_alpha = background_alpha
+        # sensitivity 0 -> 40 grey levels on 2% of the image, 1 -> 8 grey levels on 0.05%
+        self.pixel_threshold = 8 + 32 * (1.0 - self.sensitivity)
+        self.area_threshold = 0.0005 + 0.0195 * (1.0 - self.sensitivity)
+        self._background = None
+        self._last_motion = 0.0
+        self._last_open = 0.0
+        self._changed_fraction = 0.0
+        self.stats = {
+            'frames_checked': 0,
+            'frames_motion': 0,
+            'frames_skipped': 0,
+            'idle_refreshes': 0
+        }
+
+    def _small(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        small = cv2.resize(gray, self.size, interpolation=cv2.INTER_AREA)
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+    def check(self, frame, now=None):
+        """True if detection should run on this frame"""
+        now = now if now is not None else time.time()
+        self.stats['frames_checked'] += 1
+        small = self._small(frame)
+        if self._background is None or self._background.shape != small.shape:
+            self._background = small.astype(np.float32)
+            self._last_motion = now
+        else:
+            diff = cv2.absdiff(small, cv2.convertScaleAbs(self._background))
+            self._changed_fraction = float(np.count_nonzero(diff > self.pixel_threshold)) / diff.size
+            cv2.accumulateWeighted(small, self._background, self.background_alpha)
+            if self._changed_fraction >= self.area_threshold:
+                self._last_motion = now
+                self.stats['frames_motion'] += 1
+
+        if now - self._last_motion < self.hold_s:
+            self._last_open = now
+            return True
+        if now - self._last_open >= self.idle_refresh_s:
+            self._last_open = now
+            self.stats['idle_refreshes'] += 1
+            return True
+        self.stats['frames_skipped'] += 1
+        return False
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats.update({
+            'sensitivity': self.sensitivity,
+            'changed_fraction': self._changed_fraction,
+            'idle': time.time() - self._last_motion >= self.hold_s,
+            'last_motion': self._last_motion
+        })
+        return stats
+
+class FrameRateController:
+    """Decides, frame by frame, whether to run inference and whether to send a preview.
+
+    Inference and display have separate targets. Deadlines are scheduled from
+    the start of the previous event, so processing time counts towards the
+    frame budget instead of being added on top of a fixed sleep. Inference is
+    also skipped while the scene is static (the downscaled frame barely
+    differs from the last analysed one), but at least every
+    `static_refresh_s` seconds so tracks and presence stay fresh. A
+    `motion_gate` (MotionGate), when given, replaces that static-scene check.
+    """
+
+    def __init__(self, inference_fps=10, display_fps=30, static_threshold=2.0, static_refresh_s=2.0,
+                 thumbnail_size=(64, 36), motion_gate=None):
+        self.inference_fps = inference_fps
+        self.display_fps = display_fps
+        self.static_threshold = static_threshold
+        self.static_refresh_s = static_refresh_s
+        self.thumbnail_size = thumbnail_size
+        self.motion_gate = motion_gate
+        self._next_inference = 0.0
+        self._next_display = 0.0
+        self._last_inference = 0.0
+        self._reference_thumbnail = None
+        self._processing_ms = None  # EMA of inference time
+        self.inference_meter = RateMeter()
+        self.display_meter = RateMeter()
+        self.stats = {
+            'frames_seen': 0,
+            'frames_inferred': 0,
+            'frames_displayed': 0,
+            'skipped_rate_limit': 0,
+            'skipped_static': 0,
+            'skipped_no_motion': 0,
+            'skipped_no_viewers': 0
+        }
+
+    @staticmethod
+    def _interval(fps):
+        return 1.0 / fps if fps and fps > 0 else 0.0
+
+    def _advance(self, deadline, now, fps):
+        """Next deadline on a fixed cadence; a late frame does not cause a burst of catch-up frames"""
+        interval = self._interval(fps)
+        base = deadline if deadline else now
+        return max(base + interval, now + interval / 2)
+
+    def _thumbnail(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        return cv2.resize(gray, self.thumbnail_size, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+    def should_infer(self, frame, now=None):
+        """True if this frame should go through detection/recognition"""
+        now = now if now is not None else time.time()
+        self.stats['frames_seen'] += 1
+        if now < self._next_inference:
+            self.stats['skipped_rate_limit'] += 1
+            return False
+
+        if self.motion_gate is not None:
+            if not self.motion_gate.check(frame, now):
+                self.stats['skipped_no_motion'] += 1
+                return False
+        elif self.static_threshold > 0:
+            thumbnail = self._thumbnail(frame)
+            if (self._reference_thumbnail is not None
+                    and now - self._last_inference < self.static_refresh_s
+                    and float(np.mean(np.abs(thumbnail - self._reference_thumbnail))) < self.static_threshold):
+                self.stats['skipped_static'] += 1
+                return False
+            self._reference_thumbnail = thumbnail
+
+        self._last_inference = now
+        # Next deadline counts from this start, so inference time is part of the budget
+        self._next_inference = self._advance(self._next_inference, now, self.inference_fps)
+        return True
+
+    def record_inference(self, started, finished=None):
+        """Report how long one inference pass took"""
+        finished = finished if finished is not None else time.time()
+        elapsed_ms = (finished - started) * 1000.0
+        self._processing_ms = elapsed_ms if self._processing_ms is None else 0.9 * self._processing_ms + 0.1 * elapsed_ms
+        self.stats['frames_inferred'] += 1
+        self.inference_meter.tick(finished)
+
+    def max_inference_gap(self):
+        """Longest time a scene can go without an analysed frame (idle / static refresh plus the rate limit)"""
+        if self.motion_gate is not None:
+            refresh = self.motion_gate.idle_refresh_s
+        else:
+            refresh = self.static_refresh_s if self.static_threshold > 0 else 0.0
+        return refresh + self._interval(self.inference_fps)
+
+    def should_display(self, now=None, viewers=None):
+        """True if this frame should be sent to preview clients (never while `viewers` is 0)"""
+        now = now if now is not None else time.time()
+        if viewers == 0:
+            self.stats['skipped_no_viewers'] += 1
+            return False
+        if now < self._next_display:
+            return False
+        self._next_display = self._advance(self._next_display, now, self.display_fps)
+        self.stats['frames_displayed'] += 1
+        self.display_meter.tick(now)
+        return True
+
+    def get_stats(self):
+        """Achieved vs. target rates and skip counters"""
+        now = time.time()
+        stats = dict(self.stats)
+        stats.update({
+            'inference_fps_target': self.inference_fps,
+            'inference_fps_achieved': self.inference_meter.rate(now),
+            'display_fps_target': self.display_fps,
+            'display_fps_achieved': self.display_meter.rate(now),
+            'avg_processing_ms': self._processing_ms or 0.0,
+            # Highest inference rate the measured processing time allows
+            'inference_fps_capacity': 1000.0 / self._processing_ms if self._processing_ms else 0.0
+        })
+        if self.motion_gate is not None:
+            stats['motion'] = self.motion_gate.get_stats()
+        return stats
@@ -2,10 +2,457 @@
 # tracking_manager.py
 # Tracking manager for the face recognition system
 
+import json
 import time
+from collections import deque
+import cv2
 import numpy as np
 from datetime import datetime
 
+# Optimal assignment untuk asosiasi track-deteksi (fallback ke greedy jika scipy tidak ada)
+try:
+    from scipy.optimize import linear_sum_assignment
+    SCIPY_AVAILABLE = True
+except ImportError:
+    SCIPY_AVAILABLE = False
+    print("[INFO] scipy tidak tersedia, asosiasi track memakai greedy assignment")
+
+# Cost of a pair that fails both gates; never part of an accepted match
+FORBIDDEN_COST = 1e6
+
+def embedding_matrix(embeddings):
+    """Stack embeddings into L2-normalized rows; missing embeddings become zero rows"""
+    dim = next((len(embedding) for embedding in embeddings if embedding is not None), 0)
+    matrix = np.zeros((len(embeddings), dim), dtype=np.float32)
+    for row, embedding in enumerate(embeddings):
+        if embedding is not None:
+            matrix[row] = embedding
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+def associate_detections(track_centers, track_embeddings, face_centers, face_embeddings,
+                         max_distance_threshold=150, embedding_similarity_threshold=0.7):
+    """Assign detections to tracks in one vectorized step (see associate_arrays).
+
+    Takes per-track / per-face centres and raw embeddings (None allowed).
+    Returns (matches, unmatched_tracks, unmatched_faces) where matches is a
+    list of (track_index, face_index, similarity, distance).
+    """
+    return associate_arrays(
+        np.asarray(track_centers, dtype=np.float32).reshape(len(track_centers), 2),
+        embedding_matrix(track_embeddings),
+        np.asarray(face_centers, dtype=np.float32).reshape(len(face_centers), 2),
+        embedding_matrix(face_embeddings),
+        max_distance_threshold, embedding_similarity_threshold
+    )
+
+def associate_arrays(track_xy, track_matrix, face_xy, face_matrix,
+                     max_distance_threshold=150, embedding_similarity_threshold=0.7):
+    """Optimal track/detection assignment from centre arrays and normalized embedding rows.
+
+    Builds the centre-distance and cosine-similarity matrices for all
+    tracks x detections. A pair is allowed when the faces look alike
+    (similarity > embedding_similarity_threshold, at any distance) or are
+    close (distance < max_distance_threshold), the same gates the per-pair
+    loops used. Allowed pairs cost (1 - similarity) + distance / max_distance
+    and the assignment minimising the total cost is chosen (scipy's
+    linear_sum_assignment; lowest-cost-first greedy without scipy).
+    max_distance_threshold may also be an array with one gate radius per track.
+    """
+    n_tracks, n_faces = len(track_xy), len(face_xy)
+    if n_tracks == 0 or n_faces == 0:
+        return [], list(range(n_tracks)), list(range(n_faces))
+    if np.ndim(max_distance_threshold):
+        max_distance_threshold = np.asarray(max_distance_threshold, dtype=np.float32).reshape(n_tracks, 1)
+
+    distance = np.linalg.norm(track_xy[:, None, :] - face_xy[None, :, :], axis=2)
+    if track_matrix.shape[1] and track_matrix.shape[1] == face_matrix.shape[1]:
+        similarity = track_matrix @ face_matrix.T
+    else:
+        similarity = np.zeros((n_tracks, n_faces), dtype=np.float32)
+
+    allowed = (similarity > embedding_similarity_threshold) | (distance < max_distance_threshold)
+    cost = (1.0 - similarity) + distance / max_distance_threshold
+    cost = np.where(allowed, cost, FORBIDDEN_COST)
+
+    if SCIPY_AVAILABLE:
+        rows, cols = linear_sum_assignment(cost)
+        pairs = [(row, col) for row, col in zip(rows, cols) if allowed[row, col]]
+    else:
+        pairs = []
+        used_rows, used_cols = set(), set()
+        for flat in np.argsort(cost, axis=None, kind='stable'):
+            row, col = divmod(int(flat), n_faces)
+            if not allowed[row, col]:
+                break
+            if row in used_rows or col in used_cols:
+                continue
+            pairs.append((row, col))
+            used_rows.add(row)
+            used_cols.add(col)
+
+    matches = [(int(row), int(col), float(similarity[row, col]), float(distance[row, col])) for row, col in pairs]
+    matched_rows = {match[0] for match in matches}
+    matched_cols = {match[1] for match in matches}
+    return (matches,
+            [row for row in range(n_tracks) if row not in matched_rows],
+            [col for col in range(n_faces) if col not in matched_cols])
+
+class ConstantVelocityFilter:
+    """Constant-velocity Kalman filter for the boxes of every track of one camera.
+    
+    A box is handled as (cx, cy, w, h) and each of the four values has its own
+    position/velocity filter. The axes are independent, so each covariance is
+    2x2 and is stored as three arrays (pos-pos, pos-vel, vel-vel). One row per
+    track, and prediction and correction of all tracks are array operations.
+    Noise values are in pixels and seconds: process_noise is the acceleration
+    spectral density (px^2/s^3), measurement_noise the detector jitter (px).
+    A track is extrapolated at most max_predict_s past its last measurement.
+    """
+    
+    def __init__(self, process_noise=2000.0, measurement_noise=4.0, initial_velocity_std=150.0, max_predict_s=1.0):
+        self.process_noise = process_noise
+        self.measurement_var = measurement_noise ** 2
+        self.initial_velocity_var = initial_velocity_std ** 2
+        self.max_predict_s = max_predict_s
+        self.x = np.zeros((0, 4))      # cx, cy, w, h
+        self.v = np.zeros((0, 4))      # their velocities (px/s)
+        self.p_xx = np.zeros((0, 4))
+        self.p_xv = np.zeros((0, 4))
+        self.p_vv = np.zeros((0, 4))
+        self.t = np.zeros(0)           # time the state refers to
+        self.t_measured = np.zeros(0)  # time of the last measurement
+    
+    def __len__(self):
+        return len(self.t)
+    
+    @staticmethod
+    def to_state(boxes):
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        return np.stack([(boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2,
+                         boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1]], axis=1)
+    
+    @staticmethod
+    def to_boxes(state):
+        half = state[:, 2:4] / 2
+        return np.concatenate([state[:, 0:2] - half, state[:, 0:2] + half], axis=1)
+    
+    def add(self, box, now):
+        """Start a filter row at a first measurement (unknown velocity); returns the row"""
+        self.x = np.vstack([self.x, self.to_state(box)])
+        self.v = np.vstack([self.v, np.zeros((1, 4))])
+        self.p_xx = np.vstack([self.p_xx, np.full((1, 4), self.measurement_var)])
+        self.p_xv = np.vstack([self.p_xv, np.zeros((1, 4))])
+        self.p_vv = np.vstack([self.p_vv, np.full((1, 4), self.initial_velocity_var)])
+        self.t = np.append(self.t, now)
+        self.t_measured = np.append(self.t_measured, now)
+        return len(self.t) - 1
+    
+    def keep(self, rows):
+        """Keep only the given rows (in that order)"""
+        for name in ('x', 'v', 'p_xx', 'p_xv', 'p_vv', 't', 't_measured'):
+            setattr(self, name, getattr(self, name)[rows])
+    
+    def _propagate(self, now):
+        limit = np.maximum(self.t_measured + self.max_predict_s - self.t, 0.0)
+        dt = np.minimum(np.maximum(now - self.t, 0.0), limit)[:, None]
+        q = self.process_noise
+        x = self.x + self.v * dt
+        p_xx = self.p_xx + 2 * dt * self.p_xv + dt * dt * self.p_vv + q * dt ** 3 / 3
+        p_xv = self.p_xv + dt * self.p_vv + q * dt ** 2 / 2
+        p_vv = self.p_vv + q * dt
+        return x, p_xx, p_xv, p_vv
+    
+    def predict(self, now):
+        """Advance every row to `now`"""
+        if not len(self.t):
+            return
+        self.x, self.p_xx, self.p_xv, self.p_vv = self._propagate(now)
+        self.t = np.maximum(self.t, now)
+    
+    def predicted_boxes(self, now):
+        """Boxes of every row at `now`, without changing the state"""
+        return self.to_boxes(self._propagate(now)[0])
+    
+    def correct(self, rows, boxes, now):
+        """Fuse measured boxes into the given rows (rows must already be predicted to `now`)"""
+        rows = np.asarray(rows, dtype=int)
+        z = self.to_state(boxes)
+        p_xx, p_xv, p_vv = self.p_xx[rows], self.p_xv[rows], self.p_vv[rows]
+        gain_x = p_xx / (p_xx + self.measurement_var)
+        gain_v = p_xv / (p_xx + self.measurement_var)
+        innovation = z - self.x[rows]
+        self.x[rows] += gain_x * innovation
+        self.v[rows] += gain_v * innovation
+        self.p_xx[rows] = (1 - gain_x) * p_xx
+        self.p_xv[rows] = (1 - gain_x) * p_xv
+        self.p_vv[rows] = p_vv - gain_v * p_xv
+        self.t_measured[rows] = now
+        return self.to_boxes(self.x[rows])
+    
+    def centers(self):
+        return self.x[:, 0:2].astype(np.float32)
+    
+    def gate_radius(self, sigma):
+        """Distance from the predicted centre within which a detection is plausible (sigma std devs)"""
+        return sigma * np.sqrt(self.p_xx[:, 0] + self.p_xx[:, 1] + 2 * self.measurement_var)
+
+class Track:
+    """State of one tracked face (fixed attribute set, no per-instance __dict__)"""
+    
+    __slots__ = ('track_id', 'bbox', 'center', 'last_seen', 'face_obj', 'embedding', 'name', 'score',
+                 'identity_confidence', 'confidence_history', 'hits')
+    
+    def __init__(self, track_id, bbox, center, last_seen, face_obj=None, embedding=None, history_size=30):
+        self.track_id = track_id
+        self.bbox = bbox
+        self.center = center
+        self.last_seen = last_seen
+        self.face_obj = face_obj
+        self.embedding = embedding
+        self.name = "Unknown"
+        self.score = 0.0
+        self.identity_confidence = 0.0
+        self.confidence_history = deque(maxlen=history_size)  # similarity to the previous detection
+        self.hits = 1
+
+class FaceTracker:
+    """Keeps face identities stable across frames for one camera stream.
+    
+    Each update() takes one frame's detections (dicts with 'bbox', 'center',
+    'embedding' and 'face_obj'), assigns them to tracks with
+    associate_arrays, updates the boxes of matched tracks and opens new
+    tracks for the rest. Track centres and normalized embeddings are kept in
+    arrays (one row per track) so association needs no per-frame restacking.
+    Time is always passed in by the caller, which makes replays deterministic.
+    
+    With a motion_filter (ConstantVelocityFilter) tracks are predicted to the
+    frame time before association: detections are compared with the
+    predicted centres, gated by each track's predicted uncertainty
+    (gate_sigma standard deviations, never wider than
+    max_distance_threshold), and the drawn box is the filtered one. Without
+    it boxes are smoothed with the fixed smoothing_factor.
+    """
+    
+    def __init__(self, max_distance_threshold=150, embedding_similarity_threshold=0.7, smoothing_factor=0.85,
+                 tracking_timeout=3.0, history_size=30, motion_filter=None, gate_sigma=4.0):
+        self.max_distance_threshold = max_distance_threshold
+        self.embedding_similarity_threshold = embedding_similarity_threshold
+        self.smoothing_factor = smoothing_factor
+        self.tracking_timeout = tracking_timeout
+        self.history_size = history_size
+        self.motion_filter = motion_filter
+        self.gate_sigma = gate_sigma
+        self.tracks = {}  # {track_id: Track}
+        self.next_track_id = 1
+        self._rows = {}  # {track_id: row in the arrays below}
+        self._centers = np.zeros((0, 2), dtype=np.float32)
+        self._embeddings = np.zeros((0, 0), dtype=np.float32)
+        self._record_file = None
+        self.stats = {
+            'updates': 0,
+            'detections': 0,
+            'matched': 0,
+            'created': 0,
+            'expired': 0
+        }
+    
+    @classmethod
+    def from_specs(cls, specs):
+        """Tracker configured from a SYSTEM_SPECS dict ("track_motion_model": "kalman" or "smoothing")"""
+        motion_filter = None
+        if specs.get('track_motion_model', 'kalman') == 'kalman':
+            motion_filter = ConstantVelocityFilter(
+                process_noise=specs.get('kalman_process_noise', 2000.0),
+                measurement_noise=specs.get('kalman_measurement_noise', 4.0),
+                max_predict_s=specs.get('kalman_max_predict_s', 1.0)
+            )
+        return cls(
+            max_distance_threshold=specs.get('max_distance_threshold', 150),
+            embedding_similarity_threshold=specs.get('embedding_similarity_threshold', 0.7),
+            smoothing_factor=specs.get('bbox_smoothing_factor', 0.85),
+            tracking_timeout=specs.get('tracking_timeout', 3.0),
+            motion_filter=motion_filter,
+            gate_sigma=specs.get('kalman_gate_sigma', 4.0)
+        )
+    
+    def __len__(self):
+        return len(self.tracks)
+    
+    def __contains__(self, track_id):
+        return track_id in self.tracks
+    
+    def __iter__(self):
+        return iter(list(self.tracks.values()))
+    
+    def get(self, track_id):
+        return self.tracks.get(track_id)
+    
+    def boxes(self, now=None):
+        """{track_id: bbox} of every current track; with `now` and a motion filter, predicted to that time"""
+        if now is None or self.motion_filter is None or not self.tracks:
+            return {track_id: track.bbox for track_id, track in self.tracks.items()}
+        predicted = self.motion_filter.predicted_boxes(now).astype(int)
+        return {track_id: predicted[row] for track_id, row in self._rows.items()}
+    
+    def _write_row(self, track):
+        """Copy a track's centre and normalized embedding into its array row"""
+        row = self._rows.get(track.track_id)
+        if row is None:
+            row = len(self._rows)
+            self._rows[track.track_id] = row
+            self._centers = np.vstack([self._centers, np.zeros((1, 2), dtype=np.float32)])
+            self._embeddings = np.vstack([self._embeddings, np.zeros((1, self._embeddings.shape[1]), dtype=np.float32)])
+        self._centers[row] = track.center
+        if track.embedding is not None:
+            embedding = np.asarray(track.embedding, dtype=np.float32).ravel()
+            if self._embeddings.shape[1] != embedding.size:
+                # First embedding seen (or model changed): resize the embedding array
+                self._embeddings = np.zeros((len(self._rows), embedding.size), dtype=np.float32)
+            norm = np.linalg.norm(embedding)
+            self._embeddings[row] = embedding / norm if norm > 0 else 0.0
+        elif self._embeddings.shape[1]:
+            self._embeddings[row] = 0.0
+    
+    def create_track(self, detection, now):
+        """Open a new track for a detection"""
+        track = Track(self.next_track_id, detection['bbox'], detection['center'], now,
+                      detection.get('face_obj'), detection.get('embedding'), self.history_size)
+        self.next_track_id += 1
+        self.tracks[track.track_id] = track
+        self._write_row(track)
+        if self.motion_filter is not None:
+            self.motion_filter.add(detection['bbox'], now)
+        self.stats['created'] += 1
+        return track
+    
+    def _filter_boxes(self, track_ids, boxes, now):
+        """Predict the motion filter to `now` and fuse measured boxes; returns the filtered boxes"""
+        self.motion_filter.predict(now)
+        rows = [self._rows[track_id] for track_id in track_ids]
+        filtered = self.motion_filter.correct(rows, boxes, now).astype(int)
+        self._centers = self.motion_filter.centers()
+        return filtered
+    
+    def update_track(self, track_id, detection, now, similarity=None, bbox=None):
+        """Move an existing track to a matched detection.
+        
+        The new box is the filtered one (motion filter) or the detection
+        smoothed against the previous box; `bbox` passes a box already
+        filtered by update().
+        """
+        track = self.tracks[track_id]
+        if bbox is not None:
+            track.bbox = bbox
+        elif self.motion_filter is not None:
+            track.bbox = self._filter_boxes([track_id], [detection['bbox']], now)[0]
+        else:
+            track.bbox = (self.smoothing_factor * track.bbox + (1 - self.smoothing_factor) * detection['bbox']).astype(int)
+        track.center = ((track.bbox[0] + track.bbox[2]) // 2, (track.bbox[1] + track.bbox[3]) // 2)
+        track.last_seen = now
+        track.face_obj = detection.get('face_obj')
+        track.embedding = detection.get('embedding')
+        track.hits += 1
+        if similarity is not None:
+            track.confidence_history.append(similarity)
+        self._write_row(track)
+        return track
+    
+    def move(self, track_id, bbox, now):
+        """Place a track at a box found without detection (e.g. optical flow)"""
+        track = self.tracks[track_id]
+        if self.motion_filter is not None:
+            bbox = self._filter_boxes([track_id], [bbox], now)[0]
+        track.bbox = bbox
+        track.center = ((bbox[0] + bbox[2]) // 2, (bbox[1] + bbox[3]) // 2)
+        track.last_seen = now
+        self._centers[self._rows[track_id]] = track.center
+        return track
+    
+    def update(self, detections, now=None):
+        """Associate one frame's detections with the tracks.
+        
+        Returns [(track, detection, similarity)] with matched tracks first and
+        then the new tracks (similarity None), each in detection order.
+        """
+        now = now if now is not None else time.time()
+        self.stats['updates'] += 1
+        self.stats['detections'] += len(detections)
+        if self._record_file is not None:
+            self._record(detections, now)
+        
+        track_ids = list(self._rows.keys())
+        gate = self.max_distance_threshold
+        if self.motion_filter is not None and track_ids:
+            # Compare detections with where the tracks should be now
+            self.motion_filter.predict(now)
+            self._centers = self.motion_filter.centers()
+            gate = np.minimum(self.motion_filter.gate_radius(self.gate_sigma), self.max_distance_threshold)
+        face_xy = np.asarray([detection['center'] for detection in detections], dtype=np.float32).reshape(len(detections), 2)
+        matches, _, unmatched = associate_arrays(
+            self._centers, self._embeddings, face_xy,
+            embedding_matrix([detection.get('embedding') for detection in detections]),
+            gate, self.embedding_similarity_threshold
+        )
+        
+        matches = sorted(matches, key=lambda match: match[1])
+        filtered = [None] * len(matches)
+        if self.motion_filter is not None and matches:
+            filtered = self._filter_boxes([track_ids[match[0]] for match in matches],
+                                          [detections[match[1]]['bbox'] for match in matches], now)
+        assignments = []
+        for (track_index, face_index, similarity, _), bbox in zip(matches, filtered):
+            detection = detections[face_index]
+            track = self.update_track(track_ids[track_index], detection, now, similarity, bbox)
+            assignments.append((track, detection, similarity))
+        for face_index in unmatched:
+            detection = detections[face_index]
+            assignments.append((self.create_track(detection, now), detection, None))
+        self.stats['matched'] += len(matches)
+        return assignments
+    
+    def cleanup(self, now=None, timeout=None):
+        """Drop tracks not seen within the timeout; returns the removed track IDs"""
+        now = now if now is not None else time.time()
+        timeout = timeout if timeout is not None else self.tracking_timeout
+        expired = [track_id for track_id, track in self.tracks.items() if now - track.last_seen >= timeout]
+        if expired:
+            for track_id in expired:
+                del self.tracks[track_id]
+            keep = [row for track_id, row in self._rows.items() if track_id in self.tracks]
+            self._centers = self._centers[keep]
+            self._embeddings = self._embeddings[keep]
+            if self.motion_filter is not None:
+                self.motion_filter.keep(keep)
+            self._rows = {track_id: row for row, track_id in enumerate(self.tracks.keys())}
+            self.stats['expired'] += len(expired)
+        return expired
+    
+    def start_recording(self, path):
+        """Append every update's detections to a JSON-lines file (input for replay_tracker.py)"""
+        self._record_file = open(path, 'a')
+    
+    def stop_recording(self):
+        if self._record_file is not None:
+            self._record_file.close()
+            self._record_file = None
+    
+    def _record(self, detections, now):
+        frame = {
+            't': now,
+            'detections': [{
+                'bbox': [int(value) for value in detection['bbox']],
+                'embedding': (None if detection.get('embedding') is None
+                              else [round(float(value), 5) for value in np.ravel(detection['embedding'])])
+            } for detection in detections]
+        }
+        self._record_file.write(json.dumps(frame) + "\n")
+    
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['active_tracks'] = len(self.tracks)
+        return stats
+
 class TrackingManager:
     """Manager for employee tracking and monitoring"""
     
@@ -15,9 +462,12 @@ class TrackingManager:
         self.employee_status = {}  # {employee_name: {'last_seen': timestamp, 'camera': camera_id, 'status': 'present/absent'}}
         self.alerts = []  # List of alert messages
         self.absence_threshold = absence_threshold
-        self.tracked_faces = {}  # {track_id: {'bbox', 'last_seen', 'name', 'embedding', 'confidence_history'}}
-        self.next_track_id = 1
-        self.bbox_history = {}
+        self.tracker = FaceTracker()
+    
+    @property
+    def tracked_faces(self):
+        """{track_id: Track} of the shared FaceTracker"""
+        return self.tracker.tracks
     
     def update_employee_status(self, employee_name, camera_id):
         """Update employee status when detected"""
@@ -120,106 +570,288 @@ class TrackingManager:
     
     def update_tracked_face(self, track_id, bbox, center, face_obj, embedding):
         """Update tracked face information"""
-        current_time = time.time()
-        self.tracked_faces[track_id] = {
-            'bbox': bbox,
-            'center': center,
-            'last_seen': current_time,
-            'face_obj': face_obj,
-            'embedding': embedding,
-            'name': self.tracked_faces.get(track_id, {}).get('name', "Unknown")
-        }
+        detection = {'bbox': bbox, 'center': center, 'face_obj': face_obj, 'embedding': embedding}
+        if track_id in self.tracker:
+            self.tracker.update_track(track_id, detection, time.time())
+        else:
+            self.create_new_track(bbox, center, face_obj, embedding)
     
     def create_new_track(self, bbox, center, face_obj, embedding):
         """Create new face track"""
-        track_id = self.next_track_id
-        self.next_track_id += 1
-        current_time = time.time()
-        
-        self.tracked_faces[track_id] = {
-            'bbox': bbox,
-            'center': center,
-            'last_seen': current_time,
-            'face_obj': face_obj,
-            'embedding': embedding,
-            'name': "Unknown"
-        }
-        
-        return track_id
+        detection = {'bbox': bbox, 'center': center, 'face_obj': face_obj, 'embedding': embedding}
+        return self.tracker.create_track(detection, time.time()).track_id
     
     def cleanup_old_tracks(self, timeout=3.0):
         """Clean up old face tracks"""
-        current_time = time.time()
-        self.tracked_faces = {
-            k: v for k, v in self.tracked_faces.items() 
-            if current_time - v['last_seen'] < timeout
-        }
+        self.tracker.cleanup(time.time(), timeout)
     
     def match_faces(self, current_faces, max_distance_threshold=150, embedding_similarity_threshold=0.7):
         """Match current faces with tracked faces"""
+        self.tracker.max_distance_threshold = max_distance_threshold
+        self.tracker.embedding_similarity_threshold = embedding_similarity_threshold
         matched_tracks = set()
         matched_faces = set()
-        updated_tracks = {}
-        
-        # Match tracked faces with current faces
-        for track_id, track_data in list(self.tracked_faces.items()):
-            if current_faces:
-                # Find closest face for this tracked face
-                min_distance = float('inf')
-                best_match = None
-                best_similarity = 0
-                
-                for face_data in current_faces:
-                    if face_data['index'] in matched_faces:
-                        continue
-                        
-                    # Calculate distance between center points
-                    dx = track_data['center'][0] - face_data['center'][0]
-                    dy = track_data['center'][1] - face_data['center'][1]
-                    distance = (dx * dx + dy * dy) ** 0.5
-                    
-                    # Calculate similarity based on embedding
-                    similarity = self.calculate_embedding_similarity(track_data['embedding'], face_data['embedding'])
-                    
-                    # Use combination of distance and similarity for matching
-                    if similarity > embedding_similarity_threshold:
-                        if distance < min_distance:
-                            min_distance = distance
-                            best_match = face_data
-                            best_similarity = similarity
-                    elif distance < min_distance and distance < max_distance_threshold:
-                        min_distance = distance
-                        best_match = face_data
-                        best_similarity = similarity
-                
-                # If we found a good match
-                if best_match and (best_similarity > embedding_similarity_threshold or min_distance < max_distance_threshold):
-                    matched_tracks.add(track_id)
-                    matched_faces.add(best_match['index'])
-                    
-                    # Update tracked face with new data
-                    updated_tracks[track_id] = {
-                        'bbox': best_match['bbox'],
-                        'center': best_match['center'],
-                        'last_seen': time.time(),
-                        'face_obj': best_match['face_obj'],
-                        'embedding': best_match['embedding'],
-                        'name': track_data.get('name', "Unknown")
-                    }
-        
-        # Add new faces that weren't matched
-        for face_data in current_faces:
-            if face_data['index'] not in matched_faces:
-                track_id = self.create_new_track(
-                    face_data['bbox'],
-                    face_data['center'],
-                    face_data['face_obj'],
-                    face_data['embedding']
-                )
-                updated_tracks[track_id] = self.tracked_faces[track_id]
-        
-        self.tracked_faces = updated_tracks
+        for track, face_data, similarity in self.tracker.update(current_faces, time.time()):
+            if similarity is not None:
+                matched_tracks.add(track.track_id)
+                matched_faces.add(face_data['index'])
         return matched_tracks, matched_faces
 
+class OpticalFlowTracker:
+    """Moves face boxes between keyframes with pyramidal Lucas-Kanade optical flow.
+    
+    On a keyframe, corner features are picked inside every tracked box. On
+    the following frames the features are followed forward (and checked
+    backward), and each box is shifted and scaled by the median motion of
+    its surviving points. No detection or embedding model runs.
+    """
+    
+    def __init__(self, max_points=40, min_points=4, fb_threshold=1.5, min_quality=0.5):
+        self.max_points = max_points          # fitur per kotak wajah
+        self.min_points = min_points          # di bawah ini track dianggap hilang
+        self.fb_threshold = fb_threshold      # batas error forward-backward (piksel)
+        self.min_quality = min_quality        # rasio titik yang bertahan, di bawah ini track hilang
+        self.lk_params = dict(winSize=(21, 21), maxLevel=3,
+                              criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03))
+        self.prev_gray = None
+        self.tracks = {}  # {track_id: {'bbox': np.array, 'points': (n, 1, 2) float32}}
+        self.stats = {
+            'keyframes': 0,
+            'tracked_frames': 0,
+            'tracks_lost': 0
+        }
+    
+    def _select_points(self, gray, bbox):
+        height, width = gray.shape[:2]
+        x1, y1 = max(0, int(bbox[0])), max(0, int(bbox[1]))
+        x2, y2 = min(width, int(bbox[2])), min(height, int(bbox[3]))
+        if x2 - x1 < 8 or y2 - y1 < 8:
+            return None
+        points = cv2.goodFeaturesToTrack(gray[y1:y2, x1:x2], maxCorners=self.max_points,
+                                         qualityLevel=0.01, minDistance=3)
+        if points is None or len(points) < self.min_points:
+            return None
+        points[:, 0, 0] += x1
+        points[:, 0, 1] += y1
+        return points.astype(np.float32)
+    
+    def reset(self, gray, boxes):
+        """Start tracking from a keyframe; boxes is {track_id: bbox}"""
+        self.prev_gray = gray
+        self.tracks = {}
+        for track_id, bbox in boxes.items():
+            points = self._select_points(gray, bbox)
+            if points is not None:
+                self.tracks[track_id] = {'bbox': np.asarray(bbox, dtype=np.float32), 'points': points}
+        self.stats['keyframes'] += 1
+    
+    def update(self, gray):
+        """Propagate every box to this frame.
+        
+        Returns {track_id: (bbox, quality)} where quality is the fraction of
+        points that survived; lost tracks get quality 0 and keep their box.
+        """
+        results = {}
+        if self.prev_gray is None or not self.tracks:
+            self.prev_gray = gray
+            return results
+        self.stats['tracked_frames'] += 1
+        
+        track_ids = list(self.tracks.keys())
+        counts = [len(self.tracks[track_id]['points']) for track_id in track_ids]
+        previous = np.concatenate([self.tracks[track_id]['points'] for track_id in track_ids])
+        
+        # One LK call for all boxes, forward then backward
+        current, status, _ = cv2.calcOpticalFlowPyrLK(self.prev_gray, gray, previous, None, **self.lk_params)
+        back, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, self.prev_gray, current, None, **self.lk_params)
+        fb_error = np.linalg.norm((previous - back).reshape(-1, 2), axis=1)
+        good = (status.ravel() == 1) & (back_status.ravel() == 1) & (fb_error < self.fb_threshold)
+        
+        offset = 0
+        for track_id, count in zip(track_ids, counts):
+            track = self.tracks[track_id]
+            track_good = good[offset:offset + count]
+            old_points = previous[offset:offset + count][track_good].reshape(-1, 2)
+            new_points = current[offset:offset + count][track_good].reshape(-1, 2)
+            offset += count
+            
+            quality = len(new_points) / float(count)
+            if len(new_points) < self.min_points or quality < self.min_quality:
+                self.stats['tracks_lost'] += 1
+                results[track_id] = (track['bbox'].astype(int), 0.0)
+                del self.tracks[track_id]
+                continue
+            
+            # Median translation, and scale from the spread of the points around their centre
+            shift = np.median(new_points - old_points, axis=0)
+            old_spread = np.linalg.norm(old_points - old_points.mean(axis=0), axis=1)
+            new_spread = np.linalg.norm(new_points - new_points.mean(axis=0), axis=1)
+            valid = old_spread > 1e-3
+            scale = float(np.median(new_spread[valid] / old_spread[valid])) if np.any(valid) else 1.0
+            scale = min(max(scale, 0.8), 1.25)
+            
+            x1, y1, x2, y2 = track['bbox']
+            cx, cy = (x1 + x2) / 2.0 + shift[0], (y1 + y2) / 2.0 + shift[1]
+            half_w, half_h = (x2 - x1) * scale / 2.0, (y2 - y1) * scale / 2.0
+            track['bbox'] = np.array([cx - half_w, cy - half_h, cx + half_w, cy + half_h], dtype=np.float32)
+            track['points'] = new_points.reshape(-1, 1, 2).astype(np.float32)
+            results[track_id] = (track['bbox'].astype(int), quality)
+        
+        self.prev_gray = gray
+        return results
+    
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['active_tracks'] = len(self.tracks)
+        return stats
+
+def bbox_iou(box_a, box_b):
+    """Intersection over union of two [x1, y1, x2, y2] boxes"""
+    x1, y1 = max(box_a[0], box_b[0]), max(box_a[1], box_b[1])
+    x2, y2 = min(box_a[2], box_b[2]), min(box_a[3], box_b[3])
+    intersection = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (box_a[2] - box_a[0]) * (box_a[3] - box_a[1]) + (box_b[2] - box_b[0]) * (box_b[3] - box_b[1]) - intersection
+    return float(intersection / union) if union > 0 else 0.0
+
+class IdentityCache:
+    """Per-track identity locks so confirmed tracks skip embedding and gallery lookup.
+    
+    A track whose recognized name stays the same over `lock_after`
+    consecutive embeddings is locked. While locked, a detection overlapping
+    its box (IoU >= `match_iou`) with an unchanged appearance reuses the
+    track's identity instead of being embedded. The lock is re-verified with
+    a real embedding every `reverify_interval` seconds, or sooner when the
+    face crop's appearance signature changes by more than
+    `appearance_threshold`.
+    """
+    
+    def __init__(self, lock_after=5, reverify_interval=10.0, match_iou=0.5, appearance_threshold=0.5,
+                 recognition_threshold=0.5):
+        self.lock_after = lock_after
+        self.reverify_interval = reverify_interval
+        self.match_iou = match_iou
+        self.appearance_threshold = appearance_threshold
+        self.recognition_threshold = recognition_threshold
+        self.tracks = {}  # {track_id: identity state}
+        self.stats = {
+            'embeds_run': 0,
+            'embeds_skipped': 0,
+            'locks_acquired': 0,
+            'reverifications': 0,
+            'locks_broken': 0
+        }
+    
+    @staticmethod
+    def appearance_signature(frame, bbox, size=16):
+        """Tiny normalized grey thumbnail of a face crop"""
+        height, width = frame.shape[:2]
+        x1, y1 = max(0, int(bbox[0])), max(0, int(bbox[1]))
+        x2, y2 = min(width, int(bbox[2])), min(height, int(bbox[3]))
+        if x2 - x1 < 2 or y2 - y1 < 2:
+            return None
+        crop = frame[y1:y2, x1:x2]
+        if crop.ndim == 3:
+            crop = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+        thumbnail = cv2.resize(crop, (size, size), interpolation=cv2.INTER_AREA).astype(np.float32)
+        return (thumbnail - thumbnail.mean()) / (thumbnail.std() + 1e-6)
+    
+    def _state(self, track_id):
+        return self.tracks.setdefault(track_id, {
+            'name': "Unknown",
+            'score': 0.0,
+            'streak': 0,
+            'locked': False,
+            'verified_at': 0.0,
+            'appearance': None,
+            'embeds': 0,
+            'embed_skipped': 0
+        })
+    
+    def select(self, frame, faces, track_boxes, now=None):
+        """Decide which detected faces need an embedding.
+        
+        `track_boxes` is {track_id: bbox} of the current tracks. Faces that
+        reuse a locked identity get face.locked_track_id set; returns one
+        boolean per face (True = embed). Every face also gets its
+        face.appearance_signature, for update() after recognition.
+        """
+        now = now if now is not None else time.time()
+        claimed = set()
+        mask = []
+        for face in faces:
+            face.locked_track_id = None
+            face.appearance_signature = self.appearance_signature(frame, face.bbox)
+            best_track, best_iou = None, self.match_iou
+            for track_id, bbox in track_boxes.items():
+                state = self.tracks.get(track_id)
+                if (track_id in claimed or state is None or not state['locked']
+                        or now - state['verified_at'] >= self.reverify_interval):
+                    continue
+                iou = bbox_iou(face.bbox, bbox)
+                if iou >= best_iou:
+                    best_track, best_iou = track_id, iou
+            
+            if best_track is not None:
+                state = self.tracks[best_track]
+                signature = face.appearance_signature
+                changed = (signature is None or state['appearance'] is None
+                           or float(np.mean(np.abs(signature - state['appearance']))) > self.appearance_threshold)
+                if not changed:
+                    face.locked_track_id = best_track
+                    claimed.add(best_track)
+                    state['embed_skipped'] += 1
+                    self.stats['embeds_skipped'] += 1
+                    mask.append(False)
+                    continue
+            self.stats['embeds_run'] += 1
+            mask.append(True)
+        return mask
+    
+    def update(self, track_id, name, score, appearance=None, now=None):
+        """Record a fresh recognition result (from a real embedding) for a track"""
+        now = now if now is not None else time.time()
+        state = self._state(track_id)
+        state['embeds'] += 1
+        confident = name != "Unknown" and score > self.recognition_threshold
+        
+        if state['locked']:
+            if confident and name == state['name']:
+                self.stats['reverifications'] += 1
+                state['verified_at'] = now
+                state['appearance'] = appearance
+            else:
+                self.stats['locks_broken'] += 1
+                state['locked'] = False
+        
+        state['streak'] = state['streak'] + 1 if confident and name == state['name'] else (1 if confident else 0)
+        state['name'] = name
+        state['score'] = score
+        
+        if not state['locked'] and state['streak'] >= self.lock_after:
+            state['locked'] = True
+            state['verified_at'] = now
+            state['appearance'] = appearance
+            self.stats['locks_acquired'] += 1
+    
+    def retain(self, track_ids):
+        """Forget the state of tracks that no longer exist"""
+        for track_id in list(self.tracks.keys()):
+            if track_id not in track_ids:
+                del self.tracks[track_id]
+    
+    def get_stats(self):
+        """Totals plus per-track lock state and embed-skipped counters"""
+        stats = dict(self.stats)
+        stats['tracks'] = {
+            track_id: {
+                'name': state['name'],
+                'locked': state['locked'],
+                'embeds': state['embeds'],
+                'embed_skipped': state['embed_skipped']
+            }
+            for track_id, state in list(self.tracks.items())
+        }
+        return stats
+
 # Global instance
 tracking_manager = TrackingManager()
\ No newline at end of file